@@ -0,0 +1,209 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+
+class AdmissionRejected(Exception):
+    """A request turned away instead of queued; carries the HTTP status and Retry-After to answer with."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: Optional[float] = None):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    def headers(self) -> Dict[str, str]:
+        return {"Retry-After": str(max(1, math.ceil(self.retry_after)))} if self.retry_after is not None else {}
+
+
+class Ticket:
+    """Capacity held by one admitted request until it is released."""
+
+    __slots__ = ("lane", "rows", "started_at", "released")
+
+    def __init__(self, lane: str, rows: int):
+        self.lane = lane
+        self.rows = rows
+        self.started_at = time.perf_counter()
+        self.released = False
+
+
+class _Waiter:
+    __slots__ = ("rows", "future", "enqueued_at")
+
+    def __init__(self, rows: int, future: asyncio.Future):
+        self.rows = rows
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class AdmissionController:
+    """
+    Bounds the rows being scored at once and decides, on arrival, whether a request is served,
+    queued or rejected.
+
+    Requests of at most `interactive_max_rows` rows go to the interactive lane, larger ones to
+    the bulk lane. Scoring starts while the rows in flight stay within `max_inflight_rows`;
+    bulk requests stop at `bulk_max_inflight_rows`, so the difference is always left to
+    interactive requests, and queued interactive requests start before any queued bulk one.
+
+    A request that has to queue is rejected straight away when its estimated wait, the rows
+    ahead of it divided by the recent scoring rate, is over its lane's maximum wait. One still
+    queued when that wait runs out is rejected too. Interactive rejections are 503s (the
+    service is overloaded) and bulk rejections 429s (back off and retry), both with
+    Retry-After. Requests over `max_request_rows` are rejected with 413.
+
+    Not thread-safe: it is only used from the event loop.
+    """
+
+    def __init__(
+        self,
+        max_request_rows: int,
+        max_inflight_rows: int,
+        bulk_max_inflight_rows: int,
+        interactive_max_rows: int,
+        interactive_max_wait: float,
+        bulk_max_wait: float,
+        queue_gauge=None,
+        inflight_gauge=None,
+        shed_counter=None,
+        wait_histogram=None,
+        smoothing: float = 0.2
+    ):
+        self.max_request_rows = max_request_rows
+        self.interactive_max_rows = interactive_max_rows
+        self.limits = {INTERACTIVE: max(1, max_inflight_rows), BULK: max(1, min(bulk_max_inflight_rows, max_inflight_rows))}
+        self.max_waits = {INTERACTIVE: interactive_max_wait, BULK: bulk_max_wait}
+        self.shed_counter = shed_counter
+        self.wait_histogram = wait_histogram
+        self.smoothing = smoothing
+
+        self._queues: Dict[str, Deque[_Waiter]] = {lane: deque() for lane in LANES}
+        self._queued_rows = {lane: 0 for lane in LANES}
+        self._inflight_rows = 0
+        # Moving averages of scoring time and rows per request; their ratio is the time per row
+        self._avg_seconds: Optional[float] = None
+        self._avg_rows: Optional[float] = None
+
+        if queue_gauge is not None:
+            for lane in LANES:
+                queue_gauge.labels(lane=lane).set_function(lambda lane=lane: len(self._queues[lane]))
+        if inflight_gauge is not None:
+            inflight_gauge.set_function(lambda: self._inflight_rows)
+
+    def lane(self, rows: int) -> str:
+        return INTERACTIVE if rows <= self.interactive_max_rows else BULK
+
+    def seconds_per_row(self) -> Optional[float]:
+        if self._avg_seconds is None or not self._avg_rows:
+            return None
+        return self._avg_seconds / self._avg_rows
+
+    def estimated_wait(self, lane: str, rows: int) -> float:
+        """Seconds until `rows` more rows would fit in `lane`, from the rows in flight and queued ahead."""
+        ahead = self._queued_rows[INTERACTIVE] + (self._queued_rows[BULK] if lane == BULK else 0)
+        backlog = self._inflight_rows + ahead + rows - self.limits[lane]
+        per_row = self.seconds_per_row()
+        if backlog <= 0 or per_row is None:
+            return 0.0
+        return backlog * per_row
+
+    async def acquire(self, rows: int, lane: Optional[str] = None, deadline: bool = True) -> Ticket:
+        """
+        Waits until `rows` rows may be scored and returns the ticket to `release` afterwards.
+        Raises AdmissionRejected instead of waiting past the lane's maximum wait; with
+        `deadline=False` (later chunks of a stream already under way) it waits as long as it takes.
+        """
+        lane = lane or self.lane(rows)
+        if self.max_request_rows > 0 and rows > self.max_request_rows:
+            self._shed(lane, "too_large")
+            raise AdmissionRejected(413, f"Batches are limited to {self.max_request_rows} rows; send larger ones to /predict/bulk.")
+
+        ahead_queued = self._queues[INTERACTIVE] or (lane == BULK and self._queues[BULK])
+        if not ahead_queued and self._fits(lane, rows):
+            return self._start(lane, rows, 0.0)
+
+        max_wait = self.max_waits[lane] if deadline else None
+        estimate = self.estimated_wait(lane, rows)
+        if max_wait is not None and estimate > max_wait:
+            self._shed(lane, "queue_time")
+            raise self._rejection(lane, f"Estimated queue time {estimate:.2f}s is over the {max_wait:g}s limit.", estimate)
+
+        waiter = _Waiter(rows, asyncio.get_running_loop().create_future())
+        self._queues[lane].append(waiter)
+        self._queued_rows[lane] += rows
+        try:
+            done, _ = await asyncio.wait({waiter.future}, timeout=max_wait)
+        except asyncio.CancelledError:
+            # The client went away while queued
+            self._abandon(lane, waiter)
+            raise
+        if not done:
+            self._abandon(lane, waiter)
+            self._shed(lane, "timeout")
+            raise self._rejection(lane, f"Waited {max_wait:g}s in the queue without being scored.", max_wait)
+        return waiter.future.result()
+
+    def release(self, ticket: Ticket, observe: bool = True):
+        """
+        Frees a ticket's rows and starts whatever queued requests now fit. `observe` feeds its
+        scoring time into the rate estimate; streamed responses pass False since their time
+        includes the client reading them. Releasing a ticket again does nothing.
+        """
+        if ticket.released:
+            return
+        ticket.released = True
+        self._inflight_rows -= ticket.rows
+        if observe and ticket.rows > 0:
+            elapsed = time.perf_counter() - ticket.started_at
+            if self._avg_seconds is None:
+                self._avg_seconds, self._avg_rows = elapsed, float(ticket.rows)
+            else:
+                self._avg_seconds += self.smoothing * (elapsed - self._avg_seconds)
+                self._avg_rows += self.smoothing * (ticket.rows - self._avg_rows)
+        self._dispatch()
+
+    def _fits(self, lane: str, rows: int) -> bool:
+        # A request larger than its lane's limit still runs once nothing else is in flight
+        return self._inflight_rows == 0 or self._inflight_rows + rows <= self.limits[lane]
+
+    def _start(self, lane: str, rows: int, waited: float) -> Ticket:
+        self._inflight_rows += rows
+        if self.wait_histogram is not None:
+            self.wait_histogram.labels(lane=lane).observe(waited)
+        return Ticket(lane, rows)
+
+    def _dispatch(self):
+        for lane in LANES:
+            queue = self._queues[lane]
+            while queue and self._fits(lane, queue[0].rows):
+                waiter = queue.popleft()
+                self._queued_rows[lane] -= waiter.rows
+                waiter.future.set_result(self._start(lane, waiter.rows, time.perf_counter() - waiter.enqueued_at))
+            if queue:
+                # Bulk requests wait while any interactive request is queued
+                return
+
+    def _abandon(self, lane: str, waiter: _Waiter):
+        if waiter.future.done():
+            # Admitted at the same moment it gave up
+            self.release(waiter.future.result(), observe=False)
+            return
+        waiter.future.cancel()
+        self._queues[lane].remove(waiter)
+        self._queued_rows[lane] -= waiter.rows
+        # It may have been holding up the requests behind it
+        self._dispatch()
+
+    def _shed(self, lane: str, reason: str):
+        if self.shed_counter is not None:
+            self.shed_counter.labels(lane=lane, reason=reason).inc()
+
+    def _rejection(self, lane: str, detail: str, retry_after: float) -> AdmissionRejected:
+        return AdmissionRejected(503 if lane == INTERACTIVE else 429, detail, retry_after)
@@ -1,20 +1,41 @@
 import os
+import sys
+import asyncio
+import dataclasses
+import hashlib
+import hmac
 import logging
+import threading
 import pickle
 import json
-import mlflow
-import pandas as pd
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
-from typing import List, Dict, Any
-from sklearn.preprocessing import StandardScaler
-
-from mlflow.exceptions import MlflowException
-from mlflow.tracking import MlflowClient
+import tempfile
+import time
+import numpy as np
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, TypeAdapter, ValidationError
+from typing import Callable, List, Dict, Any, Optional, Tuple
+
 from fastapi.concurrency import run_in_threadpool
 from prometheus_fastapi_instrumentator import Instrumentator
 from prometheus_client import Counter, Gauge, Histogram
 
+from admission import BULK, AdmissionController, AdmissionRejected, Ticket
+from artifact_cache import ArtifactCache, content_hash
+from batching import MicroBatcher
+from compiled_model import COMPILED_BACKENDS, compile_model, sklearn_estimator
+from drift import DRIFT_PROFILE_ARTIFACT, DriftMonitor, build_reference_profile, read_dataset_columns
+from fast_json import columnar_json, float_array_json, ndjson_records
+from inference_pool import DEFAULT_START_METHOD, InferencePool, NativeModel, export_native_model, read_bundle, read_bundle_metadata
+from metrics import observe_batch
+from model_bundle import ModelBundle, warmup_batch
+from model_store import ModelStore
+from prediction_cache import PredictionCache, RedisCacheBackend
+from preprocessing import CompiledPreprocessor, build_preprocessor, input_field_groups
+from profiler import SamplingProfiler
+from traffic_split import ShadowScorer, batch_rows, canary_row_mask, model_label, take_rows
+
 # --- Basic Setup ---
 logging.basicConfig(
     level=logging.INFO,
@@ -49,6 +70,14 @@ class CarFeatures(BaseModel):
     citympg: int
     highwaympg: int
 
+# Column layout expected from bulk uploads (same as CarPrice_Assignment.csv)
+BULK_NUMERIC_COLUMNS = [name for name, field in CarFeatures.model_fields.items() if field.annotation in (int, float)]
+BULK_STRING_COLUMNS = [name for name, field in CarFeatures.model_fields.items() if field.annotation is str]
+BULK_INTEGER_COLUMNS = [name for name, field in CarFeatures.model_fields.items() if field.annotation is int]
+
+# Validates a /predict body straight from JSON bytes
+car_batch_adapter = TypeAdapter(List[CarFeatures])
+
 # --- FastAPI App Initialization ---
 app = FastAPI(
     title="Car Price Predictor API",
@@ -73,236 +102,1361 @@ prediction_value_histogram = Histogram(
     "ml_prediction_price_usd",
     "Distribution of predicted car prices in USD."
 )
+microbatch_size_histogram = Histogram(
+    "ml_microbatch_size_rows",
+    "Number of rows per micro-batched inference call.",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+)
+microbatch_queue_wait_histogram = Histogram(
+    "ml_microbatch_queue_wait_seconds",
+    "Time a request waits in the micro-batching queue before inference starts.",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+microbatch_queue_depth_gauge = Gauge(
+    "ml_microbatch_queue_depth",
+    "Number of requests waiting in the micro-batching queue."
+)
+inference_stage_histogram = Histogram(
+    "ml_inference_stage_seconds",
+    "Time spent in each stage of serving predictions: parse, preprocess, predict, explain and serialize.",
+    ["stage"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+# Resolve the label children once instead of on every request
+parse_stage_histogram = inference_stage_histogram.labels(stage="parse")
+preprocess_stage_histogram = inference_stage_histogram.labels(stage="preprocess")
+predict_stage_histogram = inference_stage_histogram.labels(stage="predict")
+serialize_stage_histogram = inference_stage_histogram.labels(stage="serialize")
+explain_stage_histogram = inference_stage_histogram.labels(stage="explain")
+# Times the stages above; while a /debug/profile session runs it also samples their stacks
+profiler = SamplingProfiler()
+prediction_cache_hits_total = Counter(
+    "ml_prediction_cache_hits_total",
+    "Rows answered from the prediction cache."
+)
+prediction_cache_misses_total = Counter(
+    "ml_prediction_cache_misses_total",
+    "Rows that missed the prediction cache."
+)
+prediction_cache_evictions_total = Counter(
+    "ml_prediction_cache_evictions_total",
+    "Entries evicted from the in-process prediction cache."
+)
+feature_drift_psi_gauge = Gauge(
+    "ml_feature_drift_psi",
+    "Population stability index of each input feature in the current window against the model's reference profile.",
+    ["feature"]
+)
+feature_drift_ks_gauge = Gauge(
+    "ml_feature_drift_ks",
+    "Kolmogorov-Smirnov statistic of each numeric input feature in the current window against the reference profile.",
+    ["feature"]
+)
+prediction_drift_psi_gauge = Gauge(
+    "ml_prediction_drift_psi",
+    "Population stability index of predicted prices in the current window against the reference profile."
+)
+prediction_drift_ks_gauge = Gauge(
+    "ml_prediction_drift_ks",
+    "Kolmogorov-Smirnov statistic of predicted prices in the current window against the reference profile."
+)
+drift_window_rows_gauge = Gauge(
+    "ml_drift_window_rows",
+    "Rows in the current drift monitoring window."
+)
+drift_dropped_batches_total = Counter(
+    "ml_drift_dropped_batches_total",
+    "Served batches left out of drift monitoring because its queue was full."
+)
+prediction_log_rows_total = Counter(
+    "ml_prediction_log_rows_total",
+    "Served rows written to the prediction log."
+)
+prediction_log_dropped_rows_total = Counter(
+    "ml_prediction_log_dropped_rows_total",
+    "Served rows left out of the prediction log because its buffer was full or a write failed."
+)
+prediction_log_buffered_rows_gauge = Gauge(
+    "ml_prediction_log_buffered_rows",
+    "Rows waiting in the prediction log buffer."
+)
+model_store_bundles_gauge = Gauge(
+    "ml_model_store_bundles",
+    "Named model bundles resident in memory besides the default model."
+)
+model_inference_histogram = Histogram(
+    "ml_model_inference_seconds",
+    "Time to score one served batch, per model and its role: primary (default model), canary, shadow or selected.",
+    ["model", "role"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+model_rows_total = Counter(
+    "ml_model_rows_total",
+    "Rows scored per model and its role: primary (default model), canary, shadow or selected.",
+    ["model", "role"]
+)
+shadow_delta_histogram = Histogram(
+    "ml_shadow_prediction_delta_usd",
+    "Absolute difference between the shadow model's prediction and the price served, per row.",
+    ["model"],
+    buckets=(10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 25000)
+)
+shadow_relative_delta_histogram = Histogram(
+    "ml_shadow_prediction_relative_delta",
+    "Absolute difference between the shadow model's prediction and the price served, relative to the price served.",
+    ["model"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+shadow_shed_rows_total = Counter(
+    "ml_shadow_shed_rows_total",
+    "Rows left unscored by the shadow model: queue_full, stale (waited too long), unavailable (not loaded) or error.",
+    ["reason"]
+)
+shadow_queue_gauge = Gauge(
+    "ml_shadow_queue_batches",
+    "Served batches waiting to be scored by the shadow model."
+)
+admission_queue_gauge = Gauge(
+    "ml_admission_queue_requests",
+    "Requests waiting for admission, per lane: interactive or bulk.",
+    ["lane"]
+)
+admission_inflight_rows_gauge = Gauge(
+    "ml_admission_inflight_rows",
+    "Rows admitted and being scored."
+)
+admission_shed_total = Counter(
+    "ml_admission_shed_requests_total",
+    "Requests rejected by admission control, per lane and reason: too_large, queue_time (estimated wait over the limit) or timeout.",
+    ["lane", "reason"]
+)
+admission_wait_histogram = Histogram(
+    "ml_admission_queue_wait_seconds",
+    "Time an admitted request waited for capacity, per lane.",
+    ["lane"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
 
 # --- MLflow Configuration ---
 MLFLOW_TRACKING_URI = os.getenv("MLFLOW_TRACKING_URI") # Default to local
-mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
 
 # Optional: Set credentials if using a remote artifact store like S3
 os.environ['AWS_ACCESS_KEY_ID'] = os.getenv("AWS_ACCESS_KEY_ID", "")
 os.environ['AWS_SECRET_ACCESS_KEY'] = os.getenv("AWS_SECRET_ACCESS_KEY", "")
 os.environ['MLFLOW_S3_ENDPOINT_URL'] = os.getenv("MLFLOW_S3_ENDPOINT_URL", "")
 
-MODEL_NAME = "xgboost_regressor"
-MODEL_STAGE = "prod"
+# The default model, served when a request doesn't select one
+MODEL_NAME = os.getenv("MODEL_NAME", "xgboost_regressor")
+MODEL_STAGE = os.getenv("MODEL_STAGE", "prod")
 
-# Global variables to hold the loaded model and its artifacts
-model = None
-scaler = None
-model_features = None
-model_mae = None
-target_encoder = None  
-ordinal_encoder = None 
+# --- Multi-model Configuration ---
+# Other registered models that requests may select with ?model=<name>&alias=<alias>, as
+# comma-separated name@alias pairs ("*" allows any). They are loaded on first use.
+SERVED_MODELS = [entry.strip() for entry in os.getenv("SERVED_MODELS", "").split(",") if entry.strip()]
+# Named bundles kept in memory besides the default model, least recently used evicted first
+MODEL_STORE_MAX_BUNDLES = int(os.getenv("MODEL_STORE_MAX_BUNDLES", "4"))
+# How often a resident named model checks whether its alias moved
+MODEL_STORE_REFRESH_SECONDS = float(os.getenv("MODEL_STORE_REFRESH_SECONDS", "60"))
 
-# --- Model Loading on Startup ---
-@app.on_event("startup")
-def load_model_and_artifacts():
-    """
-    Loads the model, scaler, and feature list from the MLflow Model Registry.
-    This function is executed when the FastAPI application starts.
-    """
-    global model, scaler, model_features, model_mae, target_encoder, ordinal_encoder
+# --- Traffic Splitting Configuration (opt-in) ---
+# name@alias answering CANARY_PERCENT of the default model's rows, e.g. xgboost_regressor@challenger
+CANARY_MODEL = os.getenv("CANARY_MODEL") or None
+CANARY_PERCENT = float(os.getenv("CANARY_PERCENT", "0"))
+# name@alias scoring a copy of every default-model batch off the response path
+SHADOW_MODEL = os.getenv("SHADOW_MODEL") or None
+SHADOW_WORKERS = int(os.getenv("SHADOW_WORKERS", "1"))
+# Shadow work beyond these bounds is shed rather than queued
+SHADOW_QUEUE_SIZE = int(os.getenv("SHADOW_QUEUE_SIZE", "64"))
+SHADOW_MAX_QUEUE_SECONDS = float(os.getenv("SHADOW_MAX_QUEUE_SECONDS", "5"))
+
+# --- Artifact Cache Configuration ---
+ARTIFACT_CACHE_DIR = os.getenv("ARTIFACT_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "car-price-api"))
+ARTIFACT_CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+# --- Inference Backend Configuration ---
+# native (XGBoost booster, or pyfunc), onnx (ONNX Runtime) or treelite (compiled shared library)
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "native").lower()
+# Converted models, reused across restarts when kept on a volume. The dot keeps the artifact
+# cache from taking the directory for a cached run and evicting it.
+COMPILED_MODEL_DIR = os.getenv("COMPILED_MODEL_DIR") or os.path.join(ARTIFACT_CACHE_DIR, ".compiled")
+COMPILED_MODEL_THREADS = int(os.getenv("COMPILED_MODEL_THREADS", "1"))
+# A compiled model is only used if it matches the loaded model within these tolerances (USD)
+COMPILED_MODEL_RTOL = float(os.getenv("COMPILED_MODEL_RTOL", "1e-5"))
+COMPILED_MODEL_ATOL = float(os.getenv("COMPILED_MODEL_ATOL", "0.05"))
+
+# --- Admission Control Configuration (opt-in: it rejects /predict batches over the row cap with 413) ---
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "false").lower() == "true"
+# Larger /predict batches are rejected with 413 (0 disables the limit); /predict/bulk is for those
+ADMISSION_MAX_REQUEST_ROWS = int(os.getenv("ADMISSION_MAX_REQUEST_ROWS", "10000"))
+ADMISSION_MAX_INFLIGHT_ROWS = int(os.getenv("ADMISSION_MAX_INFLIGHT_ROWS", "20000"))
+# Bulk requests use at most this much of the in-flight rows; the rest is kept for interactive ones
+ADMISSION_BULK_MAX_INFLIGHT_ROWS = int(os.getenv("ADMISSION_BULK_MAX_INFLIGHT_ROWS", "15000"))
+# Requests with at most this many rows (such as the single car from car-prediction-form) are interactive
+ADMISSION_INTERACTIVE_MAX_ROWS = int(os.getenv("ADMISSION_INTERACTIVE_MAX_ROWS", "10"))
+ADMISSION_INTERACTIVE_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_INTERACTIVE_MAX_WAIT_SECONDS", "0.5"))
+ADMISSION_BULK_MAX_WAIT_SECONDS = float(os.getenv("ADMISSION_BULK_MAX_WAIT_SECONDS", "10"))
+
+# --- Micro-batching Configuration (opt-in) ---
+MICROBATCH_ENABLED = os.getenv("MICROBATCH_ENABLED", "false").lower() == "true"
+MICROBATCH_MAX_SIZE = int(os.getenv("MICROBATCH_MAX_SIZE", "256"))
+MICROBATCH_MAX_WAIT_MS = float(os.getenv("MICROBATCH_MAX_WAIT_MS", "5"))
+MICROBATCH_MAX_CONCURRENCY = int(os.getenv("MICROBATCH_MAX_CONCURRENCY", "1"))
+
+# --- Process-pool Inference Configuration (0 keeps inference in the API process) ---
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", "0"))
+INFERENCE_BUNDLE_DIR = os.getenv("INFERENCE_BUNDLE_DIR") or None
+# fork (default on Linux) shares the loaded model with the workers; spawn gives each its own copy
+INFERENCE_POOL_START_METHOD = os.getenv("INFERENCE_POOL_START_METHOD") or DEFAULT_START_METHOD
+
+# --- Explanation Configuration ---
+# Explanations run in chunks of this many rows, at most EXPLAIN_MAX_CONCURRENCY at a time,
+# so they never occupy every inference worker and plain predictions keep flowing
+EXPLAIN_CHUNK_ROWS = int(os.getenv("EXPLAIN_CHUNK_ROWS", "256"))
+EXPLAIN_MAX_CONCURRENCY = int(os.getenv("EXPLAIN_MAX_CONCURRENCY", "1"))
+
+# --- Response Format Configuration ---
+# Rows scored and written per NDJSON chunk of a streamed /predict response
+PREDICT_STREAM_CHUNK_ROWS = int(os.getenv("PREDICT_STREAM_CHUNK_ROWS", "5000"))
+
+# --- Bulk Scoring Configuration ---
+BULK_CHUNK_ROWS = int(os.getenv("BULK_CHUNK_ROWS", "10000"))
+# Uploads larger than this are spooled to disk instead of memory
+BULK_SPOOL_MAX_MEMORY_BYTES = int(os.getenv("BULK_SPOOL_MAX_MEMORY_BYTES", str(32 * 1024 ** 2)))
+
+# --- Prediction Cache Configuration (opt-in) ---
+PREDICTION_CACHE_ENABLED = os.getenv("PREDICTION_CACHE_ENABLED", "false").lower() == "true"
+PREDICTION_CACHE_MAX_ENTRIES = int(os.getenv("PREDICTION_CACHE_MAX_ENTRIES", "100000"))
+PREDICTION_CACHE_TTL_SECONDS = float(os.getenv("PREDICTION_CACHE_TTL_SECONDS", "3600"))
+# Optional shared tier, e.g. redis://localhost:6379/0
+PREDICTION_CACHE_REDIS_URL = os.getenv("PREDICTION_CACHE_REDIS_URL") or None
+
+# --- Drift Monitoring Configuration ---
+DRIFT_MONITOR_ENABLED = os.getenv("DRIFT_MONITOR_ENABLED", "true").lower() == "true"
+# Used to build the reference profile when the model has no drift_reference.json artifact
+DRIFT_REFERENCE_DATASET = os.getenv("DRIFT_REFERENCE_DATASET", os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CarPrice_Assignment.csv"))
+DRIFT_BINS = int(os.getenv("DRIFT_BINS", "10"))
+DRIFT_WINDOW_ROWS = int(os.getenv("DRIFT_WINDOW_ROWS", "10000"))
+DRIFT_MIN_ROWS = int(os.getenv("DRIFT_MIN_ROWS", "500"))
+DRIFT_QUEUE_SIZE = int(os.getenv("DRIFT_QUEUE_SIZE", "1000"))
+
+# --- Prediction Logging Configuration (opt-in, needs pyarrow) ---
+PREDICTION_LOG_ENABLED = os.getenv("PREDICTION_LOG_ENABLED", "false").lower() == "true"
+PREDICTION_LOG_DIR = os.getenv("PREDICTION_LOG_DIR", os.path.join(os.path.expanduser("~"), "car-price-predictions"))
+# Fraction of served batches that are logged
+PREDICTION_LOG_SAMPLE_RATE = float(os.getenv("PREDICTION_LOG_SAMPLE_RATE", "1.0"))
+PREDICTION_LOG_BUFFER_ROWS = int(os.getenv("PREDICTION_LOG_BUFFER_ROWS", "100000"))
+PREDICTION_LOG_FLUSH_ROWS = int(os.getenv("PREDICTION_LOG_FLUSH_ROWS", "10000"))
+PREDICTION_LOG_FLUSH_SECONDS = float(os.getenv("PREDICTION_LOG_FLUSH_SECONDS", "5"))
+PREDICTION_LOG_FILE_MAX_BYTES = int(os.getenv("PREDICTION_LOG_FILE_MAX_BYTES", str(128 * 1024 ** 2)))
+PREDICTION_LOG_FILE_MAX_SECONDS = float(os.getenv("PREDICTION_LOG_FILE_MAX_SECONDS", "900"))
+
+# --- Profiling Configuration (/debug/profile only exists when a token is set) ---
+DEBUG_PROFILE_TOKEN = os.getenv("DEBUG_PROFILE_TOKEN") or None
+DEBUG_PROFILE_MAX_SECONDS = float(os.getenv("DEBUG_PROFILE_MAX_SECONDS", "60"))
+
+# --- Local Model Configuration ---
+# Serve artifacts from a local directory (car_price_model/, scaler.sav, model_features.json,
+# target_encoder.sav, ordinal_encoder.sav) instead of the registry, e.g. for benchmarks
+LOCAL_MODEL_DIR = os.getenv("LOCAL_MODEL_DIR") or None
+
+# --- Slim Serving Configuration ---
+# Serve a bundle file written by export_bundle.py (native booster + detached preprocessor),
+# so neither mlflow, scikit-learn nor pandas is imported. Reloads re-read the file.
+SERVING_BUNDLE_PATH = os.getenv("SERVING_BUNDLE_PATH") or None
+
+# --- Model Watcher Configuration (0 disables polling the registry alias) ---
+MODEL_WATCH_INTERVAL_SECONDS = float(os.getenv("MODEL_WATCH_INTERVAL_SECONDS", "0"))
+
+# The model bundle currently being served. Replaced in a single assignment on reload.
+current_bundle: Optional[ModelBundle] = None
+
+# Serializes reloads triggered by startup, /refresh-model and the alias watcher
+_reload_lock = threading.Lock()
+
+# Local cache of registry artifacts, shared by restarts when ARTIFACT_CACHE_DIR is on a volume
+artifact_cache = ArtifactCache(ARTIFACT_CACHE_DIR, ARTIFACT_CACHE_MAX_BYTES)
+
+# Worker processes that share the loaded model copy-on-write (see INFERENCE_POOL_START_METHOD)
+inference_pool = InferencePool(INFERENCE_WORKERS, INFERENCE_BUNDLE_DIR, INFERENCE_POOL_START_METHOD) if INFERENCE_WORKERS > 0 else None
+
+# Limits the explanation chunks running at once (in the pool or in-process)
+explain_semaphore = threading.BoundedSemaphore(max(1, EXPLAIN_MAX_CONCURRENCY))
+
+# Cache of predictions keyed by preprocessed feature rows, namespaced by run_id
+prediction_cache = PredictionCache(
+    PREDICTION_CACHE_MAX_ENTRIES,
+    PREDICTION_CACHE_TTL_SECONDS,
+    shared_backend=RedisCacheBackend(PREDICTION_CACHE_REDIS_URL, PREDICTION_CACHE_TTL_SECONDS) if PREDICTION_CACHE_REDIS_URL else None,
+    hits_counter=prediction_cache_hits_total,
+    misses_counter=prediction_cache_misses_total,
+    evictions_counter=prediction_cache_evictions_total
+) if PREDICTION_CACHE_ENABLED else None
+
+# Compares served traffic with the model's reference profile on a background thread
+drift_monitor = DriftMonitor(
+    DRIFT_WINDOW_ROWS,
+    DRIFT_MIN_ROWS,
+    DRIFT_QUEUE_SIZE,
+    feature_psi_gauge=feature_drift_psi_gauge,
+    feature_ks_gauge=feature_drift_ks_gauge,
+    prediction_psi_gauge=prediction_drift_psi_gauge,
+    prediction_ks_gauge=prediction_drift_ks_gauge,
+    window_rows_gauge=drift_window_rows_gauge,
+    dropped_counter=drift_dropped_batches_total
+) if DRIFT_MONITOR_ENABLED else None
+
+def create_prediction_logger():
+    """Starts the Parquet prediction log, or returns None when pyarrow isn't installed."""
+    try:
+        from prediction_log import PredictionLogger
+    except ImportError:
+        # pyarrow is left out of the slim serving image
+        logging.warning("Prediction logging needs pyarrow, which this deployment doesn't install; it is disabled.")
+        return None
+
+    logging.info(f"Logging served predictions to {PREDICTION_LOG_DIR} (sample rate {PREDICTION_LOG_SAMPLE_RATE}).")
+    return PredictionLogger(
+        PREDICTION_LOG_DIR,
+        BULK_NUMERIC_COLUMNS,
+        BULK_STRING_COLUMNS,
+        sample_rate=PREDICTION_LOG_SAMPLE_RATE,
+        max_buffered_rows=PREDICTION_LOG_BUFFER_ROWS,
+        flush_rows=PREDICTION_LOG_FLUSH_ROWS,
+        flush_seconds=PREDICTION_LOG_FLUSH_SECONDS,
+        max_file_bytes=PREDICTION_LOG_FILE_MAX_BYTES,
+        max_file_seconds=PREDICTION_LOG_FILE_MAX_SECONDS,
+        logged_counter=prediction_log_rows_total,
+        dropped_counter=prediction_log_dropped_rows_total,
+        buffered_gauge=prediction_log_buffered_rows_gauge
+    )
 
-    client = MlflowClient()
+# Served features and predictions, written to Parquet by a background thread
+prediction_logger = create_prediction_logger() if PREDICTION_LOG_ENABLED else None
 
-    model_version_details = client.get_model_version_by_alias(MODEL_NAME, MODEL_STAGE)
+# --- Model Loading ---
+# MLflow is imported on the registry path only, so slim serving never loads it
+def mlflow_client():
+    """Imports MLflow on first use and returns a client for the configured tracking server."""
+    import mlflow
+    from mlflow.tracking import MlflowClient
+
+    mlflow.set_tracking_uri(MLFLOW_TRACKING_URI)
+    return MlflowClient()
+
+def is_registry_error(e: Exception) -> bool:
+    """True for MLflow errors (missing model, alias or artifacts), without importing MLflow."""
+    mlflow_exceptions = sys.modules.get("mlflow.exceptions")
+    return mlflow_exceptions is not None and isinstance(e, mlflow_exceptions.MlflowException)
+
+# Artifacts every served run must provide
+BUNDLE_ARTIFACTS = ["car_price_model", "scaler.sav", "model_features.json", "target_encoder.sav", "ordinal_encoder.sav"]
+# The ones that determine preprocessing
+PREPROCESSING_ARTIFACTS = ["scaler.sav", "model_features.json", "target_encoder.sav", "ordinal_encoder.sav"]
+
+def load_bundle(client: "MlflowClient", run_id: str) -> ModelBundle:
+    """
+    Loads the model, scaler, and feature list of a registry run into a new bundle
+    and warms it up with a dummy batch. The bundle being served is left untouched.
+    """
    # model_source_uri = model_version_details.source.split('models:/')[1]
    # model_path = f's3://mlflow/1/models/{model_source_uri}/artifacts'
-    model_path = f's3://mlflow/1/{model_version_details.run_id}/artifacts/car_price_model'
+    import mlflow.artifacts
+
+    model_path = f's3://mlflow/1/{run_id}/artifacts/car_price_model'
     logging.info(f"Attempting to load model and artifacts from URI: {model_path}")
 
+    # Fetch the model and its run artifacts through the local cache, downloading any misses concurrently
+    local_paths = artifact_cache.fetch(run_id, {
+        "car_price_model": lambda dst: mlflow.artifacts.download_artifacts(artifact_uri=model_path, dst_path=dst),
+        "scaler.sav": lambda dst: client.download_artifacts(run_id, "scaler.sav", dst),
+        "model_features.json": lambda dst: client.download_artifacts(run_id, "model_features.json", dst),
+        "target_encoder.sav": lambda dst: client.download_artifacts(run_id, "target_encoder.sav", dst),
+        "ordinal_encoder.sav": lambda dst: client.download_artifacts(run_id, "ordinal_encoder.sav", dst),
+    })
+
+    run_data = client.get_run(run_id).data
+    model_mae = run_data.metrics.get("mae", 0.0)
+    logging.info(f"Registered model MAE: {model_mae:.2f}")
+
+    return build_bundle(local_paths, run_id, model_mae, download_drift_profile(client, run_id))
+
+def download_drift_profile(client: "MlflowClient", run_id: str) -> Optional[Dict[str, Any]]:
+    """Returns the reference profile logged with the run, or None if it has none."""
+    if drift_monitor is None:
+        return None
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        try:
+            path = client.download_artifacts(run_id, DRIFT_PROFILE_ARTIFACT, tmp_dir)
+            with open(path, "r") as f:
+                return json.load(f)
+        except Exception as e:
+            # Older runs don't log one; the profile is then built from DRIFT_REFERENCE_DATASET
+            logging.info(f"Run {run_id} has no usable {DRIFT_PROFILE_ARTIFACT}: {e}")
+            return None
+
+def load_local_bundle(model_dir: str) -> ModelBundle:
+    """Loads a bundle from a local artifact directory laid out like a registry run."""
+    local_paths = {name: os.path.join(model_dir, name) for name in BUNDLE_ARTIFACTS}
+    missing = [name for name, path in local_paths.items() if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"{model_dir} is missing artifacts: {missing}")
+
+    mae = 0.0
+    metrics_path = os.path.join(model_dir, "metrics.json")
+    if os.path.exists(metrics_path):
+        with open(metrics_path, "r") as f:
+            mae = float(json.load(f).get("mae", 0.0))
+
+    drift_profile = None
+    drift_profile_path = os.path.join(model_dir, DRIFT_PROFILE_ARTIFACT)
+    if os.path.exists(drift_profile_path):
+        with open(drift_profile_path, "r") as f:
+            drift_profile = json.load(f)
+
+    # The content hash stands in for a run_id so caches still key on the exact model
+    run_id = f"local-{content_hash(model_dir)[:16]}"
+    logging.info(f"Loading local model artifacts from {model_dir} as {run_id}")
+    return build_bundle(local_paths, run_id, mae, drift_profile)
+
+def build_bundle(local_paths: Dict[str, str], run_id: str, model_mae: float, drift_profile: Optional[Dict[str, Any]] = None) -> ModelBundle:
+    """Builds and warms up a bundle from local artifact paths."""
+    import mlflow.pyfunc
+
+    model = mlflow.pyfunc.load_model(local_paths["car_price_model"])
+    logging.info("Model loaded successfully.")
+    logging.info(f"Associated Run ID: {run_id}")
+
+    with open(local_paths["scaler.sav"], "rb") as f:
+        scaler = pickle.load(f)
+    with open(local_paths["model_features.json"], "r") as f:
+        model_features = json.load(f)
+    with open(local_paths["target_encoder.sav"], "rb") as f:
+        target_encoder = pickle.load(f)
+    with open(local_paths["ordinal_encoder.sav"], "rb") as f:
+        ordinal_encoder = pickle.load(f)
+
+    logging.info("Scaler and model features loaded successfully.")
+
+    # Compile the preprocessing pipeline once for this model's artifacts
+    preprocessor = build_preprocessor(scaler, model_features, target_encoder, ordinal_encoder, model)
+    logging.info(f"Preprocessing pipeline ready (compiled={preprocessor.compiled}).")
+
+    # Serve the native booster directly when it predicts exactly like the pyfunc model
+    native_model = export_native_model(model, preprocessor)
+    compiled_model = compile_served_model(model, native_model, preprocessor)
+
+    # Runs with identical preprocessing artifacts produce identical preprocessed batches
+    preprocessing_digest = hashlib.sha256()
+    for name in PREPROCESSING_ARTIFACTS:
+        preprocessing_digest.update(content_hash(local_paths[name]).encode())
+
+    return prepare_bundle(ModelBundle(
+        model=model,
+        scaler=scaler,
+        model_features=model_features,
+        target_encoder=target_encoder,
+        ordinal_encoder=ordinal_encoder,
+        preprocessor=preprocessor,
+        mae=model_mae,
+        run_id=run_id,
+        native_model=native_model,
+        compiled_model=compiled_model,
+        preprocessing_key=preprocessing_digest.hexdigest()
+    ), drift_profile)
+
+def load_exported_bundle(path: str) -> ModelBundle:
+    """Loads a bundle file written by export_bundle.py, without MLflow, scikit-learn or pandas."""
+    booster, preprocessor, iteration_end = read_bundle(path)
+    metadata = read_bundle_metadata(path)
+    run_id = metadata.get("run_id") or f"bundle-{content_hash(path)[:16]}"
+    logging.info(f"Loaded exported bundle {path} for run {run_id} (compiled={preprocessor.compiled}).")
+    native_model = NativeModel(booster, iteration_end)
+
+    return prepare_bundle(ModelBundle(
+        model=None,
+        scaler=None,
+        model_features=preprocessor.model_features,
+        target_encoder=None,
+        ordinal_encoder=None,
+        preprocessor=preprocessor,
+        mae=float(metadata.get("mae", 0.0)),
+        run_id=run_id,
+        native_model=native_model,
+        compiled_model=compile_served_model(None, native_model, preprocessor),
+        preprocessing_key=hashlib.sha256(pickle.dumps(preprocessor)).hexdigest()
+    ), metadata.get("drift_profile"))
+
+def compile_served_model(model, native_model: Optional[NativeModel], preprocessor: CompiledPreprocessor):
+    """
+    Converts the model for INFERENCE_BACKEND and returns it if its predictions match the
+    pyfunc model's (the native booster's for exported bundles) within COMPILED_MODEL_RTOL and
+    COMPILED_MODEL_ATOL. Returns None, keeping the native or pyfunc path, if the backend isn't
+    selected or installed, the model can't be converted or its predictions differ.
+    """
+    if INFERENCE_BACKEND not in COMPILED_BACKENDS:
+        return None
+
+    fallback = "the native booster" if native_model is not None else "pyfunc"
+    if native_model is not None:
+        booster = native_model.booster
+        # Converters take every tree, so cut the booster at the iteration its predict stops at
+        estimator = booster[:native_model.iteration_end] if native_model.iteration_end else booster
+    else:
+        estimator = sklearn_estimator(model)
+        if estimator is None:
+            logging.warning(f"The {INFERENCE_BACKEND} backend supports XGBoost and scikit-learn models; serving through {fallback}.")
+            return None
+
     try:
-        model = mlflow.pyfunc.load_model(model_path)
-        logging.info(f"Model '{MODEL_NAME}@{MODEL_STAGE}' loaded successfully.")
-
-        model_version_details = client.get_model_version_by_alias(MODEL_NAME, MODEL_STAGE)
-        run_id = model_version_details.run_id
-        logging.info(f"Associated Run ID: {run_id}")
-
-        # Download artifacts associated with the model's run
-        scaler_path = client.download_artifacts(run_id, "scaler.sav")
-        features_path = client.download_artifacts(run_id, "model_features.json")
-        target_encoder_path = client.download_artifacts(run_id, "target_encoder.sav")
-        ordinal_encoder_path = client.download_artifacts(run_id, "ordinal_encoder.sav")
-
-        with open(scaler_path, "rb") as f:
-            scaler = pickle.load(f)
-        with open(features_path, "r") as f:
-            model_features = json.load(f)
-        with open(target_encoder_path, "rb") as f:
-            target_encoder = pickle.load(f) 
-        with open(ordinal_encoder_path, "rb") as f:
-            ordinal_encoder = pickle.load(f)
-
-        logging.info("Scaler and model features loaded successfully.")
-
-        run_data = client.get_run(run_id).data
-        model_mae = run_data.metrics.get("mae", 0.0)
-        logging.info(f"Registered model MAE: {model_mae:.2f}")
-
-        model_performance_gauge.set(model_mae)
-
-    except MlflowException as e:
-        logging.warning(f"Model or artifacts not found in MLflow. API will run without a model. Error: {e}")
-        model, scaler, model_features, model_mae = None, None, None, 0.0
-        model_performance_gauge.set(0.0)
+        compiled_model = compile_model(estimator, len(preprocessor.model_features), INFERENCE_BACKEND, COMPILED_MODEL_DIR, COMPILED_MODEL_THREADS)
+    except ImportError as e:
+        logging.warning(f"The {INFERENCE_BACKEND} backend isn't installed ({e}); serving through {fallback}.")
+        return None
     except Exception as e:
-        logging.error(f"An unexpected error occurred while loading the model. Error: {e}", exc_info=True)
-        model, scaler, model_features, model_mae = None, None, None, 0.0
-        model_performance_gauge.set(0.0)
+        logging.warning(f"Could not convert the model for the {INFERENCE_BACKEND} backend; serving through {fallback}. Error: {e}")
+        return None
 
-# --- Data Preprocessing for Batch Input ---
-def preprocess_batch_data(input_df: pd.DataFrame, scaler: StandardScaler, model_features: list, target_encoder, ordinal_encoder) -> pd.DataFrame:
-    """Preprocesses a DataFrame of raw car features for prediction."""
-    
-    # 1. Drop columns not used in training
-    cols_to_drop = ['car_ID','symboling','carlength', 'carwidth', 'enginesize', 'curbweight', 'highwaympg']
-    df = input_df.drop(columns=cols_to_drop, errors='ignore')
-
-    # 2. Feature Engineering: Extract car brand
-    if 'CarName' in df.columns:
-        df['carbrand'] = df['CarName'].apply(lambda x: x.split(' ')[0])
-        df['cartype'] = df['CarName'].apply(lambda x: ' '.join(x.split(' ')[1:]) if len(x.split(' ')) > 1 else 'unknown')
-        df = df.drop(columns=['CarName'])
-
-    # 3. One-Hot Encode categorical features
-    target_encoded_features = ['cartype', 'carbrand']  
-    ordinal_features = ['fueltype', 'aspiration', 'doornumber', 'carbody', 'drivewheel', 'enginelocation', 'cylindernumber', 'fuelsystem', 'enginetype']
-    numerical_features = ['wheelbase', 'carheight', 'horsepower', 'peakrpm', 'citympg']
-    #cols_to_encode = [col for col in categorical_cols if col in df.columns]
-    #df_encoded = pd.get_dummies(df, columns=cols_to_encode, drop_first=True)
-
-# intersect with present columns
-    target_encoded_features = [c for c in target_encoded_features if c in df.columns]
-    ordinal_features = [c for c in ordinal_features if c in df.columns]
-    numerical_features = [c for c in numerical_features if c in df.columns]
-
-    # 4. Handle missing values
-    # For numerical: simple impute with median (safe default for batch predict)
-    for col in numerical_features:
-        df[col] = pd.to_numeric(df[col], errors='coerce')
-        df[col] = df[col].fillna(df[col].median())
-
-    # For categorical: fillna with 'missing'
-    categorical_cols = list(set(target_encoded_features + ordinal_features))
-    for col in categorical_cols:
-        df[col] = df[col].fillna('missing').astype(str).str.lower()
-
-    # 5. Apply encoders if provided, else fall back to one-hot encoding
-    encoded_df = df.copy()
-
-    # If target/ordinal encoders are provided, transform them (they must be pre-fit)
+    # Random rows in the scaled feature space plus a real car cover both split directions
+    probe = np.concatenate([
+        np.random.default_rng(0).normal(size=(256, len(preprocessor.model_features))).astype(np.float32),
+        preprocessor.transform(warmup_batch())
+    ])
+    if model is not None:
+        expected = np.asarray(model.predict(preprocessor.to_frame(probe)), dtype=np.float64).ravel()
+    else:
+        expected = np.asarray(native_model.predict(probe), dtype=np.float64)
+    actual = np.asarray(compiled_model.predict(probe), dtype=np.float64)
+    if actual.shape != expected.shape or not np.allclose(expected, actual, rtol=COMPILED_MODEL_RTOL, atol=COMPILED_MODEL_ATOL):
+        max_error = float(np.max(np.abs(expected - actual))) if actual.shape == expected.shape else float("nan")
+        logging.warning(f"{INFERENCE_BACKEND} predictions differ from the model's (max error {max_error:.4f}); serving through {fallback}.")
+        return None
+
+    logging.info(f"Serving through the {INFERENCE_BACKEND} backend ({compiled_model.size_bytes:,} bytes).")
+    return compiled_model
+
+def prepare_bundle(bundle: ModelBundle, drift_profile: Optional[Dict[str, Any]] = None) -> ModelBundle:
+    """
+    Publishes a new bundle to the inference workers and warms it up before it takes traffic.
+    `drift_profile` is the model's reference profile; without one it is built from DRIFT_REFERENCE_DATASET.
+    """
+    # A compiled model is served in-process: ONNX Runtime and Treelite release the GIL while predicting
+    if inference_pool is not None and bundle.native_model is not None and bundle.compiled_model is None:
+        bundle = dataclasses.replace(bundle, pool_bundle_path=inference_pool.publish(bundle.native_model, bundle.preprocessor))
+
+    # Warm up so the first real requests don't pay for it
+    warmup = warmup_batch()
     try:
-        if target_encoder is not None and len(target_encoded_features) > 0:
-            encoded_df[target_encoded_features] = target_encoder.transform(encoded_df[target_encoded_features])
+        results = run_inference(bundle, warmup)
+        if len(results) != len(warmup["CarName"]):
+            raise ValueError("warm-up batch returned the wrong number of predictions")
     except Exception:
-        # fallback: leave the original columns for one-hot below
-        pass
+        if inference_pool is not None:
+            inference_pool.retire(bundle.pool_bundle_path)
+        raise
+
+    if drift_monitor is not None:
+        bundle = dataclasses.replace(bundle, drift_profile=drift_profile or build_drift_profile(bundle))
+    return bundle
 
+def build_drift_profile(bundle: ModelBundle) -> Optional[Dict[str, Any]]:
+    """Profiles DRIFT_REFERENCE_DATASET and the bundle's predictions on it. None disables drift monitoring for the bundle."""
+    if not os.path.exists(DRIFT_REFERENCE_DATASET):
+        logging.warning(f"No drift reference for run {bundle.run_id}: {DRIFT_REFERENCE_DATASET} doesn't exist.")
+        return None
     try:
-        if ordinal_encoder is not None and len(ordinal_features) > 0:
-            encoded_df[ordinal_features] = ordinal_encoder.transform(encoded_df[ordinal_features])
-    except Exception:
-        # fallback: leave the original columns for one-hot below
-        pass
-
-    # Decide which columns remain categorical (those not transformed numerically by provided encoders)
-    # If encoders were used and produced numeric columns, they are already numeric in encoded_df.
-    # We'll one-hot encode any remaining object/dtype 'category' columns among categorical_cols.
-    cols_for_ohe = [c for c in categorical_cols if encoded_df[c].dtype == object or encoded_df[c].dtype.name == 'category']
-    if len(cols_for_ohe) > 0:
-        encoded_df = pd.get_dummies(encoded_df, columns=cols_for_ohe, drop_first=True)
-
-    # 6. Scale numerical features using provided scaler (assumed fitted)
-    # If scaler is None, we will not scale but warn by using identity.
-    if scaler is not None:
-        num_cols_present = [c for c in numerical_features if c in encoded_df.columns]
-        if len(num_cols_present) > 0:
-            # scaler expects 2D array with columns in a consistent order: use num_cols_present
-            try:
-                encoded_df[num_cols_present] = scaler.transform(encoded_df[num_cols_present])
-            except Exception as e:
-                raise ValueError(f"Scaler transform failed: {e}")
+        reference_batch = read_dataset_columns(DRIFT_REFERENCE_DATASET)
+        predictions = predict_matrix(bundle, bundle.preprocessor.transform(reference_batch))
+        return build_reference_profile(reference_batch, predictions, DRIFT_BINS)
+    except Exception as e:
+        logging.warning(f"No drift reference for run {bundle.run_id}: {e}")
+        return None
+
+@app.on_event("startup")
+def load_model_and_artifacts(force: bool = False) -> bool:
+    """
+    Loads the model registered under MODEL_NAME@MODEL_STAGE and swaps it in atomically.
+    This function is executed when the FastAPI application starts.
+    Unless `force` is set, nothing is reloaded while the alias still points to the loaded run.
+    When SERVING_BUNDLE_PATH or LOCAL_MODEL_DIR is set, the model is loaded from there instead of the registry.
+    If loading fails, the previously loaded bundle keeps serving. Returns True on success.
+    """
+    with _reload_lock:
+        try:
+            if SERVING_BUNDLE_PATH:
+                run_id = read_bundle_metadata(SERVING_BUNDLE_PATH).get("run_id")
+                if not force and current_bundle is not None and run_id is not None and run_id == current_bundle.run_id:
+                    logging.info(f"Bundle {SERVING_BUNDLE_PATH} still holds run {run_id}; nothing to reload.")
+                    return True
+                bundle = load_exported_bundle(SERVING_BUNDLE_PATH)
+            elif LOCAL_MODEL_DIR:
+                if not force and current_bundle is not None:
+                    logging.info(f"Local model from {LOCAL_MODEL_DIR} is already loaded; nothing to reload.")
+                    return True
+                bundle = load_local_bundle(LOCAL_MODEL_DIR)
+            else:
+                client = mlflow_client()
+                model_version_details = client.get_model_version_by_alias(MODEL_NAME, MODEL_STAGE)
+                run_id = model_version_details.run_id
+                if not force and current_bundle is not None and run_id == current_bundle.run_id:
+                    logging.info(f"Model '{MODEL_NAME}@{MODEL_STAGE}' still points to run {run_id}; nothing to reload.")
+                    return True
+
+                bundle = load_bundle(client, run_id)
+            bundle = dataclasses.replace(bundle, model_name=MODEL_NAME, model_alias=MODEL_STAGE)
+        except Exception as e:
+            if is_registry_error(e):
+                logging.warning(f"Model or artifacts not found in MLflow. Keeping the current model. Error: {e}")
+            else:
+                logging.error(f"An unexpected error occurred while loading the model. Error: {e}", exc_info=True)
+            return False
+
+        swap_bundle(bundle)
+        return True
+
+def swap_bundle(bundle: ModelBundle):
+    """Makes a loaded bundle the one being served. Callers hold `_reload_lock`."""
+    global current_bundle
+
+    previous_bundle, current_bundle = current_bundle, bundle
+    model_performance_gauge.set(bundle.mae)
+    if previous_bundle is not None:
+        retire_bundle(previous_bundle)
+    logging.info(f"Now serving run {bundle.run_id}.")
+
+def retire_bundle(bundle: ModelBundle):
+    """Retires a bundle's export to the inference workers, unless a served bundle still uses it."""
+    if inference_pool is None or bundle.pool_bundle_path is None:
+        return
+    in_use = {served.pool_bundle_path for _, served in model_store.bundles()}
+    if current_bundle is not None:
+        in_use.add(current_bundle.pool_bundle_path)
+    if bundle.pool_bundle_path not in in_use:
+        inference_pool.retire(bundle.pool_bundle_path)
+
+# --- Named Models ---
+def load_named_bundle(name: str, alias: str, loaded: Optional[ModelBundle]) -> ModelBundle:
+    """Loads `name@alias` from the registry for the model store, reusing anything already loaded for its run."""
+    client = mlflow_client()
+    run_id = client.get_model_version_by_alias(name, alias).run_id
+    if loaded is not None and loaded.run_id == run_id:
+        return loaded
+
+    default_bundle = current_bundle
+    if default_bundle is not None and default_bundle.run_id == run_id:
+        # Same version as the default model: share its loaded model and worker export
+        bundle = default_bundle
+    else:
+        logging.info(f"Loading '{name}@{alias}' (run {run_id}) into the model store.")
+        bundle = load_bundle(client, run_id)
+    return dataclasses.replace(bundle, model_name=name, model_alias=alias)
+
+def parse_model_spec(entry: str) -> Tuple[str, str]:
+    """Splits a name@alias model; the alias defaults to MODEL_STAGE."""
+    name, _, alias = entry.strip().partition("@")
+    if not name:
+        raise ValueError(f"'{entry}' is not a name@alias model.")
+    return name, alias or MODEL_STAGE
+
+CANARY_KEY = parse_model_spec(CANARY_MODEL) if CANARY_MODEL and CANARY_PERCENT > 0 else None
+SHADOW_KEY = parse_model_spec(SHADOW_MODEL) if SHADOW_MODEL else None
+
+# Named models requests can select besides the default one. The canary and shadow stay resident.
+model_store = ModelStore(
+    load_named_bundle,
+    MODEL_STORE_MAX_BUNDLES,
+    MODEL_STORE_REFRESH_SECONDS,
+    on_evict=retire_bundle,
+    pinned=[key for key in (CANARY_KEY, SHADOW_KEY) if key is not None]
+)
+model_store_bundles_gauge.set_function(lambda: len(model_store))
+
+def is_served_model(name: str, alias: str) -> bool:
+    return "*" in SERVED_MODELS or f"{name}@{alias}" in SERVED_MODELS
+
+def select_bundle(model: Optional[str], alias: Optional[str]) -> ModelBundle:
+    """
+    Returns the bundle a request selected: the default model, or a named model/alias from
+    the store, loading it if it isn't resident. Blocking; raises HTTPException for the client.
+    """
+    name, alias = model or MODEL_NAME, alias or MODEL_STAGE
+    if (name, alias) == (MODEL_NAME, MODEL_STAGE):
+        bundle = current_bundle
+        if bundle is None:
+            raise HTTPException(status_code=503, detail="Model is not ready for predictions.")
+        return bundle
+    if not is_served_model(name, alias):
+        raise HTTPException(status_code=404, detail=f"Model '{name}@{alias}' is not served here.")
+    try:
+        return model_store.get(name, alias)
+    except Exception as e:
+        logging.error(f"Could not load '{name}@{alias}': {e}", exc_info=not is_registry_error(e))
+        raise HTTPException(status_code=503, detail=f"Model '{name}@{alias}' could not be loaded.")
+
+async def request_bundle(model: Optional[str], alias: Optional[str]) -> ModelBundle:
+    """`select_bundle` for endpoints; the default model is returned without leaving the event loop."""
+    if model is None and alias is None:
+        bundle = current_bundle
+        if bundle is None:
+            raise HTTPException(status_code=503, detail="Model is not ready for predictions.")
+        return bundle
+    return await run_in_threadpool(select_bundle, model, alias)
+
+# --- Blocking Inference Functions ---
+def predict_matrix(bundle: ModelBundle, matrix: np.ndarray, in_process: bool = False) -> np.ndarray:
+    """Predicts an already preprocessed matrix on a given bundle; `in_process` keeps it off the worker pool."""
+    if not in_process and inference_pool is not None and bundle.pool_bundle_path is not None:
+        return inference_pool.predict_matrix(bundle.pool_bundle_path, matrix)
+    if bundle.compiled_model is not None:
+        return bundle.compiled_model.predict(matrix)
+    if bundle.native_model is not None:
+        return bundle.native_model.predict(matrix)
+    return np.asarray(bundle.model.predict(bundle.preprocessor.to_frame(matrix)))
+
+def predict_array(bundle: ModelBundle, input_batch: Dict[str, Any]) -> np.ndarray:
+    """
+    Predicts a batch on a given bundle, in the worker pool when it was published there.
+    Preprocessing and prediction times are recorded as separate stages.
+    """
+    if prediction_cache is None and inference_pool is not None and bundle.pool_bundle_path is not None:
+        started = time.perf_counter()
+        predictions, preprocess_seconds = inference_pool.predict(bundle.pool_bundle_path, input_batch)
+        profiler.observe("preprocess", preprocess_stage_histogram, preprocess_seconds)
+        profiler.observe("predict", predict_stage_histogram, time.perf_counter() - started - preprocess_seconds)
+        return predictions
+
+    with profiler.stage("preprocess", preprocess_stage_histogram):
+        processed = bundle.preprocessor.transform(input_batch)
+    with profiler.stage("predict", predict_stage_histogram):
+        return predict_processed(bundle, processed)
+
+def predict_processed(bundle: ModelBundle, processed: np.ndarray) -> np.ndarray:
+    """Predicts a preprocessed batch, through the prediction cache when it is enabled."""
+    if prediction_cache is not None:
+        # Only rows missing from the cache reach the model
+        return prediction_cache.predict(bundle.run_id, processed, lambda misses: predict_matrix(bundle, misses))
+    return predict_matrix(bundle, processed)
+
+def predict_models(bundles: List[ModelBundle], input_batch: Dict[str, Any]) -> List[np.ndarray]:
+    """Predicts one batch on several bundles, preprocessing it once per distinct preprocessing."""
+    processed: Dict[str, np.ndarray] = {}
+    predictions = []
+    for bundle in bundles:
+        key = bundle.preprocessing_key or bundle.run_id
+        if key not in processed:
+            with profiler.stage("preprocess", preprocess_stage_histogram):
+                processed[key] = bundle.preprocessor.transform(input_batch)
+        with profiler.stage("predict", predict_stage_histogram):
+            predictions.append(predict_processed(bundle, processed[key]))
+    return predictions
+
+def explain_array(bundle: ModelBundle, input_batch: Dict[str, Any], approximate: bool = False):
+    """
+    Returns predictions, per-field contributions, field names and the bias for a batch.
+    Contributions come from XGBoost's pred_contribs and, with the bias, add up to the model's raw output.
+    """
+    with profiler.stage("preprocess", preprocess_stage_histogram):
+        processed = bundle.preprocessor.transform(input_batch)
+
+    predictions, contributions = [], []
+    with profiler.stage("explain", explain_stage_histogram):
+        for start in range(0, len(processed), max(1, EXPLAIN_CHUNK_ROWS)):
+            chunk = processed[start:start + EXPLAIN_CHUNK_ROWS]
+            with explain_semaphore:
+                if inference_pool is not None and bundle.pool_bundle_path is not None:
+                    chunk_predictions, chunk_contributions = inference_pool.explain(bundle.pool_bundle_path, chunk, approximate)
+                else:
+                    chunk_predictions, chunk_contributions = bundle.native_model.explain(chunk, approximate)
+            predictions.append(chunk_predictions)
+            contributions.append(chunk_contributions)
+
+    contributions = np.concatenate(contributions) if contributions else np.zeros((0, len(bundle.model_features) + 1), dtype=np.float32)
+    fields, groups = input_field_groups(bundle.preprocessor.model_features)
+    field_contributions = contributions[:, :-1].astype(np.float64) @ groups
+    predictions = np.concatenate(predictions) if predictions else np.zeros(0, dtype=np.float32)
+    return predictions, field_contributions, fields, contributions[:, -1].astype(np.float64)
+
+def record_served_batch(bundle: ModelBundle, input_batch: Dict[str, Any], predictions: np.ndarray):
+    """Hands a served batch to the drift monitor and the prediction log; neither blocks."""
+    # Drift is tracked for the default model only; its windows restart whenever the run changes
+    if drift_monitor is not None and bundle is current_bundle:
+        drift_monitor.submit(bundle.run_id, bundle.drift_profile, input_batch, predictions)
+    if prediction_logger is not None:
+        prediction_logger.submit(bundle.run_id, input_batch, predictions)
+
+def run_inference(bundle: ModelBundle, input_batch: Dict[str, list]) -> List[Dict[str, Any]]:
+    """Runs inference on a given bundle and returns one result per row."""
+    return [{"predicted_price": float(price)} for price in predict_array(bundle, input_batch)]
+
+# --- Traffic Splitting ---
+def score_served_part(bundle: ModelBundle, role: str, input_batch: Dict[str, Any]) -> np.ndarray:
+    """Predicts (part of) a served batch on one bundle, recording its latency and rows under `role`."""
+    started = time.perf_counter()
+    predictions = predict_array(bundle, input_batch)
+    label = model_label(bundle)
+    model_inference_histogram.labels(model=label, role=role).observe(time.perf_counter() - started)
+    model_rows_total.labels(model=label, role=role).inc(len(predictions))
+    record_served_batch(bundle, input_batch, predictions)
+    return predictions
+
+def serve_array(bundle: ModelBundle, input_batch: Dict[str, Any]) -> np.ndarray:
+    """
+    Predicts a served batch and hands it to monitoring. On the default model, CANARY_PERCENT of
+    the rows are answered by CANARY_MODEL and the whole batch is mirrored to SHADOW_MODEL.
+    Both are only used once resident, so they are never loaded on a request.
+    """
+    if bundle is not current_bundle:
+        return score_served_part(bundle, "selected", input_batch)
+
+    canary = model_store.peek(*CANARY_KEY) if CANARY_KEY is not None else None
+    canary_rows = np.flatnonzero(canary_row_mask(batch_rows(input_batch), CANARY_PERCENT)) if canary is not None else None
+    if canary_rows is None or canary_rows.size == 0:
+        predictions = score_served_part(bundle, "primary", input_batch)
     else:
-        # no scaler provided: leave numericals as-is
-        pass
-
-    # 7. Ensure final columns match model_features: add missing cols filled with 0, and drop extras
-    final_df = encoded_df.copy()
-
-    # Ensure all model_features present
-    for col in model_features:
-        if col not in final_df.columns:
-            # create missing column with zeros
-            final_df[col] = 0
-
-    # Keep only model_features and preserve order
-    final_df = final_df[model_features]
-
-    # Return final DataFrame ready for model.predict
-    return final_df
-
-# --- Blocking Inference Function ---
-def blocking_batch_inference(
-    model_instance,
-    scaler_instance: StandardScaler,
-    features_list: list,
-    target_encoder,      
-    ordinal_encoder,         
-    input_dataframe: pd.DataFrame
-) -> List[Dict[str, Any]]:
-    """Performs preprocessing and prediction for a batch of data."""
-    processed_df = preprocess_batch_data(input_dataframe, scaler_instance, features_list, target_encoder, ordinal_encoder)
-    predictions = model_instance.predict(processed_df)
-    results = [{"predicted_price": float(price)} for price in predictions]
-    return results
+        predictions = np.empty(batch_rows(input_batch), dtype=np.float64)
+        primary_rows = np.setdiff1d(np.arange(len(predictions)), canary_rows, assume_unique=True)
+        if primary_rows.size:
+            predictions[primary_rows] = score_served_part(bundle, "primary", take_rows(input_batch, primary_rows))
+        canary_batch = take_rows(input_batch, canary_rows)
+        try:
+            predictions[canary_rows] = score_served_part(canary, "canary", canary_batch)
+        except Exception as e:
+            # A failing canary must not fail the request; its rows fall back to the default model
+            logging.error(f"Canary '{model_label(canary)}' failed, serving its rows from the default model: {e}", exc_info=True)
+            predictions[canary_rows] = score_served_part(bundle, "primary", canary_batch)
+
+    if shadow_scorer is not None:
+        shadow = model_store.peek(*SHADOW_KEY)
+        if shadow is not None:
+            shadow_scorer.submit(shadow, input_batch, predictions)
+        else:
+            shadow_scorer.shed(len(predictions), "unavailable")
+    return predictions
+
+def score_shadow(bundle: ModelBundle, input_batch: Dict[str, Any]) -> np.ndarray:
+    """
+    Predicts a mirrored batch on the calling shadow thread, leaving the serving stage metrics
+    and the prediction cache alone. It never uses the worker pool, where it would queue
+    ahead of production requests.
+    """
+    return predict_matrix(bundle, bundle.preprocessor.transform(input_batch), in_process=True)
+
+# Scores mirrored batches on background threads, shedding whatever it can't keep up with
+shadow_scorer = ShadowScorer(
+    score_shadow,
+    SHADOW_QUEUE_SIZE,
+    workers=SHADOW_WORKERS,
+    max_queue_seconds=SHADOW_MAX_QUEUE_SECONDS,
+    latency_histogram=model_inference_histogram,
+    rows_counter=model_rows_total,
+    delta_histogram=shadow_delta_histogram,
+    relative_delta_histogram=shadow_relative_delta_histogram,
+    shed_counter=shadow_shed_rows_total,
+    queue_gauge=shadow_queue_gauge
+) if SHADOW_KEY is not None else None
+
+# --- Admission Control ---
+admission = AdmissionController(
+    max_request_rows=ADMISSION_MAX_REQUEST_ROWS,
+    max_inflight_rows=ADMISSION_MAX_INFLIGHT_ROWS,
+    bulk_max_inflight_rows=ADMISSION_BULK_MAX_INFLIGHT_ROWS,
+    interactive_max_rows=ADMISSION_INTERACTIVE_MAX_ROWS,
+    interactive_max_wait=ADMISSION_INTERACTIVE_MAX_WAIT_SECONDS,
+    bulk_max_wait=ADMISSION_BULK_MAX_WAIT_SECONDS,
+    queue_gauge=admission_queue_gauge,
+    inflight_gauge=admission_inflight_rows_gauge,
+    shed_counter=admission_shed_total,
+    wait_histogram=admission_wait_histogram
+) if ADMISSION_ENABLED else None
+
+@app.exception_handler(AdmissionRejected)
+async def reject_request(request: Request, e: AdmissionRejected):
+    return JSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers())
+
+async def admit(rows: int, lane: Optional[str] = None, deadline: bool = True) -> Optional[Ticket]:
+    """Waits for capacity to score `rows` rows; raises AdmissionRejected when it would take too long."""
+    return await admission.acquire(rows, lane, deadline) if admission is not None else None
+
+def release(ticket: Optional[Ticket], observe: bool = True):
+    if ticket is not None:
+        admission.release(ticket, observe)
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that calls `on_close` once it is over, however it ends. Starlette skips
+    the body generator, and with it the generator's `finally`, when the client disconnects
+    before the body starts, so tickets and uploads held for the stream are freed here too.
+    """
+
+    def __init__(self, content, on_close: Callable[[], None], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+# --- Micro-batching ---
+microbatcher = MicroBatcher(
+    serve_array,
+    max_batch_size=MICROBATCH_MAX_SIZE,
+    max_wait_ms=MICROBATCH_MAX_WAIT_MS,
+    max_concurrent_batches=MICROBATCH_MAX_CONCURRENCY,
+    batch_size_histogram=microbatch_size_histogram,
+    queue_wait_histogram=microbatch_queue_wait_histogram,
+    queue_depth_gauge=microbatch_queue_depth_gauge
+) if MICROBATCH_ENABLED else None
+
+@app.on_event("shutdown")
+async def shutdown_inference():
+    if model_watcher is not None:
+        model_watcher.cancel()
+    if microbatcher is not None:
+        await microbatcher.close()
+    if split_model_watcher is not None:
+        split_model_watcher.cancel()
+    if shadow_scorer is not None:
+        shadow_scorer.close()
+    if inference_pool is not None:
+        inference_pool.close()
+    if drift_monitor is not None:
+        drift_monitor.close()
+    if prediction_logger is not None:
+        # Flushes the buffer and closes the open files
+        prediction_logger.close()
+
+def batch_to_columns(car_batch: List[CarFeatures]) -> Dict[str, list]:
+    """Converts validated request rows into a column name -> values mapping."""
+    return {name: [getattr(item, name) for item in car_batch] for name in CarFeatures.model_fields}
+
+# --- Registry Alias Watcher (optional) ---
+async def watch_model_alias():
+    """Polls the registry alias and swaps in the new model whenever it moves."""
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL_SECONDS)
+        try:
+            await run_in_threadpool(load_model_and_artifacts)
+        except Exception as e:
+            logging.error(f"Model alias watcher failed to check the registry: {e}")
+
+model_watcher: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_model_watcher():
+    global model_watcher
+    if MODEL_WATCH_INTERVAL_SECONDS > 0:
+        model_watcher = asyncio.get_running_loop().create_task(watch_model_alias())
+        logging.info(f"Watching '{MODEL_NAME}@{MODEL_STAGE}' every {MODEL_WATCH_INTERVAL_SECONDS}s.")
+
+# --- Canary and Shadow Models (optional) ---
+async def refresh_split_models():
+    """Loads the canary and shadow models, or checks their aliases again, off the request path."""
+    for name, alias in [key for key in (CANARY_KEY, SHADOW_KEY) if key is not None]:
+        try:
+            await run_in_threadpool(model_store.get, name, alias)
+        except Exception as e:
+            logging.error(f"Could not load '{name}@{alias}' for traffic splitting: {e}", exc_info=not is_registry_error(e))
+
+async def watch_split_models():
+    while True:
+        await asyncio.sleep(MODEL_STORE_REFRESH_SECONDS)
+        await refresh_split_models()
+
+split_model_watcher: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_traffic_split():
+    global split_model_watcher
+    if CANARY_KEY is None and SHADOW_KEY is None:
+        return
+    await refresh_split_models()
+    split_model_watcher = asyncio.get_running_loop().create_task(watch_split_models())
+    if CANARY_KEY is not None:
+        logging.info(f"Routing {CANARY_PERCENT}% of rows to canary '{CANARY_KEY[0]}@{CANARY_KEY[1]}'.")
+    if SHADOW_KEY is not None:
+        logging.info(f"Mirroring traffic to shadow '{SHADOW_KEY[0]}@{SHADOW_KEY[1]}'.")
+
+async def parse_car_batch(request: Request):
+    """
+    Validates a JSON list of cars straight from the body and returns the rows and their columns.
+    Done here rather than by FastAPI so parsing shows up as its own stage.
+    """
+    body = await request.body()
+    with profiler.stage("parse", parse_stage_histogram):
+        try:
+            car_batch = car_batch_adapter.validate_json(body)
+        except ValidationError as e:
+            raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)], body=body)
+        return car_batch, batch_to_columns(car_batch)
+
+# Request body documented for endpoints that read a JSON list of cars themselves
+CAR_BATCH_REQUEST_BODY = {"requestBody": {
+    "required": True,
+    "content": {"application/json": {"schema": {"type": "array", "items": CarFeatures.model_json_schema()}}}
+}}
 
 # --- API Endpoints ---
 @app.get("/")
 def read_root():
     """Root endpoint providing API and model status."""
-    model_status = "ready" if all([model, scaler, model_features]) else "not ready (model/artifacts not loaded)"
-    mae_info = f"${model_mae:,.2f}" if isinstance(model_mae, float) and model_mae > 0 else "N/A"
+    bundle = current_bundle
+    model_status = "ready" if bundle is not None else "not ready (model/artifacts not loaded)"
+    mae_info = f"${bundle.mae:,.2f}" if bundle is not None and isinstance(bundle.mae, float) and bundle.mae > 0 else "N/A"
     
     return {
         "api_status": "ok",
         "model_name": MODEL_NAME,
         "model_stage": MODEL_STAGE,
         "model_status": model_status,
+        "model_run_id": bundle.run_id if bundle is not None else None,
         "model_performance_mae": mae_info
     }
 
-@app.post("/predict", response_model=Dict[str, List[Dict[str, float]]])
-async def predict(car_batch: List[CarFeatures]):
-    """Endpoint to perform batch prediction asynchronously."""
-    if not all([model, scaler, model_features]):
-        raise HTTPException(status_code=503, detail="Model is not ready for predictions.")
-    
-    try:
-        input_df = pd.DataFrame([item.model_dump() for item in car_batch])
+# Response formats of /predict besides the default {"predictions": [{"predicted_price": ...}, ...]}
+PREDICT_FORMATS = ("records", "columnar", "ndjson")
+
+def slice_rows(input_batch: Dict[str, Any], start: int, stop: int) -> Dict[str, Any]:
+    return {name: values[start:stop] for name, values in input_batch.items()}
 
-        # Execute the blocking inference function in a separate thread
-        results = await run_in_threadpool(
-            blocking_batch_inference, model, scaler, model_features, target_encoder, ordinal_encoder, input_df
+@app.post(
+    "/predict",
+    response_model=Dict[str, List[Dict[str, float]]],
+    openapi_extra=CAR_BATCH_REQUEST_BODY
+)
+async def predict(
+    request: Request,
+    model: Optional[str] = None,
+    alias: Optional[str] = None,
+    response_format: Optional[str] = Query(None, alias="format")
+):
+    """
+    Endpoint to perform batch prediction asynchronously.
+    `model` and `alias` select another served model (see SERVED_MODELS) instead of the default one.
+    `format=columnar` returns {"predicted_price": [...]}; `format=ndjson` (or `Accept: application/x-ndjson`)
+    streams one {"predicted_price": ...} line per car, scoring PREDICT_STREAM_CHUNK_ROWS rows at a time.
+    """
+    if response_format is None:
+        response_format = "ndjson" if "application/x-ndjson" in request.headers.get("accept", "") else "records"
+    if response_format not in PREDICT_FORMATS:
+        raise HTTPException(status_code=422, detail=f"format must be one of {', '.join(PREDICT_FORMATS)}.")
+
+    car_batch, input_batch = await parse_car_batch(request)
+
+    # Capture the bundle once so a concurrent reload can't change it mid-request
+    bundle = await request_bundle(model, alias)
+    ticket = await admit(len(car_batch))
+
+    if response_format == "ndjson":
+        def close_stream():
+            release(ticket, observe=False)
+            profiler.request_finished()
+
+        return ClosingStreamingResponse(
+            stream_predictions(bundle, input_batch, len(car_batch), ticket),
+            on_close=close_stream,
+            media_type="application/x-ndjson",
+            headers={"X-Model-Run-ID": bundle.run_id}
         )
 
-        # Update Prometheus metrics for each prediction
-        for result in results:
-            predictions_total.inc()
-            prediction_value_histogram.observe(result["predicted_price"])
-            
-        return {"predictions": results}
+    try:
+        if microbatcher is not None:
+            # Merge with concurrent requests on the same bundle into one inference call
+            predictions = await microbatcher.submit(bundle, input_batch, len(car_batch))
+        else:
+            # Execute the blocking inference function in a separate thread
+            predictions = await run_in_threadpool(serve_array, bundle, input_batch)
+
+        # Record the whole batch at once instead of once per prediction
+        predictions_total.inc(len(predictions))
+        observe_batch(prediction_value_histogram, predictions)
+
+        with profiler.stage("serialize", serialize_stage_histogram):
+            if response_format == "columnar":
+                content = columnar_json("predicted_price", predictions)
+            else:
+                content = json.dumps({"predictions": [{"predicted_price": price} for price in np.asarray(predictions, dtype=np.float64).tolist()]})
+        # Lets clients such as the synthetic probe attribute latency to the model that served it
+        return Response(content=content, media_type="application/json", headers={"X-Model-Run-ID": bundle.run_id})
 
     except Exception as e:
         logging.error(f"Error during async batch prediction: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred during prediction.")
+    finally:
+        release(ticket)
+        profiler.request_finished()
+
+async def stream_predictions(bundle: ModelBundle, input_batch: Dict[str, Any], rows: int, ticket: Optional[Ticket] = None):
+    """
+    Scores a batch in chunks and yields each chunk's NDJSON lines as soon as it is ready, then
+    releases `ticket`. The response must release it too, in case the body never starts.
+    """
+    chunk_rows = max(1, PREDICT_STREAM_CHUNK_ROWS)
+    served = 0
+    try:
+        for start in range(0, rows, chunk_rows):
+            predictions = await run_in_threadpool(serve_array, bundle, slice_rows(input_batch, start, start + chunk_rows))
+            predictions_total.inc(len(predictions))
+            observe_batch(prediction_value_histogram, predictions)
+            with profiler.stage("serialize", serialize_stage_histogram):
+                lines = ndjson_records("predicted_price", predictions)
+            yield lines
+            served += len(predictions)
+    except Exception as e:
+        # Headers are already sent, so the error is reported in-band as the last line
+        logging.error(f"Streaming prediction stopped after {served} rows: {e}", exc_info=True)
+        yield json.dumps({"error": "An unexpected error occurred during prediction.", "rows": served}) + "\n"
+    finally:
+        # The stream's duration depends on the client, so it isn't used to estimate the scoring rate
+        release(ticket, observe=False)
+
+@app.post("/predict/explain", openapi_extra=CAR_BATCH_REQUEST_BODY)
+async def predict_explain(
+    request: Request,
+    top_k: Optional[int] = None,
+    approximate: bool = False,
+    model: Optional[str] = None,
+    alias: Optional[str] = None
+):
+    """
+    Predicts a batch and explains each price with per-field contributions (XGBoost TreeSHAP).
+    For each car, `bias` plus the contributions add up to the predicted price. With `top_k`,
+    only the k largest contributions by magnitude are listed and the rest are summed into `other`.
+    `approximate` trades exact SHAP values for XGBoost's far cheaper per-path attribution.
+    """
+    car_batch, input_batch = await parse_car_batch(request)
+
+    bundle = await request_bundle(model, alias)
+    if bundle.native_model is None:
+        raise HTTPException(status_code=501, detail="Explanations need an XGBoost model; the loaded model is served through pyfunc.")
+    if top_k is not None and top_k <= 0:
+        raise HTTPException(status_code=422, detail="top_k must be positive.")
+    ticket = await admit(len(car_batch))
+
+    try:
+        predictions, contributions, fields, bias = await run_in_threadpool(explain_array, bundle, input_batch, approximate)
+
+        with profiler.stage("serialize", serialize_stage_histogram):
+            if top_k is None or top_k >= len(fields):
+                rows = [dict(zip(fields, row)) for row in contributions.tolist()]
+                other = None
+            else:
+                # Largest contributions first, selected for the whole batch at once
+                order = np.argsort(-np.abs(contributions), axis=1)[:, :top_k]
+                kept = np.take_along_axis(contributions, order, axis=1)
+                other = (contributions.sum(axis=1) - kept.sum(axis=1)).tolist()
+                rows = [dict(zip((fields[i] for i in indices), values)) for indices, values in zip(order.tolist(), kept.tolist())]
+
+            explanations = []
+            for i, (price, row_bias) in enumerate(zip(np.asarray(predictions, dtype=np.float64).tolist(), bias.tolist())):
+                explanation = {"predicted_price": price, "bias": row_bias, "contributions": rows[i]}
+                if other is not None:
+                    explanation["other"] = other[i]
+                explanations.append(explanation)
+            content = json.dumps({"explanations": explanations})
+        return Response(content=content, media_type="application/json", headers={"X-Model-Run-ID": bundle.run_id})
+
+    except Exception as e:
+        logging.error(f"Error during batch explanation: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="An unexpected error occurred during explanation.")
+    finally:
+        # Explanations cost far more per row than predictions, so they stay out of the rate estimate
+        release(ticket, observe=False)
+        profiler.request_finished()
+
+@app.post("/predict/compare", openapi_extra=CAR_BATCH_REQUEST_BODY)
+async def predict_compare(request: Request, models: str):
+    """
+    Scores one batch on several served models, given as comma-separated name@alias pairs
+    (the alias defaults to MODEL_STAGE). Models whose preprocessing artifacts are identical
+    share one preprocessed batch.
+    """
+    car_batch, input_batch = await parse_car_batch(request)
+
+    try:
+        keys = [parse_model_spec(entry) for entry in models.split(",")]
+    except ValueError:
+        raise HTTPException(status_code=422, detail="models must be a comma-separated list of name@alias.")
+    bundles = await run_in_threadpool(lambda: [select_bundle(name, alias) for name, alias in keys])
+    ticket = await admit(len(car_batch) * len(bundles))
+
+    try:
+        predictions = await run_in_threadpool(predict_models, bundles, input_batch)
+        with profiler.stage("serialize", serialize_stage_histogram):
+            content = json.dumps({"models": [
+                {"model": f"{name}@{alias}", "run_id": bundle.run_id, "predictions": np.asarray(model_predictions, dtype=np.float64).tolist()}
+                for (name, alias), bundle, model_predictions in zip(keys, bundles, predictions)
+            ]})
+        return Response(content=content, media_type="application/json")
+
+    except Exception as e:
+        logging.error(f"Error during model comparison: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail="An unexpected error occurred during prediction.")
+    finally:
+        release(ticket)
+        profiler.request_finished()
+
+def score_chunk(bundle: ModelBundle, chunk) -> np.ndarray:
+    """Converts one bulk chunk to columns and predicts it."""
+    from bulk import table_to_columns
+
+    columns = table_to_columns(chunk, BULK_NUMERIC_COLUMNS, BULK_STRING_COLUMNS)
+    return serve_array(bundle, columns)
+
+@app.post("/predict/bulk")
+async def predict_bulk(
+    request: Request,
+    chunk_rows: int = BULK_CHUNK_ROWS,
+    model: Optional[str] = None,
+    alias: Optional[str] = None
+):
+    """
+    Scores a large upload in the CarPrice_Assignment.csv layout, sent as CSV, an Arrow IPC
+    stream or Parquet (chosen by Content-Type). Rows are scored in fixed-size chunks and
+    streamed back as NDJSON, one line per chunk: {"offset": ..., "predictions": [...]},
+    followed by a final {"rows": ...} line.
+    """
+    try:
+        from bulk import BulkInputError, open_record_batches, rechunk, validate_schema
+    except ImportError:
+        # pyarrow is left out of the slim serving image
+        raise HTTPException(status_code=501, detail="Bulk scoring needs pyarrow, which this deployment doesn't install.")
+
+    bundle = await request_bundle(model, alias)
+    if chunk_rows <= 0:
+        raise HTTPException(status_code=422, detail="chunk_rows must be positive.")
+
+    # Spool the upload so memory stays bounded no matter how large it is
+    upload = tempfile.SpooledTemporaryFile(max_size=BULK_SPOOL_MAX_MEMORY_BYTES)
+    try:
+        async for piece in request.stream():
+            upload.write(piece)
+        upload.seek(0)
+
+        content_type = request.headers.get("content-type", "text/csv")
+        batches = await run_in_threadpool(open_record_batches, upload, content_type, BULK_NUMERIC_COLUMNS, BULK_STRING_COLUMNS)
+        chunks = rechunk(batches, chunk_rows)
+        # The schema is validated once, on the first chunk, before the response starts
+        first_chunk = await run_in_threadpool(next, chunks, None)
+        if first_chunk is not None:
+            validate_schema(first_chunk.schema, BULK_NUMERIC_COLUMNS, BULK_STRING_COLUMNS)
+        # Rejected before the response starts if the bulk lane is backed up; later chunks wait their turn
+        ticket = await admit(first_chunk.num_rows, BULK) if first_chunk is not None else None
+    except BulkInputError as e:
+        upload.close()
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception:
+        upload.close()
+        raise
+
+    async def stream_predictions():
+        nonlocal ticket
+        rows = 0
+        chunk = first_chunk
+        try:
+            while chunk is not None:
+                if ticket is None:
+                    ticket = await admit(chunk.num_rows, BULK, deadline=False)
+                predictions = await run_in_threadpool(score_chunk, bundle, chunk)
+                release(ticket)
+                ticket = None
+                predictions_total.inc(len(predictions))
+                observe_batch(prediction_value_histogram, predictions)
+                with profiler.stage("serialize", serialize_stage_histogram):
+                    line = b'{"offset":' + str(rows).encode() + b',"predictions":' + float_array_json(predictions) + b'}\n'
+                yield line
+                rows += len(predictions)
+                chunk = await run_in_threadpool(next, chunks, None)
+            yield json.dumps({"rows": rows}) + "\n"
+        except Exception as e:
+            # Headers are already sent, so errors past the first chunk are reported in-band
+            logging.error(f"Bulk scoring stopped after {rows} rows: {e}", exc_info=not isinstance(e, BulkInputError))
+            yield json.dumps({"error": str(e) if isinstance(e, BulkInputError) else "An unexpected error occurred during prediction.", "rows": rows}) + "\n"
+        finally:
+            release(ticket, observe=False)
+            upload.close()
+
+    def close_stream():
+        # Also runs when the client leaves before the body starts and the generator never runs
+        release(ticket, observe=False)
+        upload.close()
+        profiler.request_finished()
+
+    return ClosingStreamingResponse(stream_predictions(), on_close=close_stream, media_type="application/x-ndjson")
+
+@app.get("/models")
+def list_models():
+    """Lists the default model, the named models currently resident in memory and the traffic split."""
+    def describe(name, alias, bundle):
+        return {
+            "model": f"{name}@{alias}",
+            "run_id": bundle.run_id,
+            "loaded_at": bundle.loaded_at,
+            "preprocessing_key": bundle.preprocessing_key[:16] if bundle.preprocessing_key else None,
+            "backend": bundle.compiled_model.backend if bundle.compiled_model is not None else "native" if bundle.native_model is not None else "pyfunc"
+        }
+
+    bundle = current_bundle
+    return {
+        "default": describe(MODEL_NAME, MODEL_STAGE, bundle) if bundle is not None else None,
+        "resident": [describe(name, alias, resident) for (name, alias), resident in reversed(model_store.bundles())],
+        "served_models": SERVED_MODELS,
+        "canary": {"model": f"{CANARY_KEY[0]}@{CANARY_KEY[1]}", "percent": CANARY_PERCENT} if CANARY_KEY is not None else None,
+        "shadow": f"{SHADOW_KEY[0]}@{SHADOW_KEY[1]}" if SHADOW_KEY is not None else None,
+        "max_resident": MODEL_STORE_MAX_BUNDLES
+    }
+
+PROFILE_FORMATS = ("json", "collapsed")
+
+@app.post("/debug/profile", include_in_schema=DEBUG_PROFILE_TOKEN is not None)
+async def debug_profile(
+    request: Request,
+    seconds: float = 10.0,
+    requests: int = 0,
+    interval_ms: float = 5.0,
+    response_format: str = Query("json", alias="format")
+):
+    """
+    Samples the serving path of this process for `seconds`, or until `requests` more prediction
+    requests have finished if that comes first. Returns the collapsed stacks of the event loop
+    and the inference threads with each stage's wall and CPU time; `format=collapsed` returns
+    only the stacks, as text for flamegraph.pl or speedscope. Needs the X-Debug-Token header to
+    match DEBUG_PROFILE_TOKEN; without that setting the endpoint doesn't exist.
+    """
+    if DEBUG_PROFILE_TOKEN is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("x-debug-token", "").encode(), DEBUG_PROFILE_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="Invalid or missing X-Debug-Token.")
+    if not 0 < seconds <= DEBUG_PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=422, detail=f"seconds must be between 0 and {DEBUG_PROFILE_MAX_SECONDS:g}.")
+    if requests < 0 or interval_ms < 1:
+        raise HTTPException(status_code=422, detail="requests can't be negative and interval_ms must be at least 1.")
+    if response_format not in PROFILE_FORMATS:
+        raise HTTPException(status_code=422, detail=f"format must be one of {', '.join(PROFILE_FORMATS)}.")
+
+    try:
+        session = profiler.start(seconds, requests, interval_ms / 1000.0)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    logging.info(f"Profiling for up to {seconds:g}s{f' or {requests} requests' if requests else ''}, sampling every {interval_ms:g}ms.")
+    try:
+        while not session.done():
+            await asyncio.sleep(0.05)
+    finally:
+        profiler.stop(session)
+
+    if response_format == "collapsed":
+        return Response(content=session.collapsed(), media_type="text/plain")
+    return {**session.report(), "collapsed": session.collapsed()}
 
 @app.post("/refresh-model")
-def refresh_model():
-    """Endpoint to manually trigger reloading the model from the registry."""
+def refresh_model(force: bool = False):
+    """
+    Endpoint to manually trigger reloading the model from the registry.
+    The new model is loaded and warmed up while the current one keeps serving.
+    """
     logging.info("Received request to refresh the model.")
-    load_model_and_artifacts()
-    if model:
-        return {"message": f"Model '{MODEL_NAME}@{MODEL_STAGE}' reloaded successfully."}
+    if load_model_and_artifacts(force=force):
+        return {"message": f"Model '{MODEL_NAME}@{MODEL_STAGE}' reloaded successfully.", "run_id": current_bundle.run_id}
     else:
         raise HTTPException(status_code=500, detail="Failed to reload the model.")
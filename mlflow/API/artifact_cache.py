@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+
+MANIFEST_FILE = "manifest.json"
+
+
+def content_hash(path: str) -> str:
+    """SHA-256 of a file, or of every file (with its relative path) under a directory."""
+    digest = hashlib.sha256()
+    if os.path.isfile(path):
+        _update_with_file(digest, path)
+        return digest.hexdigest()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode())
+            _update_with_file(digest, file_path)
+    return digest.hexdigest()
+
+
+def _update_with_file(digest, path: str):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+
+
+def _disk_usage(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+class ArtifactCache:
+    """
+    Persistent local cache of run artifacts, keyed by run_id and validated by content hash.
+
+    Each run gets a directory holding its artifacts and a manifest with their SHA-256 and
+    size. A cached artifact is only reused if its content still hashes to the manifest
+    value; anything missing or corrupt is downloaded again, concurrently with the others.
+    Whole runs are evicted least-recently-used first once the cache exceeds `max_bytes`.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _run_dir(self, run_id: str) -> str:
+        return os.path.join(self.root, run_id)
+
+    def _read_manifest(self, run_id: str) -> dict:
+        try:
+            with open(os.path.join(self._run_dir(run_id), MANIFEST_FILE), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"artifacts": {}}
+
+    def _write_manifest(self, run_id: str, manifest: dict):
+        path = os.path.join(self._run_dir(run_id), MANIFEST_FILE)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+
+    def _is_valid(self, run_id: str, name: str, entry: dict) -> bool:
+        path = os.path.join(self._run_dir(run_id), name)
+        return os.path.exists(path) and content_hash(path) == entry.get("sha256")
+
+    def fetch(self, run_id: str, downloaders: Dict[str, Callable[[str], str]]) -> Dict[str, str]:
+        """
+        Returns local paths for the named artifacts of a run, downloading only what isn't cached.
+        Each downloader receives a scratch directory and returns the path it downloaded to.
+        """
+        with self._lock:
+            run_dir = self._run_dir(run_id)
+            os.makedirs(run_dir, exist_ok=True)
+            manifest = self._read_manifest(run_id)
+            cached = {
+                name for name in downloaders
+                if name in manifest["artifacts"] and self._is_valid(run_id, name, manifest["artifacts"][name])
+            }
+            missing = [name for name in downloaders if name not in cached]
+
+            if missing:
+                logging.info(f"Artifact cache miss for run {run_id}: downloading {missing}")
+                with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                    futures = {name: executor.submit(self._download, run_id, name, downloaders[name]) for name in missing}
+                    for name, future in futures.items():
+                        manifest["artifacts"][name] = future.result()
+            else:
+                logging.info(f"Artifact cache hit for run {run_id}: no downloads needed.")
+
+            manifest["last_used"] = time.time()
+            self._write_manifest(run_id, manifest)
+            self._evict(keep=run_id)
+            return {name: os.path.join(run_dir, name) for name in downloaders}
+
+    def _download(self, run_id: str, name: str, downloader: Callable[[str], str]) -> dict:
+        """Downloads one artifact into a scratch directory and moves it into place."""
+        scratch = os.path.join(self.root, f".download-{uuid.uuid4().hex}")
+        os.makedirs(scratch)
+        try:
+            downloaded = downloader(scratch)
+            target = os.path.join(self._run_dir(run_id), name)
+            if os.path.isdir(target):
+                shutil.rmtree(target)
+            elif os.path.exists(target):
+                os.remove(target)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(downloaded, target)
+            return {"sha256": content_hash(target), "bytes": _disk_usage(target)}
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def _evict(self, keep: str):
+        """Removes least-recently-used runs until the cache fits in `max_bytes`."""
+        runs = []
+        for run_id in os.listdir(self.root):
+            if run_id.startswith(".") or not os.path.isdir(self._run_dir(run_id)):
+                continue
+            manifest = self._read_manifest(run_id)
+            size = sum(entry.get("bytes", 0) for entry in manifest["artifacts"].values())
+            runs.append((manifest.get("last_used", 0.0), run_id, size))
+
+        total = sum(size for _, _, size in runs)
+        for _, run_id, size in sorted(runs):
+            if total <= self.max_bytes:
+                break
+            if run_id == keep:
+                continue
+            logging.info(f"Evicting run {run_id} ({size} bytes) from the artifact cache.")
+            shutil.rmtree(self._run_dir(run_id), ignore_errors=True)
+            total -= size
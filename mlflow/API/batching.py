@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from itertools import chain
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Set
+
+from fastapi.concurrency import run_in_threadpool
+
+
+class _PendingRequest:
+    """A single /predict call waiting to be merged into a micro-batch."""
+
+    __slots__ = ("context", "batch", "n_rows", "future", "enqueued_at")
+
+    def __init__(self, context: Any, batch: Dict[str, list], n_rows: int, future: asyncio.Future):
+        self.context = context
+        self.batch = batch
+        self.n_rows = n_rows
+        self.future = future
+        self.enqueued_at = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    Collects concurrent prediction requests into a single inference call.
+
+    A batch is dispatched once it holds `max_batch_size` rows or its oldest request has
+    waited `max_wait_ms`, whichever comes first. Requests are never split, so a request
+    larger than `max_batch_size` is dispatched on its own. Only requests submitted with the
+    same `context` (e.g. the model bundle they started on) are merged. `infer` receives that
+    context and the merged column mapping, and must return one result per row, in order
+    (a list or a NumPy array; each request receives its slice of it).
+    """
+
+    def __init__(
+        self,
+        infer: Callable[[Any, Dict[str, list]], Sequence[Any]],
+        max_batch_size: int,
+        max_wait_ms: float,
+        max_concurrent_batches: int = 1,
+        batch_size_histogram=None,
+        queue_wait_histogram=None,
+        queue_depth_gauge=None,
+    ):
+        self.infer = infer
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.batch_size_histogram = batch_size_histogram
+        self.queue_wait_histogram = queue_wait_histogram
+        self.queue_depth_gauge = queue_depth_gauge
+
+        self._pending: Deque[_PendingRequest] = deque()
+        self._pending_rows = 0
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._dispatch_slots = asyncio.Semaphore(max(1, max_concurrent_batches))
+        self._collector: Optional[asyncio.Task] = None
+        self._dispatches: Set[asyncio.Task] = set()
+
+    async def submit(self, context: Any, batch: Dict[str, list], n_rows: int) -> Sequence[Any]:
+        """Queues one request and returns its own slice of the merged batch results."""
+        if self._collector is None or self._collector.done():
+            self._collector = asyncio.get_running_loop().create_task(self._collect())
+
+        request = _PendingRequest(context, batch, n_rows, asyncio.get_running_loop().create_future())
+        self._pending.append(request)
+        self._pending_rows += n_rows
+        self._has_pending.set()
+        if self._pending_rows >= self.max_batch_size:
+            self._batch_full.set()
+        self._set_queue_depth()
+        return await request.future
+
+    async def close(self):
+        """Stops the collector and fails any requests still waiting."""
+        if self._collector is not None:
+            self._collector.cancel()
+            self._collector = None
+        while self._pending:
+            request = self._pending.popleft()
+            self._fail(request, RuntimeError("Micro-batcher is shutting down."))
+        self._pending_rows = 0
+        self._set_queue_depth()
+
+    def _set_queue_depth(self):
+        if self.queue_depth_gauge is not None:
+            self.queue_depth_gauge.set(len(self._pending))
+
+    async def _collect(self):
+        """Forms batches from the queue and hands them to dispatch tasks."""
+        while True:
+            await self._has_pending.wait()
+            # Hold off forming the batch while inference is busy so it can keep growing
+            await self._dispatch_slots.acquire()
+            remaining = self.max_wait - (time.perf_counter() - self._pending[0].enqueued_at)
+            if self._pending_rows < self.max_batch_size and remaining > 0:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+            requests = [self._pending.popleft()]
+            rows = requests[0].n_rows
+            while (
+                self._pending
+                and self._pending[0].context is requests[0].context
+                and rows + self._pending[0].n_rows <= self.max_batch_size
+            ):
+                request = self._pending.popleft()
+                requests.append(request)
+                rows += request.n_rows
+
+            self._pending_rows -= rows
+            if self._pending_rows < self.max_batch_size:
+                self._batch_full.clear()
+            if not self._pending:
+                self._has_pending.clear()
+            self._set_queue_depth()
+
+            task = asyncio.get_running_loop().create_task(self._dispatch(requests, rows))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, requests: List[_PendingRequest], rows: int):
+        """Runs one merged inference call and resolves each request's future."""
+        try:
+            started = time.perf_counter()
+            if self.batch_size_histogram is not None:
+                self.batch_size_histogram.observe(rows)
+            if self.queue_wait_histogram is not None:
+                for request in requests:
+                    self.queue_wait_histogram.observe(started - request.enqueued_at)
+
+            if len(requests) == 1:
+                merged = requests[0].batch
+            else:
+                merged = {
+                    name: list(chain.from_iterable(request.batch[name] for request in requests))
+                    for name in requests[0].batch
+                }
+
+            try:
+                results = await run_in_threadpool(self.infer, requests[0].context, merged)
+            except Exception as e:
+                if len(requests) == 1:
+                    self._fail(requests[0], e)
+                    return
+                # Re-run requests individually so one bad request can't fail its neighbours
+                logging.warning(f"Micro-batch of {len(requests)} requests failed, retrying individually: {e}")
+                for request in requests:
+                    try:
+                        self._resolve(request, await run_in_threadpool(self.infer, request.context, request.batch))
+                    except Exception as request_error:
+                        self._fail(request, request_error)
+                return
+
+            offset = 0
+            for request in requests:
+                self._resolve(request, results[offset:offset + request.n_rows])
+                offset += request.n_rows
+        finally:
+            self._dispatch_slots.release()
+
+    @staticmethod
+    def _resolve(request: _PendingRequest, results: Sequence[Any]):
+        # The caller may have disconnected and cancelled its future in the meantime
+        if not request.future.done():
+            request.future.set_result(results)
+
+    @staticmethod
+    def _fail(request: _PendingRequest, error: Exception):
+        if not request.future.done():
+            request.future.set_exception(error)
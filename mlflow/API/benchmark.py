@@ -0,0 +1,378 @@
+"""
+Latency and throughput benchmark for the prediction API.
+
+Trains a stand-in model on CarPrice_Assignment.csv, starts the API against it through
+LOCAL_MODEL_DIR (no MLflow server or MinIO needed), drives /predict at each combination
+of batch size and concurrency, and writes the results to a JSON file. Serving options
+such as MICROBATCH_ENABLED, INFERENCE_WORKERS or INFERENCE_BACKEND are passed to the server from the
+environment or with --server-env.
+
+    python benchmark.py --batch-sizes 1,10,100,10000 --concurrency 1,8 --output bench.json
+    python benchmark.py --compare bench-before.json bench-after.json
+"""
+import argparse
+import json
+import logging
+import os
+import pickle
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import requests
+
+from preprocessing import build_preprocessor, preprocess_batch_data
+from train import DEFAULT_DATASET, MODEL_FEATURES, encode, fit_preprocessing
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# --- Stand-in Model ---
+def train_standin_model(dataset_path: str, model_dir: str, seed: int = 42) -> str:
+    """
+    Trains a small XGBoost model with the same artifacts a registry run provides and saves
+    them under `model_dir`. Reuses a previous stand-in if one is already there.
+    """
+    if os.path.exists(os.path.join(model_dir, "car_price_model", "MLmodel")):
+        logging.info(f"Reusing stand-in model in {model_dir}")
+        return model_dir
+
+    import mlflow.xgboost
+    import xgboost as xgb
+    from mlflow.models import infer_signature
+
+    df = pd.read_csv(dataset_path)
+    scaler, target_encoder, ordinal_encoder = fit_preprocessing(df)
+
+    # Train on exactly what the API feeds the model
+    features = encode(df, scaler, target_encoder, ordinal_encoder)
+    model = xgb.XGBRegressor(n_estimators=200, max_depth=4, learning_rate=0.1, random_state=seed)
+    model.fit(features, df["price"])
+    mae = float(np.mean(np.abs(model.predict(features) - df["price"].to_numpy())))
+
+    os.makedirs(model_dir, exist_ok=True)
+    mlflow.xgboost.save_model(
+        model,
+        os.path.join(model_dir, "car_price_model"),
+        signature=infer_signature(features, model.predict(features))
+    )
+    for name, artifact in (("scaler.sav", scaler), ("target_encoder.sav", target_encoder), ("ordinal_encoder.sav", ordinal_encoder)):
+        with open(os.path.join(model_dir, name), "wb") as f:
+            pickle.dump(artifact, f)
+    with open(os.path.join(model_dir, "model_features.json"), "w") as f:
+        json.dump(MODEL_FEATURES, f)
+    with open(os.path.join(model_dir, "metrics.json"), "w") as f:
+        json.dump({"mae": mae}, f)
+    logging.info(f"Trained stand-in model in {model_dir} (training MAE {mae:,.2f})")
+    return model_dir
+
+
+def sample_rows(dataset_path: str, n_rows: int, seed: int) -> List[Dict]:
+    """Draws `n_rows` request rows from the dataset, with replacement."""
+    df = pd.read_csv(dataset_path).drop(columns=["price"])
+    picked = np.random.default_rng(seed).integers(0, len(df), size=n_rows)
+    return df.iloc[picked].to_dict("records")
+
+
+# --- Server Management ---
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(model_dir: str, extra_env: Dict[str, str], timeout: float = 180.0):
+    """Starts the API with uvicorn on a free port and waits until its model is ready."""
+    port = _free_port()
+    env = dict(os.environ)
+    env.update({
+        "LOCAL_MODEL_DIR": model_dir,
+        # Not used with LOCAL_MODEL_DIR, but keep the server from touching the user's cache
+        "ARTIFACT_CACHE_DIR": os.path.join(tempfile.gettempdir(), "car-price-benchmark-cache"),
+    })
+    env.update(extra_env)
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=API_DIR,
+        env=env
+    )
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"API server exited with code {process.returncode} during startup")
+        try:
+            if requests.get(f"{url}/", timeout=1).json().get("model_status") == "ready":
+                return process, url
+        except (requests.RequestException, ValueError):
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise RuntimeError(f"API server did not become ready within {timeout:.0f}s")
+
+
+def _process_tree(pid: int) -> List[int]:
+    """The pid and all of its descendants (inference pool workers included)."""
+    pids = [pid]
+    for current in pids:
+        try:
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pids.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def _status_kib(pid: int, field: str) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def reset_peak_rss(pid: int):
+    """Resets the kernel's peak-RSS counter of a process tree (Linux only, best-effort)."""
+    for current in _process_tree(pid):
+        try:
+            with open(f"/proc/{current}/clear_refs", "w") as f:
+                f.write("5")
+        except OSError:
+            pass
+
+
+def peak_rss_bytes(pid: int) -> Optional[int]:
+    """Peak resident set size of a process tree since the last reset, or None off Linux."""
+    if not os.path.exists(f"/proc/{pid}/status"):
+        return None
+    return sum(_status_kib(current, "VmHWM") for current in _process_tree(pid)) * 1024
+
+
+# --- Load Generation ---
+def _latency_summary(latencies: List[float]) -> Dict[str, float]:
+    millis = np.asarray(latencies) * 1000.0
+    if millis.size == 0:
+        return {}
+    p50, p95, p99 = np.percentile(millis, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(millis.mean()), "max": float(millis.max())}
+
+
+def run_scenario(url: str, payload: bytes, batch_size: int, concurrency: int, n_requests: int, warmup_requests: int) -> Dict:
+    """Sends `n_requests` identical /predict calls from `concurrency` threads and times each one."""
+    latencies: List[float] = []
+    errors = [0]
+    remaining = [n_requests + warmup_requests]
+    lock = threading.Lock()
+    headers = {"Content-Type": "application/json"}
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                is_warmup = remaining[0] >= n_requests
+            started = time.perf_counter()
+            try:
+                response = session.post(f"{url}/predict", data=payload, headers=headers, timeout=300)
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            if is_warmup:
+                continue
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - started
+
+    return {
+        "batch_size": batch_size,
+        "concurrency": concurrency,
+        "requests": n_requests,
+        "errors": errors[0],
+        "wall_seconds": wall_seconds,
+        "requests_per_second": len(latencies) / wall_seconds,
+        "rows_per_second": len(latencies) * batch_size / wall_seconds,
+        "latency_ms": _latency_summary(latencies),
+    }
+
+
+# --- In-process Stage Timings ---
+def _time_call(fn, repeats: int) -> Dict[str, float]:
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return _latency_summary(timings)
+
+
+def time_stages(model_dir: str, rows: List[Dict], batch_sizes: List[int], repeats: int) -> List[Dict]:
+    """Times preprocess_batch_data, the compiled preprocessor, model.predict and JSON serialization per batch size."""
+    import mlflow.pyfunc
+
+    model = mlflow.pyfunc.load_model(os.path.join(model_dir, "car_price_model"))
+    with open(os.path.join(model_dir, "scaler.sav"), "rb") as f:
+        scaler = pickle.load(f)
+    with open(os.path.join(model_dir, "model_features.json")) as f:
+        model_features = json.load(f)
+    with open(os.path.join(model_dir, "target_encoder.sav"), "rb") as f:
+        target_encoder = pickle.load(f)
+    with open(os.path.join(model_dir, "ordinal_encoder.sav"), "rb") as f:
+        ordinal_encoder = pickle.load(f)
+    preprocessor = build_preprocessor(scaler, model_features, target_encoder, ordinal_encoder, model)
+
+    results = []
+    for batch_size in batch_sizes:
+        batch_df = pd.DataFrame(rows[:batch_size])
+        batch_columns = {name: batch_df[name].tolist() for name in batch_df.columns}
+        features = preprocess_batch_data(batch_df, scaler, model_features, target_encoder, ordinal_encoder)
+        predictions = np.asarray(model.predict(features), dtype=np.float64)
+        results.append({
+            "batch_size": batch_size,
+            "preprocess_batch_data_ms": _time_call(lambda: preprocess_batch_data(batch_df, scaler, model_features, target_encoder, ordinal_encoder), repeats),
+            "compiled_preprocess_ms": _time_call(lambda: preprocessor.transform(batch_columns), repeats),
+            "model_predict_ms": _time_call(lambda: model.predict(features), repeats),
+            "json_serialize_ms": _time_call(lambda: json.dumps({"predictions": [{"predicted_price": p} for p in predictions.tolist()]}), repeats),
+        })
+    return results
+
+
+# --- Reporting ---
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=API_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path: str, candidate_path: str):
+    """Prints how a candidate run moved against a baseline, scenario by scenario."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+
+    def change(old, new):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    base_http = {(r["batch_size"], r["concurrency"]): r for r in baseline.get("http", [])}
+    print(f"{'batch':>6} {'conc':>5} {'p50 ms':>22} {'p99 ms':>22} {'rows/s':>26}")
+    for result in candidate.get("http", []):
+        old = base_http.get((result["batch_size"], result["concurrency"]))
+        if old is None or not old["latency_ms"] or not result["latency_ms"]:
+            continue
+        columns = []
+        for old_value, new_value in (
+            (old["latency_ms"]["p50"], result["latency_ms"]["p50"]),
+            (old["latency_ms"]["p99"], result["latency_ms"]["p99"]),
+            (old["rows_per_second"], result["rows_per_second"]),
+        ):
+            columns.append(f"{old_value:.1f} -> {new_value:.1f} ({change(old_value, new_value)})")
+        print(f"{result['batch_size']:>6} {result['concurrency']:>5} {columns[0]:>22} {columns[1]:>22} {columns[2]:>26}")
+
+    base_stages = {r["batch_size"]: r for r in baseline.get("stages", [])}
+    for result in candidate.get("stages", []):
+        old = base_stages.get(result["batch_size"])
+        if old is None:
+            continue
+        stages = [name for name in result if name.endswith("_ms")]
+        summary = ", ".join(f"{name[:-3]} {change(old[name]['p50'], result[name]['p50'])}" for name in stages if name in old)
+        print(f"stages @ {result['batch_size']} rows (p50): {summary}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-sizes", default="1,10,100,10000", help="Comma-separated rows per request.")
+    parser.add_argument("--concurrency", default="1,8", help="Comma-separated numbers of concurrent clients.")
+    parser.add_argument("--requests", type=int, default=200, help="Timed requests per scenario.")
+    parser.add_argument("--max-rows", type=int, default=500000, help="Caps timed requests so a scenario sends at most this many rows.")
+    parser.add_argument("--warmup-requests", type=int, default=5, help="Untimed requests per scenario.")
+    parser.add_argument("--stage-repeats", type=int, default=20, help="Repetitions of each in-process stage timing.")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET)
+    parser.add_argument("--model-dir", default=os.path.join(tempfile.gettempdir(), "car-price-benchmark-model"), help="Where the stand-in model is trained (reused if present).")
+    parser.add_argument("--server-env", action="append", default=[], metavar="KEY=VALUE", help="Extra environment for the API server.")
+    parser.add_argument("--url", default=None, help="Benchmark an already running API instead of starting one (no RSS figures).")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CANDIDATE"), help="Compare two result files and exit.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+    concurrencies = [int(level) for level in args.concurrency.split(",")]
+    server_env = dict(item.split("=", 1) for item in args.server_env)
+
+    model_dir = train_standin_model(args.dataset, args.model_dir, args.seed)
+    rows = sample_rows(args.dataset, max(batch_sizes), args.seed)
+
+    process, url = (None, args.url) if args.url else start_server(model_dir, server_env)
+    http_results = []
+    try:
+        for batch_size in batch_sizes:
+            payload = json.dumps(rows[:batch_size]).encode()
+            for concurrency in concurrencies:
+                n_requests = max(concurrency, min(args.requests, args.max_rows // batch_size))
+                if process is not None:
+                    reset_peak_rss(process.pid)
+                result = run_scenario(url, payload, batch_size, concurrency, n_requests, args.warmup_requests)
+                result["peak_rss_bytes"] = peak_rss_bytes(process.pid) if process is not None else None
+                http_results.append(result)
+                latency = result["latency_ms"]
+                logging.info(
+                    f"batch={batch_size} concurrency={concurrency}: p50={latency.get('p50', float('nan')):.2f}ms "
+                    f"p99={latency.get('p99', float('nan')):.2f}ms rows/s={result['rows_per_second']:,.0f} errors={result['errors']}"
+                )
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    stage_results = time_stages(model_dir, rows, batch_sizes, args.stage_repeats)
+
+    report = {
+        "meta": {
+            "git_commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "server_env": server_env,
+            "args": vars(args),
+        },
+        "http": http_results,
+        "stages": stage_results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    logging.info(f"Wrote benchmark results to {args.output}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
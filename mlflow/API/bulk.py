@@ -0,0 +1,117 @@
+from typing import BinaryIO, Dict, Iterator, List
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.ipc as pa_ipc
+import pyarrow.parquet as pa_parquet
+
+# Content types accepted by the bulk-scoring endpoint
+CSV_CONTENT_TYPES = ("text/csv", "application/csv")
+ARROW_CONTENT_TYPES = ("application/vnd.apache.arrow.stream", "application/x-arrow-stream")
+PARQUET_CONTENT_TYPES = ("application/vnd.apache.parquet", "application/x-parquet", "application/parquet")
+SUPPORTED_CONTENT_TYPES = CSV_CONTENT_TYPES + ARROW_CONTENT_TYPES + PARQUET_CONTENT_TYPES
+
+
+class BulkInputError(ValueError):
+    """Raised when a bulk upload doesn't match the CarPrice_Assignment.csv layout."""
+
+
+def open_record_batches(source: BinaryIO, content_type: str, numeric_columns: List[str], string_columns: List[str]) -> Iterator[pa.RecordBatch]:
+    """Streams record batches from a CSV, Arrow IPC stream or Parquet upload without reading it whole."""
+    media_type = content_type.split(";")[0].strip().lower()
+    try:
+        if media_type in CSV_CONTENT_TYPES:
+            # Fix the column types up front so every block parses the same way
+            column_types = {name: pa.float64() for name in numeric_columns}
+            column_types.update({name: pa.string() for name in string_columns})
+            reader = pa_csv.open_csv(
+                source,
+                read_options=pa_csv.ReadOptions(block_size=1 << 20),
+                convert_options=pa_csv.ConvertOptions(column_types=column_types)
+            )
+            return _reraise_as_input_errors(reader)
+        if media_type in ARROW_CONTENT_TYPES:
+            return _reraise_as_input_errors(pa_ipc.open_stream(source))
+        if media_type in PARQUET_CONTENT_TYPES:
+            return _reraise_as_input_errors(pa_parquet.ParquetFile(source).iter_batches())
+    except (pa.ArrowInvalid, OSError) as e:
+        raise BulkInputError(f"Could not read the uploaded {media_type} data: {e}")
+    raise BulkInputError(f"Unsupported content type '{media_type}'. Use one of: {', '.join(SUPPORTED_CONTENT_TYPES)}.")
+
+
+def _reraise_as_input_errors(batches) -> Iterator[pa.RecordBatch]:
+    # Malformed data further into the upload only surfaces while iterating
+    try:
+        yield from batches
+    except (pa.ArrowInvalid, OSError) as e:
+        raise BulkInputError(f"Could not read the uploaded data: {e}")
+
+
+def rechunk(batches: Iterator[pa.RecordBatch], chunk_rows: int) -> Iterator[pa.Table]:
+    """Regroups record batches of arbitrary size into tables of exactly `chunk_rows` rows (the last may be shorter)."""
+    buffered: List[pa.RecordBatch] = []
+    buffered_rows = 0
+    for batch in batches:
+        while batch.num_rows:
+            take = min(chunk_rows - buffered_rows, batch.num_rows)
+            buffered.append(batch.slice(0, take))
+            buffered_rows += take
+            batch = batch.slice(take)
+            if buffered_rows == chunk_rows:
+                yield pa.Table.from_batches(buffered)
+                buffered, buffered_rows = [], 0
+    if buffered_rows:
+        yield pa.Table.from_batches(buffered)
+
+
+def validate_schema(schema: pa.Schema, numeric_columns: List[str], string_columns: List[str]):
+    """Checks once per upload that every required column exists with a usable type."""
+    problems = []
+    for name in numeric_columns + string_columns:
+        index = schema.get_field_index(name)
+        if index < 0:
+            problems.append(f"missing column '{name}'")
+            continue
+        field_type = schema.field(index).type
+        if pa.types.is_dictionary(field_type):
+            field_type = field_type.value_type
+        if name in numeric_columns and not (pa.types.is_integer(field_type) or pa.types.is_floating(field_type)):
+            problems.append(f"column '{name}' must be numeric, got {field_type}")
+        if name in string_columns and not (pa.types.is_string(field_type) or pa.types.is_large_string(field_type)):
+            problems.append(f"column '{name}' must be a string, got {field_type}")
+    if problems:
+        raise BulkInputError("; ".join(problems))
+
+
+def restore_integer_columns(table: pa.Table, integer_columns: List[str]) -> pa.Table:
+    """
+    Casts the columns `open_record_batches` parsed from CSV as float64 back to int64 where
+    the layout declares them integers, so IDs copied to an output keep their type.
+    """
+    for name in integer_columns:
+        index = table.schema.get_field_index(name)
+        if index < 0 or not pa.types.is_floating(table.schema.field(index).type):
+            continue
+        try:
+            table = table.set_column(index, name, table.column(index).cast(pa.int64()))
+        except pa.ArrowInvalid:
+            raise BulkInputError(f"column '{name}' must hold whole numbers")
+    return table
+
+
+def table_to_columns(table: pa.Table, numeric_columns: List[str], string_columns: List[str]) -> Dict[str, np.ndarray]:
+    """Converts one validated chunk into the column mapping the preprocessor consumes."""
+    nulls = [name for name in numeric_columns + string_columns if table.column(name).null_count]
+    if nulls:
+        raise BulkInputError(f"null values in required columns: {', '.join(nulls)}")
+
+    columns = {}
+    for name in numeric_columns:
+        columns[name] = table.column(name).cast(pa.float64()).to_numpy()
+    for name in string_columns:
+        column = table.column(name)
+        if pa.types.is_dictionary(column.type):
+            column = column.cast(column.type.value_type)
+        columns[name] = column.to_numpy()
+    return columns
@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import os
+import pickle
+from typing import Any, Optional
+
+import numpy as np
+import xgboost as xgb
+
+# Backends selectable with INFERENCE_BACKEND besides "native" (the XGBoost booster, or pyfunc)
+COMPILED_BACKENDS = ("onnx", "treelite")
+
+
+class OnnxModel:
+    """A model converted to ONNX and run by ONNX Runtime on the CPU; predicts a preprocessed float32 matrix."""
+
+    backend = "onnx"
+
+    def __init__(self, onnx_bytes: bytes, threads: int = 1):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = onnxruntime.InferenceSession(onnx_bytes, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.size_bytes = len(onnx_bytes)
+
+    def predict(self, matrix: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: np.ascontiguousarray(matrix, dtype=np.float32)})[0].ravel()
+
+
+class TreeliteModel:
+    """A tree ensemble compiled to a shared library with Treelite; predicts a preprocessed float32 matrix."""
+
+    backend = "treelite"
+
+    def __init__(self, library_path: str, threads: int = 1):
+        import tl2cgen
+
+        self._dmatrix = tl2cgen.DMatrix
+        self.predictor = tl2cgen.Predictor(library_path, nthread=threads)
+        self.library_path = library_path
+        self.size_bytes = os.path.getsize(library_path)
+
+    def predict(self, matrix: np.ndarray) -> np.ndarray:
+        return self.predictor.predict(self._dmatrix(np.ascontiguousarray(matrix, dtype=np.float32))).ravel()
+
+
+def sklearn_estimator(model) -> Optional[Any]:
+    """Returns the scikit-learn estimator behind a pyfunc model, or None for other flavors."""
+    estimator = getattr(getattr(model, "_model_impl", None), "sklearn_model", None)
+    return estimator if hasattr(estimator, "predict") else None
+
+
+def _fingerprint(estimator) -> str:
+    if isinstance(estimator, xgb.Booster):
+        return hashlib.sha256(bytes(estimator.save_raw(raw_format="ubj"))).hexdigest()
+    return hashlib.sha256(pickle.dumps(estimator, protocol=pickle.HIGHEST_PROTOCOL)).hexdigest()
+
+
+def _to_onnx(estimator, n_features: int) -> bytes:
+    if isinstance(estimator, xgb.Booster):
+        import onnxmltools
+        from onnxmltools.convert.common.data_types import FloatTensorType
+
+        # The converter only understands the default f0, f1, ... feature names
+        booster = estimator.copy()
+        booster.feature_names = None
+        booster.feature_types = None
+        onnx_model = onnxmltools.convert_xgboost(booster, initial_types=[("input", FloatTensorType([None, n_features]))])
+    else:
+        from skl2onnx import convert_sklearn
+        from skl2onnx.common.data_types import FloatTensorType
+
+        onnx_model = convert_sklearn(estimator, initial_types=[("input", FloatTensorType([None, n_features]))])
+    return onnx_model.SerializeToString()
+
+
+def _to_treelite_library(estimator, path: str):
+    import tl2cgen
+    import treelite
+
+    if isinstance(estimator, xgb.Booster):
+        treelite_model = treelite.frontend.from_xgboost(estimator)
+    else:
+        # Tree ensembles only; linear models raise and stay on the native path
+        treelite_model = treelite.sklearn.import_model(estimator)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    tl2cgen.export_lib(treelite_model, toolchain="gcc", libpath=tmp_path, params={"parallel_comp": os.cpu_count() or 1})
+    os.replace(tmp_path, path)
+
+
+def compile_model(estimator, n_features: int, backend: str, cache_dir: str, threads: int = 1):
+    """
+    Converts an XGBoost booster or a scikit-learn estimator for `backend` and loads it.
+    Converted models are kept in `cache_dir` under a hash of the estimator, so restarts and
+    runs sharing a model skip the conversion (Treelite's C compilation takes seconds).
+    Raises ImportError when the backend isn't installed and any other error when the
+    estimator can't be converted.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{_fingerprint(estimator)[:32]}.{'onnx' if backend == 'onnx' else 'so'}")
+
+    if backend == "onnx":
+        if not os.path.exists(path):
+            onnx_bytes = _to_onnx(estimator, n_features)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(onnx_bytes)
+            os.replace(tmp_path, path)
+        with open(path, "rb") as f:
+            return OnnxModel(f.read(), threads)
+
+    if backend == "treelite":
+        if not os.path.exists(path):
+            logging.info(f"Compiling the model with Treelite into {path}")
+            _to_treelite_library(estimator, path)
+        return TreeliteModel(path, threads)
+
+    raise ValueError(f"Unknown inference backend '{backend}'; expected one of {COMPILED_BACKENDS}.")
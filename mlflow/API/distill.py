@@ -0,0 +1,291 @@
+"""
+Builds a compact variant of the production model and registers it when it is accurate enough.
+
+Starts from the teacher, MODEL_NAME@MODEL_STAGE by default, loaded with the API's own
+loading code. Builds compact candidates on the teacher's own features and preprocessing
+artifacts:
+- trim: the teacher's booster cut down to its first trees.
+- shallow: a small XGBoost student.
+- linear: a linear student.
+The students learn the teacher's predictions on CarPrice_Assignment.csv plus synthetic cars
+made by mixing and jittering real ones.
+
+Each candidate is compared with the teacher on real cars held out from the students. Its
+MAE is estimated as the teacher's registered "mae" plus its mean distance from the teacher's
+predictions, an upper bound since |student - price| <= |teacher - price| + |student - teacher|.
+Every candidate is loaded the way the API serves it and its prediction of 1000 preprocessed
+cars is timed. Only candidates within --max-mae-delta of the teacher and faster than it
+qualify. The fastest one is logged with the teacher's preprocessing artifacts and
+registered under --alias, to be served next to the full model:
+
+    SERVED_MODELS=xgboost_regressor@compact, then POST /predict?alias=compact
+
+    python distill.py                                       # teacher: MODEL_NAME@MODEL_STAGE
+    python distill.py --max-mae-delta 100 --candidates trim,shallow
+    python distill.py --local-model-dir <artifact directory> --no-mlflow --output-dir /tmp/compact
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Candidates are loaded and timed in this process, without the API's live monitoring
+os.environ["INFERENCE_WORKERS"] = "0"
+os.environ.setdefault("DRIFT_MONITOR_ENABLED", "false")
+os.environ.setdefault("PREDICTION_LOG_ENABLED", "false")
+
+import app  # noqa: E402
+from drift import DRIFT_PROFILE_ARTIFACT, build_reference_profile  # noqa: E402
+from train import DEFAULT_DATASET, register  # noqa: E402
+
+CANDIDATE_KINDS = ("trim", "shallow", "linear")
+# Share of the teacher's trees kept by the trim candidates
+TRIM_FRACTIONS = (0.1, 0.25, 0.5)
+# (max_depth, n_estimators) of the shallow XGBoost students
+SHALLOW_SHAPES = ((2, 100), (3, 100), (3, 300))
+
+
+# --- Teacher ---
+def load_teacher(args) -> Tuple[app.ModelBundle, Dict[str, str]]:
+    """Loads the teacher bundle and returns it with the local paths of its preprocessing artifacts."""
+    if args.local_model_dir:
+        teacher = app.load_local_bundle(args.local_model_dir)
+        return teacher, {name: os.path.join(args.local_model_dir, name) for name in app.PREPROCESSING_ARTIFACTS}
+
+    client = app.mlflow_client()
+    run_id = args.run_id or client.get_model_version_by_alias(app.MODEL_NAME, app.MODEL_STAGE).run_id
+    teacher = app.load_bundle(client, run_id)
+    # Served from the artifact cache, which load_bundle just filled
+    paths = app.artifact_cache.fetch(run_id, {
+        name: (lambda dst, name=name: client.download_artifacts(run_id, name, dst))
+        for name in app.PREPROCESSING_ARTIFACTS
+    })
+    return teacher, paths
+
+
+# --- Transfer Set ---
+def synthetic_cars(cars: pd.DataFrame, n_rows: int, rng: np.random.Generator, swap_rate: float, jitter: float) -> pd.DataFrame:
+    """
+    Makes cars that stay close to the real ones: each starts as a random real car, then each
+    field is swapped, with probability `swap_rate`, for the same field of another random car.
+    Numeric fields are also jittered by `jitter` standard deviations and clipped to the
+    observed range; integer fields stay integers.
+    """
+    base = rng.integers(0, len(cars), size=n_rows)
+    synthetic = {}
+    for name in cars.columns:
+        values = cars[name].to_numpy()[base].copy()
+        swap = rng.random(n_rows) < swap_rate
+        values[swap] = cars[name].to_numpy()[rng.integers(0, len(cars), size=int(swap.sum()))]
+        if name != "car_ID" and pd.api.types.is_numeric_dtype(cars[name]):
+            column = cars[name].to_numpy(dtype=np.float64)
+            noisy = values.astype(np.float64) + rng.normal(0.0, jitter * column.std(), size=n_rows)
+            noisy = np.clip(noisy, column.min(), column.max())
+            values = np.round(noisy).astype(cars[name].dtype) if pd.api.types.is_integer_dtype(cars[name]) else noisy
+        synthetic[name] = values
+    return pd.DataFrame(synthetic)
+
+
+def to_columns(cars: pd.DataFrame) -> Dict[str, list]:
+    return {name: cars[name].tolist() for name in cars.columns}
+
+
+# --- Candidates ---
+def build_candidates(kinds: List[str], teacher: app.ModelBundle, frame: pd.DataFrame, labels: np.ndarray, seed: int) -> List[Tuple[str, Dict[str, Any], Any]]:
+    """Returns (name, params, model) for each candidate; models are boosters or estimators fitted on `frame`."""
+    candidates = []
+    if "trim" in kinds:
+        if teacher.native_model is None:
+            logging.warning("The teacher isn't served as an XGBoost booster; skipping the trim candidates.")
+        else:
+            booster = teacher.native_model.booster
+            trees = teacher.native_model.iteration_end or booster.num_boosted_rounds()
+            for fraction in TRIM_FRACTIONS:
+                kept = max(1, int(trees * fraction))
+                candidates.append((f"trim-{kept}", {"kind": "trim", "trees": kept}, booster[0:kept]))
+    if "shallow" in kinds:
+        import xgboost as xgb
+
+        for depth, n_trees in SHALLOW_SHAPES:
+            model = xgb.XGBRegressor(max_depth=depth, n_estimators=n_trees, learning_rate=0.1, random_state=seed)
+            candidates.append((f"shallow-d{depth}-{n_trees}", {"kind": "shallow", "max_depth": depth, "n_estimators": n_trees}, model.fit(frame, labels)))
+    if "linear" in kinds:
+        from sklearn.linear_model import Ridge
+
+        candidates.append(("linear", {"kind": "linear", "alpha": 1.0}, Ridge(alpha=1.0).fit(frame, labels)))
+    return candidates
+
+
+def save_candidate(directory: str, model, frame: pd.DataFrame, preprocessing_paths: Dict[str, str]):
+    """Writes a candidate next to copies of the teacher's preprocessing artifacts, in the LOCAL_MODEL_DIR layout."""
+    import xgboost as xgb
+    from mlflow.models import infer_signature
+
+    os.makedirs(directory, exist_ok=True)
+    model_path = os.path.join(directory, "car_price_model")
+    if isinstance(model, xgb.Booster):
+        predictions = model.inplace_predict(frame)
+    else:
+        predictions = model.predict(frame)
+    signature = infer_signature(frame, predictions)
+    if isinstance(model, (xgb.Booster, xgb.XGBModel)):
+        import mlflow.xgboost
+        mlflow.xgboost.save_model(model, model_path, signature=signature)
+    else:
+        import mlflow.sklearn
+        mlflow.sklearn.save_model(model, model_path, signature=signature, serialization_format="cloudpickle")
+    # Unchanged copies, so the variant shares the teacher's preprocessing key and preprocessed batches
+    for name, path in preprocessing_paths.items():
+        shutil.copyfile(path, os.path.join(directory, name))
+
+
+def time_call(call: Callable[[], Any], repeats: int) -> float:
+    """Median seconds per call, after one warm-up call."""
+    call()
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - started)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--run-id", help="Registry run of the teacher (default: the run behind MODEL_NAME@MODEL_STAGE).")
+    source.add_argument("--local-model-dir", help="Local artifact directory of the teacher instead of a registry run.")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="Real cars in the CarPrice_Assignment.csv layout.")
+    parser.add_argument("--candidates", default=",".join(CANDIDATE_KINDS), help="Comma-separated candidate kinds to try.")
+    parser.add_argument("--max-mae-delta", type=float, default=float(os.getenv("DISTILL_MAX_MAE_DELTA", "150")),
+                        help="Largest MAE increase over the teacher's registered mae, in USD (default: DISTILL_MAX_MAE_DELTA or 150).")
+    parser.add_argument("--synthetic-rows", type=int, default=20000, help="Synthetic cars labelled by the teacher.")
+    parser.add_argument("--swap-rate", type=float, default=0.3, help="Chance that a synthetic car takes each field from another car.")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Noise added to numeric fields, in standard deviations.")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Share of real cars kept out of the students to score them on.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--model-name", default=app.MODEL_NAME, help="Registered model name (default: MODEL_NAME).")
+    parser.add_argument("--alias", default="compact", help="Alias pointed at the compact variant.")
+    parser.add_argument("--experiment", default=os.getenv("MLFLOW_EXPERIMENT_NAME", "car_price_prediction"), help="MLflow experiment to log to.")
+    parser.add_argument("--output-dir", help="Also write the chosen variant here, in the LOCAL_MODEL_DIR layout.")
+    parser.add_argument("--no-mlflow", action="store_true", help="Skip logging and registering (needs --output-dir).")
+    args = parser.parse_args()
+
+    if args.no_mlflow and not args.output_dir:
+        raise SystemExit("--no-mlflow needs --output-dir, or the compact model goes nowhere.")
+    kinds = [kind.strip() for kind in args.candidates.split(",") if kind.strip()]
+    unknown = [kind for kind in kinds if kind not in CANDIDATE_KINDS]
+    if unknown:
+        raise SystemExit(f"Unknown candidates: {', '.join(unknown)}. Choose from {', '.join(CANDIDATE_KINDS)}.")
+
+    teacher, preprocessing_paths = load_teacher(args)
+    rng = np.random.default_rng(args.seed)
+
+    # Real cars are split before any synthetic car is made, so held-out cars never leak in
+    df = pd.read_csv(args.dataset)
+    held_out = rng.random(len(df)) < args.holdout
+    train_cars = df.loc[~held_out].drop(columns=["price"]).reset_index(drop=True)
+    holdout_cars = df.loc[held_out].drop(columns=["price"]).reset_index(drop=True)
+    holdout_prices = df.loc[held_out, "price"].to_numpy(dtype=np.float64)
+
+    transfer_cars = pd.concat([train_cars, synthetic_cars(train_cars, args.synthetic_rows, rng, args.swap_rate, args.jitter)], ignore_index=True)
+    transfer_columns = to_columns(transfer_cars)
+    frame = teacher.preprocessor.to_frame(teacher.preprocessor.transform(transfer_columns))
+    labels = np.asarray(app.predict_array(teacher, transfer_columns), dtype=np.float64)
+    logging.info(f"Labelled {len(transfer_cars):,} cars with the teacher ({len(train_cars)} real, {args.synthetic_rows:,} synthetic).")
+
+    holdout_columns = to_columns(holdout_cars)
+    teacher_holdout = np.asarray(app.predict_array(teacher, holdout_columns), dtype=np.float64)
+    teacher_holdout_mae = float(np.mean(np.abs(teacher_holdout - holdout_prices)))
+    # Without a registered mae (a bare local model) the teacher's held-out error is the baseline
+    teacher_mae = teacher.mae if teacher.mae > 0 else teacher_holdout_mae
+
+    # Preprocessing is the teacher's for every candidate, so only the model itself is timed
+    single_row = teacher.preprocessor.transform(to_columns(holdout_cars.head(1)))
+    batch = teacher.preprocessor.transform(to_columns(pd.concat([holdout_cars] * (1000 // len(holdout_cars) + 1), ignore_index=True).head(1000)))
+    teacher_latency = time_call(lambda: app.predict_matrix(teacher, single_row), 1000)
+    teacher_batch_latency = time_call(lambda: app.predict_matrix(teacher, batch), 50)
+    logging.info(
+        f"Teacher: registered MAE {teacher.mae:,.2f}, held-out MAE {teacher_holdout_mae:,.2f}, "
+        f"{teacher_latency * 1e6:,.0f}us per single-car prediction, {teacher_batch_latency * 1e3:,.2f}ms per 1000 cars."
+    )
+
+    all_columns = to_columns(df.drop(columns=["price"]))
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="distill-")
+    try:
+        for name, params, model in build_candidates(kinds, teacher, frame, labels, args.seed):
+            directory = os.path.join(work_dir, name)
+            save_candidate(directory, model, frame, preprocessing_paths)
+            # Loaded and timed exactly as the API would serve it, INFERENCE_BACKEND included
+            bundle = app.load_local_bundle(directory)
+            holdout = np.asarray(app.predict_array(bundle, holdout_columns), dtype=np.float64)
+            fidelity_mae = float(np.mean(np.abs(holdout - teacher_holdout)))
+            metrics = {
+                # The held-out cars may be in the teacher's training data, so its error on them
+                # understates the real one; the bound is taken from the registered mae instead
+                "mae": teacher_mae + fidelity_mae,
+                "teacher_mae": teacher_mae,
+                "fidelity_mae": fidelity_mae,
+                "holdout_mae": float(np.mean(np.abs(holdout - holdout_prices))),
+                "teacher_holdout_mae": teacher_holdout_mae,
+                "latency_1_row_seconds": time_call(lambda: app.predict_matrix(bundle, single_row), 1000),
+                "latency_1000_rows_seconds": time_call(lambda: app.predict_matrix(bundle, batch), 50),
+                "teacher_latency_1_row_seconds": teacher_latency,
+                "teacher_latency_1000_rows_seconds": teacher_batch_latency
+            }
+            qualifies = fidelity_mae <= args.max_mae_delta and metrics["latency_1000_rows_seconds"] < teacher_batch_latency
+            logging.info(
+                f"{name}: MAE at most {metrics['mae']:,.2f} ({fidelity_mae:+,.2f} vs the teacher, "
+                f"{'within' if fidelity_mae <= args.max_mae_delta else 'over'} {args.max_mae_delta:g}), "
+                f"{metrics['latency_1_row_seconds'] * 1e6:,.0f}us per single-car prediction, "
+                f"{metrics['latency_1000_rows_seconds'] * 1e3:,.2f}ms per 1000 cars."
+            )
+            if qualifies:
+                with open(os.path.join(directory, "metrics.json"), "w") as f:
+                    json.dump(metrics, f)
+                with open(os.path.join(directory, DRIFT_PROFILE_ARTIFACT), "w") as f:
+                    json.dump(build_reference_profile(all_columns, app.predict_array(bundle, all_columns)), f)
+                results.append((metrics["latency_1000_rows_seconds"], metrics["mae"], name, params, metrics, directory))
+
+        if not results:
+            raise SystemExit(f"No candidate was both faster than the teacher and within {args.max_mae_delta:g} of its MAE ({teacher_mae:,.2f}); nothing registered.")
+        # A single car's time is mostly fixed per-call overhead, the same for every tree model;
+        # the time per 1000 cars is what a smaller model actually saves
+        _, _, name, params, metrics, directory = min(results, key=lambda result: result[:2])
+        logging.info(
+            f"Chose {name}: {metrics['latency_1000_rows_seconds'] * 1e3:,.2f}ms vs the teacher's "
+            f"{teacher_batch_latency * 1e3:,.2f}ms per 1000 cars, MAE at most {metrics['mae']:,.2f}."
+        )
+
+        if args.output_dir:
+            shutil.copytree(directory, args.output_dir, dirs_exist_ok=True)
+            logging.info(f"Wrote {name} to {args.output_dir}; serve it with LOCAL_MODEL_DIR={args.output_dir}.")
+        if args.no_mlflow:
+            return
+
+        import mlflow
+
+        experiment_id = mlflow.set_experiment(args.experiment).experiment_id
+        if experiment_id != "1":
+            # app.load_bundle downloads from s3://mlflow/1/<run_id>/artifacts
+            logging.warning(f"Experiment '{args.experiment}' has id {experiment_id}; the API loads registry runs from experiment 1.")
+        with mlflow.start_run(run_name=f"car_price_compact_{name}") as run:
+            mlflow.set_tags({"model_family": f"compact-{params['kind']}", "distilled_from": teacher.run_id})
+            mlflow.log_params({**params, "max_mae_delta": args.max_mae_delta, "synthetic_rows": args.synthetic_rows})
+            mlflow.log_metrics(metrics)
+            mlflow.log_artifacts(directory)
+        register(run.info.run_id, args.model_name, args.alias)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+import csv
+import logging
+import queue
+import threading
+import zlib
+from typing import Any, Dict, Mapping, Optional, Sequence
+
+import numpy as np
+
+# --- Monitored Features ---
+# car_ID is an identifier and CarName is summarized by its brand, like in preprocessing
+NUMERIC_DRIFT_FEATURES = [
+    'symboling', 'wheelbase', 'carlength', 'carwidth', 'carheight', 'curbweight', 'enginesize',
+    'boreratio', 'stroke', 'compressionratio', 'horsepower', 'peakrpm', 'citympg', 'highwaympg'
+]
+CATEGORICAL_DRIFT_FEATURES = [
+    'carbrand', 'fueltype', 'aspiration', 'doornumber', 'carbody', 'drivewheel', 'enginelocation',
+    'enginetype', 'cylindernumber', 'fuelsystem'
+]
+
+# Artifact name of a reference profile logged with a training run
+DRIFT_PROFILE_ARTIFACT = "drift_reference.json"
+
+# Floor for empty bins so PSI stays finite
+_PSI_EPSILON = 1e-4
+
+
+def read_dataset_columns(path: str) -> Dict[str, list]:
+    """Reads a CSV in the CarPrice_Assignment.csv layout into columns, without pandas."""
+    def convert(value: str) -> Any:
+        for cast in (int, float):
+            try:
+                return cast(value)
+            except ValueError:
+                pass
+        return value
+
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    names = [name for name in (rows[0] if rows else {}) if name != 'price']
+    return {name: [convert(row[name]) for row in rows] for name in names}
+
+
+def _numeric_column(batch: Mapping[str, Any], name: str) -> np.ndarray:
+    try:
+        values = np.asarray(batch[name], dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.empty(0)
+    return values[np.isfinite(values)]
+
+
+def _category_counts(batch: Mapping[str, Any], name: str) -> Dict[str, int]:
+    """Counts the normalized categories of a column, normalizing each distinct value once."""
+    source = 'CarName' if name == 'carbrand' else name
+    values, counts = np.unique(np.asarray(batch[source], dtype=str), return_counts=True)
+    totals: Dict[str, int] = {}
+    for value, count in zip(values.tolist(), counts.tolist()):
+        category = value.partition(' ')[0].lower() if name == 'carbrand' else value.lower()
+        totals[category] = totals.get(category, 0) + count
+    return totals
+
+
+def _bin_counts(edges: np.ndarray, values: np.ndarray) -> np.ndarray:
+    return np.bincount(np.searchsorted(edges, values, side="right"), minlength=len(edges) + 1)
+
+
+def _numeric_profile(values: np.ndarray, bins: int) -> Dict[str, list]:
+    # Quantile edges give every reference bin roughly the same mass
+    edges = np.unique(np.quantile(values, np.linspace(0.0, 1.0, bins + 1)[1:-1]))
+    counts = _bin_counts(edges, values)
+    return {"edges": edges.tolist(), "proportions": (counts / counts.sum()).tolist()}
+
+
+def build_reference_profile(batch: Mapping[str, Any], predictions: Sequence[float], bins: int = 10) -> Dict[str, Any]:
+    """
+    Summarizes reference data (normally the training set) and the model's predictions on it:
+    quantile-binned proportions for numeric features and predictions, and category
+    proportions for categorical features.
+    """
+    profile: Dict[str, Any] = {"rows": len(predictions), "numeric": {}, "categorical": {}}
+    for name in NUMERIC_DRIFT_FEATURES:
+        values = _numeric_column(batch, name)
+        if values.size:
+            profile["numeric"][name] = _numeric_profile(values, bins)
+    for name in CATEGORICAL_DRIFT_FEATURES:
+        if name in batch or (name == 'carbrand' and 'CarName' in batch):
+            counts = _category_counts(batch, name)
+            total = sum(counts.values())
+            profile["categorical"][name] = {category: count / total for category, count in counts.items()}
+    profile["prediction"] = _numeric_profile(np.asarray(predictions, dtype=np.float64), bins)
+    return profile
+
+
+def psi(expected: np.ndarray, actual: np.ndarray) -> float:
+    """Population stability index of two proportion vectors over the same bins."""
+    expected = np.maximum(expected, _PSI_EPSILON)
+    actual = np.maximum(actual, _PSI_EPSILON)
+    return float(np.sum((actual - expected) * np.log(actual / expected)))
+
+
+def ks(expected: np.ndarray, actual: np.ndarray) -> float:
+    """Kolmogorov-Smirnov statistic of two binned distributions, evaluated at the bin edges."""
+    return float(np.max(np.abs(np.cumsum(expected) - np.cumsum(actual))))
+
+
+class HistogramSketch:
+    """Counts of values per reference bin; memory is fixed by the reference edges."""
+
+    def __init__(self, reference: Mapping[str, list]):
+        self.edges = np.asarray(reference["edges"], dtype=np.float64)
+        self.expected = np.asarray(reference["proportions"], dtype=np.float64)
+        self.counts = np.zeros(len(self.expected), dtype=np.int64)
+
+    def update(self, values: np.ndarray):
+        self.counts += _bin_counts(self.edges, values)
+
+    def scores(self):
+        total = self.counts.sum()
+        if total == 0:
+            return None
+        actual = self.counts / total
+        return psi(self.expected, actual), ks(self.expected, actual)
+
+
+class CountMinSketch:
+    """
+    Approximate category counts in a fixed `depth` x `width` table. Estimates never
+    undercount; collisions can only inflate them.
+    """
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        self._rows = np.arange(depth)[:, None]
+
+    def _indices(self, keys: Sequence[str]) -> np.ndarray:
+        return np.array(
+            [[zlib.crc32(key.encode(), seed) % self.width for key in keys] for seed in range(self.depth)],
+            dtype=np.int64
+        ).reshape(self.depth, len(keys))
+
+    def update(self, counts: Mapping[str, int]):
+        if not counts:
+            return
+        np.add.at(self.table, (self._rows, self._indices(list(counts))), np.fromiter(counts.values(), dtype=np.int64))
+        self.total += sum(counts.values())
+
+    def estimate(self, keys: Sequence[str]) -> np.ndarray:
+        return self.table[self._rows, self._indices(keys)].min(axis=0)
+
+
+class CategoricalSketch:
+    """Count-min sketch of one categorical feature, compared on the reference categories."""
+
+    def __init__(self, reference: Mapping[str, float], width: int, depth: int):
+        self.categories = list(reference)
+        self.expected = np.append(np.asarray(list(reference.values()), dtype=np.float64), 0.0)
+        self.sketch = CountMinSketch(width, depth)
+
+    def update(self, counts: Mapping[str, int]):
+        self.sketch.update(counts)
+
+    def scores(self):
+        total = self.sketch.total
+        if total == 0:
+            return None
+        known = np.minimum(self.sketch.estimate(self.categories), total).astype(np.float64)
+        # Whatever the reference categories don't account for went to unseen categories
+        actual = np.append(known, max(total - known.sum(), 0.0)) / total
+        return psi(self.expected, actual), None
+
+
+class _Window:
+    """Sketches of the traffic served by one model since the window started."""
+
+    def __init__(self, run_id: str, profile: Mapping[str, Any], cms_width: int, cms_depth: int):
+        self.run_id = run_id
+        self.rows = 0
+        self.numeric = {name: HistogramSketch(reference) for name, reference in profile.get("numeric", {}).items()}
+        self.categorical = {name: CategoricalSketch(reference, cms_width, cms_depth) for name, reference in profile.get("categorical", {}).items()}
+        self.prediction = HistogramSketch(profile["prediction"])
+
+    def update(self, batch: Mapping[str, Any], predictions: np.ndarray):
+        for name, sketch in self.numeric.items():
+            if name in batch:
+                sketch.update(_numeric_column(batch, name))
+        for name, sketch in self.categorical.items():
+            sketch.update(_category_counts(batch, name))
+        self.prediction.update(predictions[np.isfinite(predictions)])
+        self.rows += len(predictions)
+
+
+class DriftMonitor:
+    """
+    Compares live traffic with a model's reference profile and publishes PSI and KS scores.
+
+    `submit()` only enqueues the batch; a background thread updates the sketches with
+    vectorized per-batch operations, so monitoring adds no latency to requests. When the
+    queue is full the batch is dropped and counted instead of blocking. Scores cover a
+    tumbling window of `window_rows` rows and are published once it holds `min_rows`.
+    """
+
+    def __init__(
+        self,
+        window_rows: int,
+        min_rows: int,
+        queue_size: int,
+        feature_psi_gauge,
+        feature_ks_gauge,
+        prediction_psi_gauge,
+        prediction_ks_gauge,
+        window_rows_gauge,
+        dropped_counter,
+        cms_width: int = 2048,
+        cms_depth: int = 4
+    ):
+        self.window_rows = window_rows
+        self.min_rows = min_rows
+        self.cms_width = cms_width
+        self.cms_depth = cms_depth
+        self._feature_psi_gauge = feature_psi_gauge
+        self._feature_ks_gauge = feature_ks_gauge
+        self._prediction_psi_gauge = prediction_psi_gauge
+        self._prediction_ks_gauge = prediction_ks_gauge
+        self._window_rows_gauge = window_rows_gauge
+        self._dropped_counter = dropped_counter
+        self._queue: "queue.Queue" = queue.Queue(maxsize=queue_size)
+        self._window: Optional[_Window] = None
+        self._thread = threading.Thread(target=self._run, name="drift-monitor", daemon=True)
+        self._thread.start()
+
+    def submit(self, run_id: str, profile: Optional[Mapping[str, Any]], batch: Mapping[str, Any], predictions: Any):
+        """Queues a served batch for monitoring. Never blocks."""
+        if profile is None:
+            return
+        try:
+            self._queue.put_nowait((run_id, profile, batch, predictions))
+        except queue.Full:
+            self._dropped_counter.inc()
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            try:
+                self._update(*item)
+            except Exception as e:
+                logging.error(f"Drift monitor failed to process a batch: {e}", exc_info=True)
+
+    def _update(self, run_id: str, profile: Mapping[str, Any], batch: Mapping[str, Any], predictions: Any):
+        if self._window is None or self._window.run_id != run_id:
+            # A new model is compared against its own reference from scratch
+            self._window = _Window(run_id, profile, self.cms_width, self.cms_depth)
+        window = self._window
+        window.update(batch, np.asarray(predictions, dtype=np.float64).ravel())
+
+        if window.rows >= self.min_rows:
+            self._publish(window)
+        if window.rows >= self.window_rows:
+            # The published scores stay until the next window has enough rows
+            self._window = _Window(run_id, profile, self.cms_width, self.cms_depth)
+        self._window_rows_gauge.set(self._window.rows)
+
+    def _publish(self, window: _Window):
+        for name, sketch in [*window.numeric.items(), *window.categorical.items()]:
+            scores = sketch.scores()
+            if scores is None:
+                continue
+            psi_score, ks_score = scores
+            self._feature_psi_gauge.labels(feature=name).set(psi_score)
+            if ks_score is not None:
+                self._feature_ks_gauge.labels(feature=name).set(ks_score)
+        scores = window.prediction.scores()
+        if scores is not None:
+            self._prediction_psi_gauge.set(scores[0])
+            self._prediction_ks_gauge.set(scores[1])
@@ -0,0 +1,75 @@
+"""
+Exports the served model as a single bundle file for slim serving (SERVING_BUNDLE_PATH).
+
+The bundle holds the native XGBoost booster and the compiled preprocessor detached from the
+fitted scaler and encoders, so the API can serve it without mlflow, scikit-learn or pandas.
+
+    python export_bundle.py --output /models/car-price.bundle               # MODEL_NAME@MODEL_STAGE
+    python export_bundle.py --output car-price.bundle --run-id <run_id>
+    python export_bundle.py --output car-price.bundle --local-model-dir <artifact directory>
+"""
+import argparse
+import logging
+import os
+import time
+
+import numpy as np
+
+import app
+from inference_pool import read_bundle, write_bundle
+from model_bundle import warmup_batch
+
+DEFAULT_DATASET = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "CarPrice_Assignment.csv")
+
+
+def verify_export(path: str, bundle, dataset_path: str):
+    """Checks that the exported file predicts what the pyfunc model does on the dataset."""
+    import pandas as pd
+
+    booster, preprocessor, iteration_end = read_bundle(path)
+    if os.path.exists(dataset_path):
+        frame = pd.read_csv(dataset_path).drop(columns=["price"], errors="ignore")
+        batch = {name: frame[name].tolist() for name in frame.columns}
+    else:
+        batch = warmup_batch()
+
+    expected = np.asarray(bundle.model.predict(bundle.preprocessor.to_frame(bundle.preprocessor.transform(batch))), dtype=np.float64)
+    actual = booster.inplace_predict(preprocessor.transform(batch), iteration_range=(0, iteration_end))
+    if not np.allclose(expected, actual, rtol=1e-6, atol=1e-3):
+        raise ValueError("Exported bundle predictions differ from the pyfunc model.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", required=True, help="Bundle file to write.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--run-id", help="Registry run to export (default: the run behind MODEL_NAME@MODEL_STAGE).")
+    source.add_argument("--local-model-dir", help="Local artifact directory to export instead of a registry run.")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="Rows used to verify the export.")
+    args = parser.parse_args()
+
+    if args.local_model_dir:
+        bundle = app.load_local_bundle(args.local_model_dir)
+    else:
+        client = app.mlflow_client()
+        run_id = args.run_id or client.get_model_version_by_alias(app.MODEL_NAME, app.MODEL_STAGE).run_id
+        bundle = app.load_bundle(client, run_id)
+
+    if bundle.native_model is None or not bundle.preprocessor.compiled:
+        raise SystemExit("This model can't be served slim: it needs the pyfunc model or the pandas preprocessing path.")
+
+    tmp_path = f"{args.output}.export"
+    write_bundle(
+        tmp_path,
+        bundle.native_model.booster,
+        bundle.preprocessor.detached(),
+        bundle.native_model.iteration_end,
+        {"run_id": bundle.run_id, "mae": bundle.mae, "exported_at": time.time(), "drift_profile": bundle.drift_profile}
+    )
+    verify_export(tmp_path, bundle, args.dataset)
+    os.replace(tmp_path, args.output)
+    logging.info(f"Exported run {bundle.run_id} to {args.output} ({os.path.getsize(args.output):,} bytes).")
+
+
+if __name__ == "__main__":
+    main()
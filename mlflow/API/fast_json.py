@@ -0,0 +1,37 @@
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    # The standard library encoder is used instead; it is roughly 10x slower on large arrays
+    orjson = None
+
+
+def float_array_json(values) -> bytes:
+    """Serializes numbers as a compact JSON array, straight from the NumPy array when orjson is installed."""
+    # float64 so values are written exactly like Python floats, whatever dtype the model returned
+    values = np.ascontiguousarray(values, dtype=np.float64).ravel()
+    if orjson is not None:
+        return orjson.dumps(values, option=orjson.OPT_SERIALIZE_NUMPY)
+    items = values.tolist()
+    finite = np.isfinite(values)
+    if not finite.all():
+        # null, as orjson writes them; bare NaN and Infinity aren't valid JSON
+        items = [value if ok else None for value, ok in zip(items, finite.tolist())]
+    return json.dumps(items, separators=(",", ":"), allow_nan=False).encode()
+
+
+def columnar_json(name: str, values) -> bytes:
+    """A single {name: [values...]} object."""
+    return b'{' + json.dumps(name).encode() + b':' + float_array_json(values) + b'}'
+
+
+def ndjson_records(name: str, values) -> bytes:
+    """One {name: value} line per value, each terminated by a newline."""
+    if len(values) == 0:
+        return b""
+    prefix = b'{' + json.dumps(name).encode() + b':'
+    # Numbers never contain commas, so the array's separators become the line breaks
+    return prefix + float_array_json(values)[1:-1].replace(b",", b"}\n" + prefix) + b"}\n"
@@ -0,0 +1,323 @@
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import xgboost as xgb
+
+# Layout of a bundle file: 8-byte little-endian header length, a JSON header with the
+# offsets of each section, then the pickled preprocessor and the raw XGBoost booster (UBJSON).
+_HEADER_SIZE_BYTES = 8
+
+# fork shares the parent's loaded models with the workers; spawn workers read bundle files.
+# fork isn't safe on macOS, where system libraries may hold locks across it.
+DEFAULT_START_METHOD = "fork" if sys.platform.startswith("linux") else "spawn"
+
+# How long a retired bundle file is kept for tasks that were queued before the swap
+RETIRED_BUNDLE_GRACE_SECONDS = 300
+
+
+def native_booster(model) -> Tuple[Optional[xgb.Booster], int]:
+    """Returns the XGBoost booster behind a pyfunc model and the number of trees its predict uses."""
+    raw = None
+    if hasattr(model, "get_raw_model"):
+        try:
+            raw = model.get_raw_model()
+        except Exception:
+            raw = None
+    if raw is None:
+        raw = getattr(getattr(model, "_model_impl", None), "xgb_model", None)
+
+    if isinstance(raw, xgb.Booster):
+        return raw, 0
+    if hasattr(raw, "get_booster"):
+        # The sklearn wrapper predicts with the early-stopping iteration when one was recorded
+        try:
+            iteration_end = int(raw.best_iteration) + 1
+        except (AttributeError, TypeError, ValueError):
+            iteration_end = 0
+        return raw.get_booster(), iteration_end
+    return None, 0
+
+
+class NativeModel:
+    """An XGBoost booster that predicts a preprocessed float32 matrix directly, without pandas or pyfunc."""
+
+    def __init__(self, booster: xgb.Booster, iteration_end: int = 0):
+        self.booster = booster
+        self.iteration_end = iteration_end
+
+    def predict(self, matrix: np.ndarray) -> np.ndarray:
+        return self.booster.inplace_predict(matrix, iteration_range=(0, self.iteration_end))
+
+    def explain(self, matrix: np.ndarray, approximate: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the predictions and XGBoost's TreeSHAP contributions (`pred_contribs`) of a
+        preprocessed matrix: one column per model feature plus the bias in the last column.
+        `approximate` uses XGBoost's much cheaper per-path attribution instead of exact SHAP values.
+        """
+        dmatrix = xgb.DMatrix(matrix, feature_names=self.booster.feature_names, feature_types=self.booster.feature_types)
+        contributions = self.booster.predict(
+            dmatrix,
+            pred_contribs=True,
+            approx_contribs=approximate,
+            iteration_range=(0, self.iteration_end)
+        )
+        return self.predict(matrix), contributions
+
+
+def export_native_model(model, preprocessor) -> Optional[NativeModel]:
+    """
+    Returns the native booster behind a pyfunc model if it predicts exactly what the pyfunc
+    model does on preprocessed input, or None if the model must be served through pyfunc.
+    """
+    booster, iteration_end = native_booster(model)
+    if booster is None:
+        logging.warning("Loaded model is not an XGBoost model; serving it through pyfunc.")
+        return None
+
+    probe = np.random.default_rng(0).normal(size=(64, len(preprocessor.model_features))).astype(np.float32)
+    expected = np.asarray(model.predict(preprocessor.to_frame(probe)), dtype=np.float64)
+    native_model = NativeModel(booster, iteration_end)
+    if not np.allclose(expected, native_model.predict(probe), rtol=1e-6, atol=1e-3):
+        logging.warning("Native booster predictions differ from the pyfunc model; serving it through pyfunc.")
+        return None
+    return native_model
+
+
+def write_bundle(path: str, booster: xgb.Booster, preprocessor, iteration_end: int, metadata: Optional[dict] = None):
+    """
+    Serializes the booster and preprocessor into a single file that workers without a shared
+    copy of the model (spawned ones) load from.
+    `metadata` (e.g. run_id and mae) is stored in the header and read back by `read_bundle_metadata`.
+    """
+    preprocessor_blob = pickle.dumps(preprocessor, protocol=pickle.HIGHEST_PROTOCOL)
+    booster_blob = bytes(booster.save_raw(raw_format="ubj"))
+
+    # Section offsets are relative to the end of the header
+    header = {
+        "iteration_end": iteration_end,
+        "metadata": metadata or {},
+        "preprocessor": [0, len(preprocessor_blob)],
+        "booster": [len(preprocessor_blob), len(booster_blob)]
+    }
+    header_blob = json.dumps(header).encode()
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(len(header_blob).to_bytes(_HEADER_SIZE_BYTES, "little"))
+        f.write(header_blob)
+        f.write(preprocessor_blob)
+        f.write(booster_blob)
+    os.replace(tmp_path, path)
+
+
+def read_bundle(path: str):
+    """Rebuilds (booster, preprocessor, iteration_end) from a bundle file, as private copies of this process."""
+    with open(path, "rb") as f:
+        header_size = int.from_bytes(f.read(_HEADER_SIZE_BYTES), "little")
+        header = json.loads(f.read(header_size))
+        body = _HEADER_SIZE_BYTES + header_size
+        offset, size = header["preprocessor"]
+        f.seek(body + offset)
+        preprocessor = pickle.loads(f.read(size))
+        offset, size = header["booster"]
+        # Read straight into the buffer XGBoost loads from, so the booster is copied only once more
+        raw = bytearray(size)
+        f.seek(body + offset)
+        f.readinto(raw)
+    booster = xgb.Booster()
+    booster.load_model(raw)
+    return booster, preprocessor, header["iteration_end"]
+
+
+def read_bundle_metadata(path: str) -> dict:
+    """Reads only the metadata stored in a bundle file's header."""
+    with open(path, "rb") as f:
+        header_size = int.from_bytes(f.read(_HEADER_SIZE_BYTES), "little")
+        return json.loads(f.read(header_size)).get("metadata", {})
+
+
+# --- Worker Process State ---
+# Bundles kept loaded in each worker, so alternating between served models doesn't reload them
+WORKER_MAX_BUNDLES = int(os.getenv("INFERENCE_WORKER_MAX_BUNDLES", "4"))
+
+# Models published by the parent, by bundle path. Forked workers inherit them and use the
+# parent's pages copy-on-write instead of loading their own copies.
+_shared_bundles: Dict[str, Tuple[xgb.Booster, object, int]] = {}
+
+_worker_bundles: "OrderedDict[str, Tuple[xgb.Booster, object, int]]" = OrderedDict()
+_worker_booster = None
+_worker_preprocessor = None
+_worker_iteration_end = 0
+
+
+def _worker_load(bundle_path: str):
+    """
+    Makes a bundle the active one in this worker: the copy shared by the parent when this
+    worker was forked after it was published, otherwise one read from its file.
+    """
+    global _worker_booster, _worker_preprocessor, _worker_iteration_end
+
+    if bundle_path in _worker_bundles:
+        _worker_bundles.move_to_end(bundle_path)
+    else:
+        shared = _shared_bundles.get(bundle_path)
+        booster, preprocessor, iteration_end = shared if shared is not None else read_bundle(bundle_path)
+        # Each worker already gets a share of the cores; keep XGBoost from oversubscribing them
+        booster.set_param({"nthread": 1})
+        _worker_bundles[bundle_path] = (booster, preprocessor, iteration_end)
+        while len(_worker_bundles) > max(1, WORKER_MAX_BUNDLES):
+            _worker_bundles.popitem(last=False)
+    _worker_booster, _worker_preprocessor, _worker_iteration_end = _worker_bundles[bundle_path]
+
+
+def _worker_ready(bundle_path: str):
+    _worker_load(bundle_path)
+
+
+def _worker_predict(bundle_path: str, input_batch: Dict[str, list]) -> Tuple[np.ndarray, float]:
+    """
+    Runs preprocessing and prediction inside a worker, reloading if a newer bundle was published.
+    Also returns the seconds spent preprocessing, so the parent can report it as its own stage.
+    """
+    _worker_load(bundle_path)
+    started = time.perf_counter()
+    processed = _worker_preprocessor.transform(input_batch)
+    preprocess_seconds = time.perf_counter() - started
+    return _worker_booster.inplace_predict(processed, iteration_range=(0, _worker_iteration_end)), preprocess_seconds
+
+
+def _worker_predict_matrix(bundle_path: str, matrix: np.ndarray) -> np.ndarray:
+    """Predicts an already preprocessed matrix inside a worker."""
+    _worker_load(bundle_path)
+    return _worker_booster.inplace_predict(matrix, iteration_range=(0, _worker_iteration_end))
+
+
+def _worker_explain(bundle_path: str, matrix: np.ndarray, approximate: bool) -> Tuple[np.ndarray, np.ndarray]:
+    """Computes predictions and feature contributions of a preprocessed matrix inside a worker."""
+    _worker_load(bundle_path)
+    return NativeModel(_worker_booster, _worker_iteration_end).explain(matrix, approximate)
+
+
+class InferencePool:
+    """
+    Pool of worker processes that run preprocessing and XGBoost inference outside the GIL.
+
+    The parent loads the model once and publishes it under a versioned bundle path that
+    every task names. With the fork start method (the default on Linux) publishing forks a
+    fresh set of workers that inherit the parent's loaded models, so the booster and lookup
+    tables are shared copy-on-write rather than copied into each worker; the previous
+    workers finish the tasks already queued on them and exit. Only the pages a worker
+    writes, such as its Python object headers, become its own.
+
+    With spawn, workers keep running across reloads and load each bundle from its file on
+    their next task, from a RAM-backed directory when one is available; each then holds
+    its own copy of the model.
+    """
+
+    def __init__(self, workers: int, bundle_dir: Optional[str] = None, start_method: str = DEFAULT_START_METHOD):
+        self.workers = workers
+        self.start_method = start_method
+        default_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+        self.bundle_dir = bundle_dir or os.path.join(default_dir, f"car-price-bundles-{os.getpid()}")
+        os.makedirs(self.bundle_dir, exist_ok=True)
+
+        self._version = 0
+        self._retired: Dict[str, float] = {}
+        self._executor = self._new_executor() if start_method != "fork" else None
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(self.start_method))
+
+    def publish(self, native_model: NativeModel, preprocessor) -> str:
+        """Exports a verified native model (see `export_native_model`) for the workers and returns its bundle path."""
+        self._version += 1
+        bundle_path = os.path.join(self.bundle_dir, f"bundle-{self._version}.bin")
+        write_bundle(bundle_path, native_model.booster, preprocessor, native_model.iteration_end)
+        self._remove_retired()
+        if self.start_method == "fork":
+            _shared_bundles[bundle_path] = (native_model.booster, preprocessor, native_model.iteration_end)
+            self._refork(bundle_path)
+        logging.info(f"Published model bundle {bundle_path} to {self.workers} inference workers ({self.start_method}).")
+        return bundle_path
+
+    def _refork(self, bundle_path: str):
+        """Forks workers that inherit every model published so far, then retires the old ones."""
+        executor = self._new_executor()
+        # A fork pool starts all its workers on the first task; start them now, not on a request
+        for future in [executor.submit(_worker_ready, bundle_path) for _ in range(self.workers)]:
+            future.result()
+        previous, self._executor = self._executor, executor
+        if previous is not None:
+            # Tasks already queued there still run; the old workers exit once it drains
+            previous.shutdown(wait=False)
+        logging.info(f"Forked {self.workers} inference workers sharing {len(_shared_bundles)} published models.")
+
+    def _submit(self, fn, *args) -> Future:
+        executor = self._executor
+        try:
+            return executor.submit(fn, *args)
+        except RuntimeError:
+            # Retired by a publish between reading and using it; the new workers have the bundle too
+            if executor is self._executor:
+                raise
+            return self._executor.submit(fn, *args)
+
+    def retire(self, bundle_path: Optional[str]):
+        """Marks a bundle as no longer served; its file is removed after a grace period."""
+        if bundle_path is not None:
+            self._retired[bundle_path] = time.time()
+        self._remove_retired()
+
+    def _remove_retired(self):
+        # Requests that captured a retired bundle may still be queued for a worker
+        now = time.time()
+        for path, retired_at in list(self._retired.items()):
+            if now - retired_at >= RETIRED_BUNDLE_GRACE_SECONDS:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                del self._retired[path]
+                # Workers forked from here on no longer inherit it
+                _shared_bundles.pop(path, None)
+
+    def predict(self, bundle_path: str, input_batch: Dict[str, list]) -> Tuple[np.ndarray, float]:
+        """
+        Runs one batch on a worker process with the given bundle. Blocks until its predictions
+        are back and returns them with the seconds the worker spent preprocessing.
+        """
+        return self.submit(bundle_path, input_batch).result()
+
+    def submit(self, bundle_path: str, input_batch: Dict[str, list]) -> Future:
+        """Queues one batch like `predict` without waiting; the future resolves to the same (predictions, seconds) pair."""
+        return self._submit(_worker_predict, bundle_path, input_batch)
+
+    def predict_matrix(self, bundle_path: str, matrix: np.ndarray) -> np.ndarray:
+        """Predicts a preprocessed float32 matrix on a worker process."""
+        return self._submit(_worker_predict_matrix, bundle_path, matrix).result()
+
+    def explain(self, bundle_path: str, matrix: np.ndarray, approximate: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Computes predictions and feature contributions of a preprocessed matrix on a worker process."""
+        return self._submit(_worker_explain, bundle_path, matrix, approximate).result()
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        for path in list(_shared_bundles):
+            if os.path.dirname(path) == self.bundle_dir:
+                del _shared_bundles[path]
+        for name in os.listdir(self.bundle_dir):
+            try:
+                os.remove(os.path.join(self.bundle_dir, name))
+            except OSError:
+                pass
@@ -0,0 +1,70 @@
+import logging
+from typing import Optional
+
+import numpy as np
+
+# Whether the bucket-at-once path matches observe() on the installed prometheus_client; checked on first use
+_batched_path_ok: Optional[bool] = None
+
+
+def observe_batch(histogram, values):
+    """
+    Records a whole array of observations on a prometheus_client Histogram (or labelled child).
+
+    Calling `observe()` per value takes the bucket and sum locks once per row; here the
+    values are bucketed with NumPy and every bucket is incremented at most once, which
+    produces exactly the same bucket counts and sum. That relies on the client's private
+    bucket fields, so it is first checked against `observe()` through the exported samples
+    (prometheus-client is pinned in requirements.txt); on a mismatch every value goes
+    through `observe()` instead.
+    """
+    global _batched_path_ok
+
+    values = np.asarray(values, dtype=np.float64).ravel()
+    if values.size == 0:
+        return
+    if _batched_path_ok is None:
+        _batched_path_ok = _batched_path_matches()
+        if not _batched_path_ok:
+            logging.warning("prometheus_client histograms changed internally; recording batch observations one value at a time.")
+    if not _batched_path_ok:
+        for value in values.tolist():
+            histogram.observe(value)
+        return
+    _observe_buckets(histogram, values)
+
+
+def _observe_buckets(histogram, values: np.ndarray):
+    upper_bounds = histogram._upper_bounds
+    # observe() counts a value in the first bucket whose upper bound is >= the value
+    counts = np.bincount(np.searchsorted(upper_bounds, values, side="left"), minlength=len(upper_bounds))
+    for bucket, count in zip(histogram._buckets, counts.tolist()):
+        if count:
+            bucket.inc(count)
+    histogram._sum.inc(float(values.sum()))
+
+
+def _batched_path_matches() -> bool:
+    """Records the same values both ways on throwaway histograms and compares their exported samples."""
+    from prometheus_client import CollectorRegistry, Histogram
+
+    # Exact binary fractions, so the sums can't differ by rounding; they hit bucket edges too
+    values = np.array([-2.0, 0.0, 0.005, 0.25, 1.0, 1.5, 7.5, 10.0, 4096.0, 4096.0])
+    reference = Histogram("reference", "", registry=CollectorRegistry())
+    batched = Histogram("batched", "", registry=CollectorRegistry())
+    for value in values.tolist():
+        reference.observe(value)
+    try:
+        _observe_buckets(batched, values)
+    except (AttributeError, TypeError, ValueError):
+        return False
+    return _exported(reference) == _exported(batched)
+
+
+def _exported(histogram) -> list:
+    return [
+        (sample.name[len(metric.name):], sample.labels, sample.value)
+        for metric in histogram.collect()
+        for sample in metric.samples
+        if not sample.name.endswith("_created")
+    ]
@@ -0,0 +1,57 @@
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from inference_pool import NativeModel
+from preprocessing import CompiledPreprocessor
+
+# A representative car (first row of CarPrice_Assignment.csv) used to warm up new bundles
+WARMUP_ROW = {
+    "car_ID": 1, "symboling": 3, "CarName": "alfa-romero giulia", "fueltype": "gas", "aspiration": "std",
+    "doornumber": "two", "carbody": "convertible", "drivewheel": "rwd", "enginelocation": "front",
+    "wheelbase": 88.6, "carlength": 168.8, "carwidth": 64.1, "carheight": 48.8, "curbweight": 2548,
+    "enginetype": "dohc", "cylindernumber": "four", "enginesize": 130, "fuelsystem": "mpfi",
+    "boreratio": 3.47, "stroke": 2.68, "compressionratio": 9.0, "horsepower": 111, "peakrpm": 5000,
+    "citympg": 21, "highwaympg": 27,
+}
+
+
+def warmup_batch(n_rows: int = 8) -> Dict[str, list]:
+    """Returns a small column batch of the warm-up car."""
+    return {name: [value] * n_rows for name, value in WARMUP_ROW.items()}
+
+
+@dataclass(frozen=True)
+class ModelBundle:
+    """
+    Everything needed to serve one registered model version.
+
+    Bundles are never mutated: a reload builds a new bundle and swaps the module-level
+    reference in one assignment, so a request that captured a bundle keeps a consistent
+    model, scaler, encoders and feature list until it finishes.
+
+    A bundle loaded from a pre-exported file (slim serving) has only the native model and a
+    detached preprocessor; `model`, `scaler` and the encoders are None.
+    """
+    model: Any
+    scaler: Any
+    model_features: List[str]
+    target_encoder: Any
+    ordinal_encoder: Any
+    preprocessor: CompiledPreprocessor
+    mae: float
+    run_id: str
+    # Booster that predicts preprocessed matrices directly, when it matches the pyfunc model
+    native_model: Optional[NativeModel] = None
+    # ONNX Runtime or Treelite model selected by INFERENCE_BACKEND, when it matched the model at load time
+    compiled_model: Optional[Any] = None
+    # Bundle file published to the inference workers, if process-pool inference serves this model
+    pool_bundle_path: Optional[str] = None
+    # Reference distributions that live traffic is compared with (see drift.py)
+    drift_profile: Optional[Dict[str, Any]] = None
+    # Registered model name and alias the bundle was loaded for
+    model_name: Optional[str] = None
+    model_alias: Optional[str] = None
+    # Fingerprint of the preprocessing artifacts; bundles that share it share preprocessed batches
+    preprocessing_key: Optional[str] = None
+    loaded_at: float = field(default_factory=time.time)
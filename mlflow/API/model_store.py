@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from model_bundle import ModelBundle
+
+# A registered model name and one of its aliases, e.g. ("xgboost_regressor", "challenger")
+ModelKey = Tuple[str, str]
+
+
+class ModelStore:
+    """
+    LRU cache of bundles for named model/alias pairs, loaded on first use.
+
+    At most `max_bundles` stay resident; loading another evicts the least recently used one,
+    which is handed to `on_evict`. An entry older than `refresh_seconds` is passed back to
+    `load` on its next use, which returns it unchanged while the alias still points to the
+    same run. Concurrent requests for the same pair wait for one load; other pairs keep
+    being served while it runs. `pinned` pairs are never evicted.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str, str, Optional[ModelBundle]], ModelBundle],
+        max_bundles: int,
+        refresh_seconds: float,
+        on_evict: Optional[Callable[[ModelBundle], None]] = None,
+        pinned: Iterable[ModelKey] = ()
+    ):
+        self._load = load
+        self.max_bundles = max(1, max_bundles)
+        self.refresh_seconds = refresh_seconds
+        self._on_evict = on_evict
+        self.pinned = set(pinned)
+        # key -> (bundle, monotonic time the alias was last checked)
+        self._entries: "OrderedDict[ModelKey, Tuple[ModelBundle, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[ModelKey, threading.Lock] = {}
+
+    def _fresh(self, key: ModelKey) -> Optional[ModelBundle]:
+        """Returns the entry if it doesn't need an alias check, marking it recently used. Callers hold `_lock`."""
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[1] >= self.refresh_seconds:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def get(self, name: str, alias: str) -> ModelBundle:
+        """Returns the bundle for `name@alias`, loading it (and evicting another) if needed."""
+        key = (name, alias)
+        with self._lock:
+            bundle = self._fresh(key)
+            if bundle is not None:
+                return bundle
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                bundle = self._fresh(key)
+                if bundle is not None:
+                    return bundle
+                entry = self._entries.get(key)
+            current = entry[0] if entry is not None else None
+
+            try:
+                bundle = self._load(name, alias, current)
+            except Exception as e:
+                if current is None:
+                    raise
+                # The registry being unreachable shouldn't take down a model that is already loaded
+                logging.warning(f"Could not check '{name}@{alias}' in the registry; keeping run {current.run_id}. Error: {e}")
+                bundle = current
+
+            evicted = []
+            with self._lock:
+                self._entries[key] = (bundle, time.monotonic())
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_bundles:
+                    victim = next((resident for resident in self._entries if resident not in self.pinned), None)
+                    if victim is None:
+                        break
+                    evicted_name, evicted_alias = victim
+                    evicted_bundle, _ = self._entries.pop(victim)
+                    logging.info(f"Evicted '{evicted_name}@{evicted_alias}' (run {evicted_bundle.run_id}) from the model store.")
+                    evicted.append(evicted_bundle)
+            if current is not None and bundle is not current:
+                evicted.append(current)
+
+        if self._on_evict is not None:
+            for evicted_bundle in evicted:
+                self._on_evict(evicted_bundle)
+        return bundle
+
+    def peek(self, name: str, alias: str) -> Optional[ModelBundle]:
+        """Returns the resident bundle for `name@alias`, or None, without ever loading or checking the registry."""
+        with self._lock:
+            entry = self._entries.get((name, alias))
+        return entry[0] if entry is not None else None
+
+    def bundles(self) -> List[Tuple[ModelKey, ModelBundle]]:
+        """The resident bundles, least recently used first."""
+        with self._lock:
+            return [(key, bundle) for key, (bundle, _) in self._entries.items()]
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class RedisCacheBackend:
+    """
+    Shared second-tier cache on a Redis-compatible server (a local redis-server can stand in).
+    Entries expire server-side after `ttl_seconds`.
+    """
+
+    def __init__(self, url: str, ttl_seconds: float):
+        try:
+            import redis  # optional dependency, only needed when a shared backend is configured
+        except ImportError as e:
+            # The slim serving image leaves it out
+            raise ImportError("PREDICTION_CACHE_REDIS_URL is set but the redis package isn't installed; install it from requirements.txt or unset it.") from e
+
+        self._client = redis.Redis.from_url(url, socket_timeout=0.05, socket_connect_timeout=0.2)
+        self.ttl_seconds = max(1, int(ttl_seconds))
+
+    def get_many(self, keys: Sequence[str]) -> List[Optional[float]]:
+        return [None if value is None else float(value) for value in self._client.mget(keys)]
+
+    def set_many(self, items: Sequence[Tuple[str, float]]):
+        pipeline = self._client.pipeline(transaction=False)
+        for key, value in items:
+            pipeline.set(key, repr(value), ex=self.ttl_seconds)
+        pipeline.execute()
+
+
+class PredictionCache:
+    """
+    Bounded LRU/TTL cache of predictions keyed by the bytes of a preprocessed feature row.
+
+    Keys are namespaced by the model's run_id, so swapping in a new model never serves
+    stale predictions. A batch is deduplicated first and only rows missing from the cache
+    (and from the optional shared backend) are passed to `compute`.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        shared_backend=None,
+        hits_counter=None,
+        misses_counter=None,
+        evictions_counter=None,
+    ):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self.shared_backend = shared_backend
+        self.hits_counter = hits_counter
+        self.misses_counter = misses_counter
+        self.evictions_counter = evictions_counter
+
+        self._entries: "OrderedDict[Tuple[str, bytes], Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def predict(self, namespace: str, matrix: np.ndarray, compute: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """Returns one prediction per row of `matrix`, calling `compute` only for uncached rows."""
+        if len(matrix) == 0:
+            return compute(matrix)
+
+        matrix = np.ascontiguousarray(matrix)
+        rows = matrix.view(np.dtype((np.void, matrix.shape[1] * matrix.itemsize))).ravel()
+        unique_rows, first_index, inverse = np.unique(rows, return_index=True, return_inverse=True)
+        inverse = inverse.ravel()
+        keys = [(namespace, row) for row in unique_rows.tolist()]
+
+        values = np.empty(len(keys), dtype=np.float64)
+        found = np.zeros(len(keys), dtype=bool)
+        now = time.monotonic()
+        with self._lock:
+            for i, key in enumerate(keys):
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] > now:
+                    values[i] = entry[0]
+                    found[i] = True
+                    self._entries.move_to_end(key)
+
+        if self.shared_backend is not None and not found.all():
+            self._fill_from_shared(keys, values, found)
+
+        missing = np.flatnonzero(~found)
+        if missing.size:
+            values[missing] = compute(matrix[first_index[missing]])
+            self._store([(keys[i], float(values[i])) for i in missing], share=True)
+
+        if self.hits_counter is not None:
+            hits = int(np.count_nonzero(found[inverse]))
+            self.hits_counter.inc(hits)
+            self.misses_counter.inc(len(inverse) - hits)
+        return values[inverse]
+
+    @staticmethod
+    def _shared_key(key: Tuple[str, bytes]) -> str:
+        namespace, row = key
+        return f"prediction:{namespace}:{hashlib.blake2b(row, digest_size=16).hexdigest()}"
+
+    def _fill_from_shared(self, keys, values: np.ndarray, found: np.ndarray):
+        lookups = np.flatnonzero(~found)
+        try:
+            shared_values = self.shared_backend.get_many([self._shared_key(keys[i]) for i in lookups])
+        except Exception as e:
+            # The shared tier is best-effort; fall back to computing the rows
+            logging.warning(f"Shared prediction cache lookup failed: {e}")
+            return
+        fetched = []
+        for i, value in zip(lookups, shared_values):
+            if value is not None:
+                values[i] = value
+                found[i] = True
+                fetched.append((keys[i], value))
+        self._store(fetched, share=False)
+
+    def _store(self, items, share: bool):
+        if not items:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds
+        evicted = 0
+        with self._lock:
+            for key, value in items:
+                self._entries[key] = (value, expires_at)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted and self.evictions_counter is not None:
+            self.evictions_counter.inc(evicted)
+
+        if share and self.shared_backend is not None:
+            try:
+                self.shared_backend.set_many([(self._shared_key(key), value) for key, value in items])
+            except Exception as e:
+                logging.warning(f"Shared prediction cache write failed: {e}")
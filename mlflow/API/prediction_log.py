@@ -0,0 +1,217 @@
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, Deque, Dict, List, Mapping, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pa_parquet
+
+
+class _PartitionFile:
+    """An open Parquet file of one (hour, run_id) partition, moved to its final name when closed."""
+
+    def __init__(self, path: str, schema: pa.Schema):
+        self.path = path
+        self.tmp_path = f"{path}.inprogress"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(self.tmp_path, "wb")
+        self._writer = pa_parquet.ParquetWriter(self._file, schema, compression="zstd")
+        self.opened_at = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        return self._file.tell()
+
+    def write(self, table: pa.Table):
+        # Each flush becomes one row group
+        self._writer.write_table(table)
+
+    def close(self):
+        self._writer.close()
+        self._file.close()
+        os.replace(self.tmp_path, self.path)
+
+
+class PredictionLogger:
+    """
+    Logs served feature rows and their predictions to Parquet, for retraining and replay.
+
+    `submit()` appends the batch to a bounded in-memory buffer and returns without any I/O.
+    A background thread flushes the buffer every `flush_seconds` (sooner once it holds
+    `flush_rows`) into one open file per hour and model run_id, laid out as
+    hour=YYYY-MM-DDTHH/run_id=<run_id>/part-*.parquet. Files roll over when they reach
+    `max_file_bytes`, after `max_file_seconds` and when their hour ends, and only appear
+    under their final name once complete.
+
+    Batches are kept with probability `sample_rate`. When the buffer is full, new batches
+    are dropped and counted instead of blocking the request.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        numeric_columns: List[str],
+        string_columns: List[str],
+        sample_rate: float = 1.0,
+        max_buffered_rows: int = 100000,
+        flush_rows: int = 10000,
+        flush_seconds: float = 5.0,
+        max_file_bytes: int = 128 * 1024 ** 2,
+        max_file_seconds: float = 900.0,
+        logged_counter=None,
+        dropped_counter=None,
+        buffered_gauge=None
+    ):
+        self.directory = directory
+        self.numeric_columns = numeric_columns
+        self.string_columns = string_columns
+        self.sample_rate = sample_rate
+        self.max_buffered_rows = max_buffered_rows
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.max_file_bytes = max_file_bytes
+        self.max_file_seconds = max_file_seconds
+        self.logged_counter = logged_counter
+        self.dropped_counter = dropped_counter
+
+        # Numeric features are logged as float64, the same types bulk uploads are read with
+        self.schema = pa.schema(
+            [("logged_at", pa.timestamp("ms", tz="UTC"))]
+            + [(name, pa.float64()) for name in numeric_columns]
+            + [(name, pa.string()) for name in string_columns]
+            + [("predicted_price", pa.float64())]
+        )
+
+        self._buffer: Deque[Tuple[float, str, Mapping[str, Any], Any]] = deque()
+        self._buffered_rows = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._files: Dict[Tuple[str, str], _PartitionFile] = {}
+        if buffered_gauge is not None:
+            buffered_gauge.set_function(lambda: self._buffered_rows)
+
+        self._thread = threading.Thread(target=self._run, name="prediction-log-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, run_id: str, batch: Mapping[str, Any], predictions: Any):
+        """Buffers a served batch for logging. Never blocks on I/O."""
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+        rows = len(predictions)
+        with self._lock:
+            accepted = self._buffered_rows + rows <= self.max_buffered_rows
+            if accepted:
+                self._buffer.append((time.time(), run_id, batch, predictions))
+                self._buffered_rows += rows
+            flush_now = self._buffered_rows >= self.flush_rows
+        if not accepted and self.dropped_counter is not None:
+            self.dropped_counter.inc(rows)
+        if flush_now:
+            self._wakeup.set()
+
+    def close(self):
+        """Flushes whatever is buffered and closes every open file."""
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=30)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_seconds)
+            self._wakeup.clear()
+            closing = self._closed
+            try:
+                self._flush()
+                self._roll_over(close_all=closing)
+            except Exception as e:
+                logging.error(f"Prediction log writer failed: {e}", exc_info=True)
+            if closing:
+                return
+
+    def _to_table(self, batches: List[Tuple[float, str, Mapping[str, Any], Any]]) -> pa.Table:
+        """Builds one table from many batches, concatenating each column once."""
+        counts = [len(predictions) for _, _, _, predictions in batches]
+        logged_at = np.repeat(np.array([int(entry[0] * 1000) for entry in batches], dtype=np.int64), counts)
+        arrays = [pa.array(logged_at, type=self.schema.field("logged_at").type)]
+        arrays += [
+            pa.array(np.concatenate([np.asarray(batch[name], dtype=np.float64) for _, _, batch, _ in batches]))
+            for name in self.numeric_columns
+        ]
+        arrays += [
+            pa.array(np.concatenate([np.asarray(batch[name], dtype=object) for _, _, batch, _ in batches]), type=pa.string())
+            for name in self.string_columns
+        ]
+        arrays.append(pa.array(np.concatenate([np.asarray(predictions, dtype=np.float64).ravel() for _, _, _, predictions in batches])))
+        return pa.Table.from_arrays(arrays, schema=self.schema)
+
+    def _flush(self):
+        with self._lock:
+            batches, self._buffer = self._buffer, deque()
+            self._buffered_rows = 0
+
+        partitions: Dict[Tuple[str, str], list] = {}
+        for entry in batches:
+            hour = datetime.fromtimestamp(entry[0], timezone.utc).strftime("%Y-%m-%dT%H")
+            partitions.setdefault((hour, entry[1]), []).append(entry)
+
+        for key, entries in partitions.items():
+            try:
+                table = self._to_table(entries)
+            except (pa.ArrowException, KeyError, TypeError, ValueError):
+                # Find the malformed batches and keep the rest
+                tables = []
+                for entry in entries:
+                    try:
+                        tables.append(self._to_table([entry]))
+                    except (pa.ArrowException, KeyError, TypeError, ValueError) as e:
+                        logging.warning(f"Dropping a batch of {len(entry[3])} rows from the prediction log: {e}")
+                        if self.dropped_counter is not None:
+                            self.dropped_counter.inc(len(entry[3]))
+                if not tables:
+                    continue
+                table = pa.concat_tables(tables)
+
+            try:
+                self._write(key, table)
+            except Exception as e:
+                logging.error(f"Failed to write {table.num_rows} rows to the prediction log: {e}")
+                if self.dropped_counter is not None:
+                    self.dropped_counter.inc(table.num_rows)
+                # Start the partition over in a new file rather than append to a broken one
+                broken = self._files.pop(key, None)
+                if broken is not None:
+                    try:
+                        broken.close()
+                    except Exception:
+                        pass
+
+    def _write(self, key: Tuple[str, str], table: pa.Table):
+        partition_file = self._files.get(key)
+        if partition_file is None:
+            hour, run_id = key
+            name = f"part-{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}.parquet"
+            partition_file = _PartitionFile(os.path.join(self.directory, f"hour={hour}", f"run_id={run_id}", name), self.schema)
+            self._files[key] = partition_file
+        partition_file.write(table)
+        if self.logged_counter is not None:
+            self.logged_counter.inc(table.num_rows)
+
+    def _roll_over(self, close_all: bool = False):
+        current_hour = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H")
+        now = time.monotonic()
+        for key, partition_file in list(self._files.items()):
+            if (
+                close_all
+                or key[0] != current_hour
+                or partition_file.size >= self.max_file_bytes
+                or now - partition_file.opened_at >= self.max_file_seconds
+            ):
+                del self._files[key]
+                partition_file.close()
@@ -0,0 +1,446 @@
+import copy
+import logging
+import sys
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+# pandas is only imported by the paths that need it, so a runtime serving a detached
+# compiled preprocessor never loads it
+if TYPE_CHECKING:
+    import pandas as pd
+
+# --- Feature Groups (shared by the legacy and compiled preprocessing paths) ---
+COLS_TO_DROP = ['car_ID', 'symboling', 'carlength', 'carwidth', 'enginesize', 'curbweight', 'highwaympg']
+TARGET_ENCODED_FEATURES = ['cartype', 'carbrand']
+ORDINAL_FEATURES = ['fueltype', 'aspiration', 'doornumber', 'carbody', 'drivewheel', 'enginelocation', 'cylindernumber', 'fuelsystem', 'enginetype']
+NUMERICAL_FEATURES = ['wheelbase', 'carheight', 'horsepower', 'peakrpm', 'citympg']
+
+# Sentinel used to ask an encoder what it returns for an unseen category
+_UNSEEN_CATEGORY = "__unseen_category__"
+
+
+# --- Data Preprocessing for Batch Input ---
+def preprocess_batch_data(input_df: "pd.DataFrame", scaler, model_features: list, target_encoder, ordinal_encoder) -> "pd.DataFrame":
+    """Preprocesses a DataFrame of raw car features for prediction."""
+    import pandas as pd
+
+    # 1. Drop columns not used in training
+    df = input_df.drop(columns=COLS_TO_DROP, errors='ignore')
+
+    # 2. Feature Engineering: Extract car brand
+    if 'CarName' in df.columns:
+        df['carbrand'] = df['CarName'].apply(lambda x: x.split(' ')[0])
+        df['cartype'] = df['CarName'].apply(lambda x: ' '.join(x.split(' ')[1:]) if len(x.split(' ')) > 1 else 'unknown')
+        df = df.drop(columns=['CarName'])
+
+    # 3. One-Hot Encode categorical features
+    target_encoded_features = TARGET_ENCODED_FEATURES
+    ordinal_features = ORDINAL_FEATURES
+    numerical_features = NUMERICAL_FEATURES
+    #cols_to_encode = [col for col in categorical_cols if col in df.columns]
+    #df_encoded = pd.get_dummies(df, columns=cols_to_encode, drop_first=True)
+
+# intersect with present columns
+    target_encoded_features = [c for c in target_encoded_features if c in df.columns]
+    ordinal_features = [c for c in ordinal_features if c in df.columns]
+    numerical_features = [c for c in numerical_features if c in df.columns]
+
+    # 4. Handle missing values
+    # For numerical: simple impute with median (safe default for batch predict)
+    for col in numerical_features:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+        df[col] = df[col].fillna(df[col].median())
+
+    # For categorical: fillna with 'missing'
+    categorical_cols = list(set(target_encoded_features + ordinal_features))
+    for col in categorical_cols:
+        df[col] = df[col].fillna('missing').astype(str).str.lower()
+
+    # 5. Apply encoders if provided, else fall back to one-hot encoding
+    encoded_df = df.copy()
+
+    # If target/ordinal encoders are provided, transform them (they must be pre-fit)
+    try:
+        if target_encoder is not None and len(target_encoded_features) > 0:
+            encoded_df[target_encoded_features] = target_encoder.transform(encoded_df[target_encoded_features])
+    except Exception:
+        # fallback: leave the original columns for one-hot below
+        pass
+
+    try:
+        if ordinal_encoder is not None and len(ordinal_features) > 0:
+            encoded_df[ordinal_features] = ordinal_encoder.transform(encoded_df[ordinal_features])
+    except Exception:
+        # fallback: leave the original columns for one-hot below
+        pass
+
+    # Decide which columns remain categorical (those not transformed numerically by provided encoders)
+    # If encoders were used and produced numeric columns, they are already numeric in encoded_df.
+    # We'll one-hot encode any remaining object/dtype 'category' columns among categorical_cols.
+    cols_for_ohe = [c for c in categorical_cols if encoded_df[c].dtype == object or encoded_df[c].dtype.name == 'category']
+    if len(cols_for_ohe) > 0:
+        encoded_df = pd.get_dummies(encoded_df, columns=cols_for_ohe, drop_first=True)
+
+    # 6. Scale numerical features using provided scaler (assumed fitted)
+    # If scaler is None, we will not scale but warn by using identity.
+    if scaler is not None:
+        num_cols_present = [c for c in numerical_features if c in encoded_df.columns]
+        if len(num_cols_present) > 0:
+            # scaler expects 2D array with columns in a consistent order: use num_cols_present
+            try:
+                encoded_df[num_cols_present] = scaler.transform(encoded_df[num_cols_present])
+            except Exception as e:
+                raise ValueError(f"Scaler transform failed: {e}")
+    else:
+        # no scaler provided: leave numericals as-is
+        pass
+
+    # 7. Ensure final columns match model_features: add missing cols filled with 0, and drop extras
+    final_df = encoded_df.copy()
+
+    # Ensure all model_features present
+    for col in model_features:
+        if col not in final_df.columns:
+            # create missing column with zeros
+            final_df[col] = 0
+
+    # Keep only model_features and preserve order
+    final_df = final_df[model_features]
+
+    # Return final DataFrame ready for model.predict
+    return final_df
+
+
+# --- Compiled Preprocessing Pipeline ---
+class _UseLegacyPath(Exception):
+    """Raised when a batch needs the pandas implementation to stay output-identical."""
+
+
+class _EncoderTable:
+    """Precomputed category -> value lookup for the columns handled by one encoder."""
+
+    def __init__(self, columns: List[str], values: Dict[str, Dict[str, float]], unseen: Optional[Dict[str, float]]):
+        self.columns = columns
+        self.values = values
+        # None means the encoder raises on unseen categories
+        self.unseen = unseen
+
+    def lookup(self, column: str, category: str) -> float:
+        """Returns the encoded value of one category."""
+        value = self.values[column].get(category)
+        if value is None:
+            if self.unseen is None:
+                raise _UseLegacyPath(f"unseen category for '{column}'")
+            value = self.unseen[column]
+        return value
+
+
+def _encoder_categories(encoder, columns: List[str]) -> Optional[Dict[str, List[str]]]:
+    """Returns the categories each column was fit on, for sklearn and category_encoders encoders."""
+    names = getattr(encoder, "feature_names_in_", None)
+    categories = getattr(encoder, "categories_", None)
+    if names is not None and categories is not None:
+        fitted = {str(name): [c for c in cats if isinstance(c, str)] for name, cats in zip(names, categories)}
+    else:
+        # category_encoders keeps its category -> code mapping on an inner ordinal encoder
+        ordinal = getattr(encoder, "ordinal_encoder", None) or encoder
+        mapping = getattr(ordinal, "mapping", None)
+        if not isinstance(mapping, list):
+            return None
+        fitted = {m['col']: [c for c in m['mapping'].index if isinstance(c, str)] for m in mapping}
+
+    if any(col not in fitted or not fitted[col] for col in columns):
+        return None
+    return {col: fitted[col] for col in columns}
+
+
+def _transform_probe(encoder, probe: Dict[str, List[str]], columns: List[str]) -> np.ndarray:
+    """Runs the encoder on a probe frame and returns its output as float64 in `columns` order."""
+    import pandas as pd
+
+    out = encoder.transform(pd.DataFrame(probe, columns=columns, dtype=object))
+    if isinstance(out, pd.DataFrame) and all(col in out.columns for col in columns):
+        out = out[columns]
+    return np.asarray(out, dtype=np.float64)
+
+
+def _build_encoder_table(encoder, columns: List[str]) -> Optional[_EncoderTable]:
+    """Asks the encoder once for every known category so batches only need dict lookups."""
+    categories = _encoder_categories(encoder, columns)
+    if categories is None:
+        return None
+
+    # Pad shorter columns with their first category so every column can be probed in one call
+    depth = max(len(cats) for cats in categories.values())
+    probe = {col: cats + [cats[0]] * (depth - len(cats)) for col, cats in categories.items()}
+    try:
+        encoded = _transform_probe(encoder, probe, columns)
+    except Exception as e:
+        logging.warning(f"Could not precompute lookup table for {columns}: {e}")
+        return None
+    values = {
+        col: {cat: float(encoded[i, j]) for i, cat in enumerate(categories[col])}
+        for j, col in enumerate(columns)
+    }
+
+    try:
+        unseen_row = _transform_probe(encoder, {col: [_UNSEEN_CATEGORY] for col in columns}, columns)[0]
+        unseen = {col: float(unseen_row[j]) for j, col in enumerate(columns)}
+    except Exception:
+        unseen = None
+
+    return _EncoderTable(columns, values, unseen)
+
+
+def _as_float_column(values: Any) -> np.ndarray:
+    """Converts a column to float64, coercing unparsable entries to NaN like pd.to_numeric."""
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        import pandas as pd
+        return pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=np.float64)
+
+
+def _normalize_category(value: Any) -> str:
+    """Scalar equivalent of fillna('missing').astype(str).str.lower()."""
+    if value is None or value != value:
+        return 'missing'
+    return str(value).lower()
+
+
+def _car_brand(name: Any) -> str:
+    if not isinstance(name, str):
+        raise _UseLegacyPath("non-string CarName")
+    return name.partition(' ')[0].lower()
+
+
+def _car_type(name: Any) -> str:
+    if not isinstance(name, str):
+        raise _UseLegacyPath("non-string CarName")
+    _, sep, rest = name.partition(' ')
+    return rest.lower() if sep else 'unknown'
+
+
+def _is_dataframe(batch: Any) -> bool:
+    # A batch can only be a DataFrame if pandas has been imported by someone
+    pandas = sys.modules.get("pandas")
+    return pandas is not None and isinstance(batch, pandas.DataFrame)
+
+
+def _encode_distinct(values: Any, encode: Callable[[Any], float]) -> np.ndarray:
+    """Encodes each distinct value of a column once and gathers the results per row."""
+    if hasattr(values, "tolist"):
+        values = values.tolist()
+    encoded = {value: encode(value) for value in dict.fromkeys(values)}
+    return np.fromiter(map(encoded.__getitem__, values), dtype=np.float64, count=len(values))
+
+
+class CompiledPreprocessor:
+    """
+    Preprocessing pipeline compiled once per loaded model.
+
+    Produces the same values as `preprocess_batch_data`, but writes them straight into a
+    float32 matrix in `model_features` order. Encoders are replaced by lookup tables applied
+    once per distinct category in a batch, and the scaler is fused into a single vectorized pass.
+    Batches the tables cannot reproduce exactly are routed through `preprocess_batch_data`.
+    """
+
+    def __init__(self, scaler, model_features: list, target_encoder, ordinal_encoder, integer_features: Optional[List[str]] = None):
+        self.scaler = scaler
+        self.model_features = list(model_features)
+        self.target_encoder = target_encoder
+        self.ordinal_encoder = ordinal_encoder
+        # Features the model's input schema declares as integers (restored in `to_frame`)
+        self.integer_features = [c for c in (integer_features or []) if c in self.model_features]
+        # Set on copies made by `detached()`, which have no artifacts to fall back on
+        self.is_detached = False
+
+        positions = {name: i for i, name in enumerate(self.model_features)}
+        self._num_positions = [positions.get(c) for c in NUMERICAL_FEATURES]
+        self._target_positions = [(c, positions[c]) for c in TARGET_ENCODED_FEATURES if c in positions]
+        self._ordinal_positions = [(c, positions[c]) for c in ORDINAL_FEATURES if c in positions]
+        engineered = set(NUMERICAL_FEATURES + TARGET_ENCODED_FEATURES + ORDINAL_FEATURES + COLS_TO_DROP + ['CarName'])
+        self._passthrough_positions = [(c, i) for i, c in enumerate(self.model_features) if c not in engineered]
+
+        self._scale_mean, self._scale_std = self._compile_scaler(scaler)
+        self._target_table = _build_encoder_table(target_encoder, TARGET_ENCODED_FEATURES) if target_encoder is not None else None
+        self._ordinal_table = _build_encoder_table(ordinal_encoder, ORDINAL_FEATURES) if ordinal_encoder is not None else None
+        self.compiled = (
+            self._scale_mean is not None
+            and self._target_table is not None
+            and self._ordinal_table is not None
+        )
+        if self.compiled:
+            self.compiled = self._matches_legacy()
+        if not self.compiled:
+            logging.warning("Compiled preprocessing unavailable for these artifacts; using pandas preprocessing.")
+
+    @staticmethod
+    def _compile_scaler(scaler):
+        """Extracts StandardScaler parameters as float64 vectors, or (None, None) if unsupported."""
+        if scaler is None:
+            return np.zeros(len(NUMERICAL_FEATURES)), np.ones(len(NUMERICAL_FEATURES))
+        if not all(hasattr(scaler, attr) for attr in ("mean_", "scale_", "with_mean", "with_std")):
+            return None, None
+        names = getattr(scaler, "feature_names_in_", None)
+        if names is not None and [str(n) for n in names] != NUMERICAL_FEATURES:
+            return None, None
+        mean = np.asarray(scaler.mean_, dtype=np.float64) if scaler.with_mean and scaler.mean_ is not None else np.zeros(len(NUMERICAL_FEATURES))
+        std = np.asarray(scaler.scale_, dtype=np.float64) if scaler.with_std and scaler.scale_ is not None else np.ones(len(NUMERICAL_FEATURES))
+        if mean.shape != (len(NUMERICAL_FEATURES),) or std.shape != (len(NUMERICAL_FEATURES),):
+            return None, None
+        return mean, std
+
+    def detached(self) -> "CompiledPreprocessor":
+        """
+        Returns a copy without the fitted scaler and encoders, so unpickling it needs neither
+        scikit-learn, category_encoders nor pandas. Batches the lookup tables can't reproduce
+        raise ValueError instead of falling back to `preprocess_batch_data`.
+        """
+        if not self.compiled:
+            raise ValueError("Only a compiled preprocessor can be detached from its artifacts.")
+        clone = copy.copy(self)
+        clone.scaler = clone.target_encoder = clone.ordinal_encoder = None
+        clone.is_detached = True
+        return clone
+
+    def _matches_legacy(self) -> bool:
+        """Checks the compiled path against `preprocess_batch_data` on a batch built from the encoder tables."""
+        import pandas as pd
+
+        brands = list(self._target_table.values['carbrand'])
+        types = list(self._target_table.values['cartype'])
+        depth = max(len(brands), len(types), *(len(self._ordinal_table.values[c]) for c in ORDINAL_FEATURES))
+        probe = {
+            'CarName': [f"{brands[i % len(brands)]} {types[i % len(types)]}" for i in range(depth)] + ['Unseen'],
+        }
+        for col in ORDINAL_FEATURES:
+            cats = list(self._ordinal_table.values[col])
+            probe[col] = [cats[i % len(cats)] for i in range(depth)] + [_UNSEEN_CATEGORY]
+        for j, col in enumerate(NUMERICAL_FEATURES + [c for c, _ in self._passthrough_positions]):
+            probe[col] = [float((i * (j + 3)) % 97) for i in range(depth + 1)]
+
+        try:
+            if self._ordinal_table.unseen is None or self._target_table.unseen is None:
+                # Unseen categories are only reproducible when the encoders don't raise on them
+                probe = {col: values[:-1] for col, values in probe.items()}
+            expected = preprocess_batch_data(pd.DataFrame(probe), self.scaler, self.model_features, self.target_encoder, self.ordinal_encoder)
+            actual = self._transform_compiled(probe, len(probe['CarName']))
+        except Exception as e:
+            logging.warning(f"Compiled preprocessing self-check failed: {e}")
+            return False
+
+        expected = expected.to_numpy(dtype=np.float32)
+        if not np.array_equal(expected, actual, equal_nan=True):
+            logging.warning("Compiled preprocessing does not match pandas preprocessing for the loaded artifacts.")
+            return False
+        return True
+
+    def transform(self, batch: Mapping[str, Any]) -> np.ndarray:
+        """
+        Preprocesses a batch given as a DataFrame or a mapping of column name -> values.
+        Returns a float32 matrix with one column per entry of `model_features`.
+        """
+        is_dataframe = _is_dataframe(batch)
+        n_rows = len(batch) if is_dataframe else len(next(iter(batch.values()), []))
+        if self.compiled:
+            try:
+                return self._transform_compiled(batch, n_rows)
+            except _UseLegacyPath as e:
+                if getattr(self, "is_detached", False):
+                    raise ValueError(f"Batch can't be preprocessed without the original artifacts: {e}")
+
+        import pandas as pd
+        input_df = batch if is_dataframe else pd.DataFrame(batch)
+        processed = preprocess_batch_data(input_df, self.scaler, self.model_features, self.target_encoder, self.ordinal_encoder)
+        return processed.to_numpy(dtype=np.float32)
+
+    def _transform_compiled(self, batch: Mapping[str, Any], n_rows: int) -> np.ndarray:
+        required = ['CarName'] + NUMERICAL_FEATURES + ORDINAL_FEATURES
+        if any(col not in batch for col in required):
+            raise _UseLegacyPath("batch is missing input columns")
+
+        out = np.zeros((n_rows, len(self.model_features)), dtype=np.float32)
+        if n_rows == 0:
+            return out
+
+        # Numerical features: median-impute per batch, then scale in one fused pass
+        numeric = np.empty((n_rows, len(NUMERICAL_FEATURES)), dtype=np.float64)
+        for j, col in enumerate(NUMERICAL_FEATURES):
+            numeric[:, j] = _as_float_column(batch[col])
+        missing = np.isnan(numeric)
+        for j in np.flatnonzero(missing.any(axis=0)):
+            observed = numeric[~missing[:, j], j]
+            if observed.size:
+                numeric[missing[:, j], j] = np.median(observed)
+        numeric -= self._scale_mean
+        numeric /= self._scale_std
+        for j, pos in enumerate(self._num_positions):
+            if pos is not None:
+                out[:, pos] = numeric[:, j]
+
+        # Target-encoded features: split each distinct car name once, then look up brand and type
+        names = batch['CarName']
+        for col, pos in self._target_positions:
+            derive = _car_brand if col == 'carbrand' else _car_type
+            out[:, pos] = _encode_distinct(names, lambda name: self._target_table.lookup(col, derive(name)))
+
+        # Ordinal features: encode each distinct category once and gather per row
+        for col, pos in self._ordinal_positions:
+            out[:, pos] = _encode_distinct(batch[col], lambda value: self._ordinal_table.lookup(col, _normalize_category(value)))
+
+        # Features passed through unchanged (e.g. boreratio, stroke, compressionratio)
+        for col, pos in self._passthrough_positions:
+            if col in batch:
+                out[:, pos] = np.asarray(batch[col], dtype=np.float32)
+
+        return out
+
+    def to_frame(self, matrix: np.ndarray) -> "pd.DataFrame":
+        """Wraps a preprocessed matrix as the DataFrame a pyfunc model expects."""
+        import pandas as pd
+
+        frame = pd.DataFrame(matrix, columns=self.model_features, copy=False)
+        if self.integer_features:
+            frame = frame.astype({c: np.int64 for c in self.integer_features})
+        return frame
+
+
+def input_field_groups(model_features: List[str]) -> Tuple[List[str], np.ndarray]:
+    """
+    Maps model features back to the input fields they come from, for explanations.
+
+    Returns the field names and a (features x fields) 0/1 matrix: multiplying per-feature
+    values by it sums one-hot columns of the pandas fallback (e.g. 'carbody_sedan') into their
+    field. Encoded features keep their own name ('carbrand', 'cartype', 'fueltype', ...).
+    """
+    categorical = TARGET_ENCODED_FEATURES + ORDINAL_FEATURES
+    fields: List[str] = []
+    assignment = []
+    for feature in model_features:
+        field = next((c for c in categorical if feature.startswith(f"{c}_")), feature)
+        if field not in fields:
+            fields.append(field)
+        assignment.append(fields.index(field))
+
+    groups = np.zeros((len(model_features), len(fields)))
+    groups[np.arange(len(model_features)), assignment] = 1.0
+    return fields, groups
+
+
+def schema_integer_features(model) -> List[str]:
+    """Returns the input columns a pyfunc model's signature declares as integer types."""
+    try:
+        schema = model.metadata.get_input_schema()
+    except Exception:
+        return []
+    if schema is None or not schema.has_input_names():
+        return []
+    return [spec.name for spec in schema.inputs if str(getattr(spec.type, "name", spec.type)) in ("integer", "long")]
+
+
+def build_preprocessor(scaler, model_features: list, target_encoder, ordinal_encoder, model=None) -> CompiledPreprocessor:
+    """Compiles the preprocessing pipeline for a freshly loaded model and its artifacts."""
+    integer_features = schema_integer_features(model) if model is not None else []
+    return CompiledPreprocessor(scaler, model_features, target_encoder, ordinal_encoder, integer_features)
@@ -0,0 +1,178 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Optional
+
+
+class ProfileSession:
+    """One profiling run: stack samples and stage times collected until its deadline or request count."""
+
+    def __init__(self, seconds: float, max_requests: int, interval: float, loop_thread: int):
+        self.started_at = time.perf_counter()
+        self.deadline = self.started_at + seconds
+        self.max_requests = max_requests
+        self.interval = interval
+        self.loop_thread = loop_thread
+        self.requests = 0
+        self.samples = 0
+        self.idle_samples = 0
+        self.stacks: Counter = Counter()
+        self.stages: Dict[str, list] = {}
+        # Threads inside a timed stage, with how many stages each is nested in
+        self.busy_threads: Dict[int, int] = {}
+        self.finished_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def done(self) -> bool:
+        return self.finished_at is not None or time.perf_counter() >= self.deadline or (self.max_requests > 0 and self.requests >= self.max_requests)
+
+    def add_stage(self, name: str, wall: float, cpu: float):
+        with self._lock:
+            totals = self.stages.setdefault(name, [0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += wall
+            totals[2] += cpu
+
+    def add_stacks(self, stacks, idle: int):
+        with self._lock:
+            self.samples += 1
+            self.idle_samples += idle
+            self.stacks.update(stacks)
+
+    def collapsed(self) -> str:
+        """Samples as collapsed stacks ("root;caller;callee count" lines), the input of flamegraph.pl and speedscope."""
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def report(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "duration_seconds": (self.finished_at or time.perf_counter()) - self.started_at,
+                "requests": self.requests,
+                "samples": self.samples,
+                "interval_ms": self.interval * 1000,
+                # Samples where the event loop was waiting for I/O, left out of the stacks
+                "event_loop_idle_samples": self.idle_samples,
+                "stages": {
+                    name: {"count": count, "wall_seconds": wall, "cpu_seconds": cpu}
+                    for name, (count, wall, cpu) in sorted(self.stages.items())
+                },
+            }
+
+
+class _StageTimer:
+    """Times one stage into its histogram and, while a session runs, into the session too."""
+
+    __slots__ = ("profiler", "name", "histogram", "session", "started", "cpu_started", "thread")
+
+    def __init__(self, profiler: "SamplingProfiler", name: str, histogram):
+        self.profiler = profiler
+        self.name = name
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.session = self.profiler.session
+        if self.session is not None:
+            self.thread = threading.get_ident()
+            self.session.busy_threads[self.thread] = self.session.busy_threads.get(self.thread, 0) + 1
+            self.cpu_started = time.thread_time()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.perf_counter() - self.started
+        self.histogram.observe(wall)
+        session = self.session
+        if session is not None:
+            session.add_stage(self.name, wall, time.thread_time() - self.cpu_started)
+            nested = session.busy_threads.get(self.thread, 1) - 1
+            if nested > 0:
+                session.busy_threads[self.thread] = nested
+            else:
+                session.busy_threads.pop(self.thread, None)
+        return False
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for the serving path, started on demand by `start()`.
+
+    While a session runs, a background thread wakes every `interval` seconds and records the
+    Python stack of the event loop thread and of every thread inside a stage timed with
+    `stage()`, such as a threadpool thread running preprocessing. Stacks are kept as
+    collapsed strings, one root per thread role (event_loop or inference), for flamegraphs.
+    Stage timers also add up each stage's wall and CPU time.
+
+    With no session there is no sampler thread, and `stage()` costs the same as the
+    histogram's own `time()`. Only one session runs at a time.
+    """
+
+    def __init__(self):
+        self.session: Optional[ProfileSession] = None
+        self._labels: Dict[Any, str] = {}
+
+    def stage(self, name: str, histogram) -> _StageTimer:
+        """Use as `with profiler.stage("preprocess", histogram):` in place of `with histogram.time():`."""
+        return _StageTimer(self, name, histogram)
+
+    def observe(self, name: str, histogram, seconds: float):
+        """Records a stage timed elsewhere, such as in a worker process, whose CPU time isn't visible here."""
+        histogram.observe(seconds)
+        session = self.session
+        if session is not None:
+            session.add_stage(name, seconds, 0.0)
+
+    def request_finished(self):
+        session = self.session
+        if session is not None:
+            session.requests += 1
+
+    def start(self, seconds: float, max_requests: int, interval: float) -> ProfileSession:
+        """Starts a session from the event loop thread. Raises RuntimeError if one is already running."""
+        if self.session is not None:
+            raise RuntimeError("A profiling session is already running.")
+        session = ProfileSession(seconds, max_requests, interval, threading.get_ident())
+        self.session = session
+        threading.Thread(target=self._sample, args=(session,), name="profiler-sampler", daemon=True).start()
+        return session
+
+    def stop(self, session: ProfileSession):
+        session.finished_at = time.perf_counter()
+        if self.session is session:
+            self.session = None
+
+    def _sample(self, session: ProfileSession):
+        sampler = threading.get_ident()
+        while not session.done():
+            time.sleep(session.interval)
+            frames = sys._current_frames()
+            stacks = []
+            idle = 0
+            targets = {ident: "inference" for ident in list(session.busy_threads)}
+            targets[session.loop_thread] = "event_loop"
+            for ident, role in targets.items():
+                frame = frames.get(ident)
+                if frame is None or ident == sampler:
+                    continue
+                if role == "event_loop" and frame.f_code.co_filename.endswith("selectors.py"):
+                    idle += 1
+                    continue
+                stacks.append(self._collapse(role, frame))
+            session.add_stacks(stacks, idle)
+        session.finished_at = session.finished_at or time.perf_counter()
+
+    def _collapse(self, role: str, frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                # One label per function rather than per line, so samples aggregate
+                label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+                self._labels[code] = label
+            names.append(label)
+            frame = frame.f_back
+        names.append(role)
+        return ";".join(reversed(names))
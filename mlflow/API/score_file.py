@@ -0,0 +1,227 @@
+"""
+Scores a large CSV or Parquet file offline, without the HTTP server or JSON.
+
+Loads the model with the API's own loading code (MODEL_NAME@MODEL_STAGE by default), reads
+the input in the CarPrice_Assignment.csv layout in chunks of --chunk-rows, scores the
+chunks on a pool of worker processes and writes the predictions, in input order, to a CSV
+or Parquet file next to the --keep columns. Each finished chunk is saved under
+<output>.parts, so an interrupted run picks up after its last finished chunk with --resume.
+
+    python score_file.py listings.csv predictions.parquet --workers 4
+    python score_file.py listings.parquet predictions.csv --chunk-rows 50000 --resume
+    python score_file.py listings.csv predictions.csv --local-model-dir <artifact directory>
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import time
+from collections import deque
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pa_parquet
+
+# Offline scoring runs its own worker pool and doesn't feed the API's live monitoring
+os.environ["INFERENCE_WORKERS"] = "0"
+os.environ.setdefault("DRIFT_MONITOR_ENABLED", "false")
+os.environ.setdefault("PREDICTION_LOG_ENABLED", "false")
+
+import app  # noqa: E402
+from bulk import CSV_CONTENT_TYPES, BulkInputError, open_record_batches, rechunk, restore_integer_columns, table_to_columns, validate_schema  # noqa: E402
+from inference_pool import InferencePool  # noqa: E402
+
+INPUT_CONTENT_TYPES = {
+    ".csv": "text/csv",
+    ".parquet": "application/x-parquet",
+    ".pq": "application/x-parquet",
+    ".arrow": "application/vnd.apache.arrow.stream",
+}
+
+
+def load_model(args):
+    """Loads the bundle to score with, the same way the API would."""
+    if args.bundle:
+        return app.load_exported_bundle(args.bundle)
+    if args.local_model_dir:
+        return app.load_local_bundle(args.local_model_dir)
+    client = app.mlflow_client()
+    run_id = args.run_id or client.get_model_version_by_alias(app.MODEL_NAME, app.MODEL_STAGE).run_id
+    return app.load_bundle(client, run_id)
+
+
+def part_path(parts_dir: str, index: int) -> str:
+    return os.path.join(parts_dir, f"part-{index:08d}.parquet")
+
+
+def prepare_parts_dir(parts_dir: str, manifest: dict, resume: bool) -> int:
+    """
+    Creates the directory of finished chunks, or checks it belongs to the same job when
+    resuming. Returns the number of chunks already finished.
+    """
+    manifest_path = os.path.join(parts_dir, "manifest.json")
+    if resume and os.path.exists(manifest_path):
+        with open(manifest_path, "r") as f:
+            previous = json.load(f)
+        if previous != manifest:
+            changed = sorted(key for key in manifest if previous.get(key) != manifest[key])
+            raise SystemExit(f"Can't resume: {', '.join(changed)} changed since the interrupted run. Start over without --resume.")
+        finished = 0
+        while os.path.exists(part_path(parts_dir, finished)):
+            finished += 1
+        return finished
+
+    if os.path.exists(parts_dir):
+        shutil.rmtree(parts_dir)
+    os.makedirs(parts_dir)
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f)
+    return 0
+
+
+def write_part(parts_dir: str, index: int, kept: pa.Table, predictions: np.ndarray):
+    table = kept.append_column("predicted_price", pa.array(np.asarray(predictions, dtype=np.float64)))
+    path = part_path(parts_dir, index)
+    # Written under a temporary name so a part only counts as finished once complete
+    pa_parquet.write_table(table, f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+
+
+def merge_parts(parts_dir: str, chunks: int, output: str):
+    """Concatenates the finished chunks into the output file, in order."""
+    tmp_output = f"{output}.tmp"
+    writer = None
+    try:
+        for index in range(chunks):
+            table = pa_parquet.read_table(part_path(parts_dir, index))
+            if writer is None:
+                writer = pa_parquet.ParquetWriter(tmp_output, table.schema) if output.endswith((".parquet", ".pq")) else pa_csv.CSVWriter(tmp_output, table.schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is not None:
+        os.replace(tmp_output, output)
+
+
+class Progress:
+    """Logs rows scored and throughput every `interval` seconds."""
+
+    def __init__(self, interval: float, skipped_rows: int):
+        self.interval = interval
+        self.started = self.reported = time.monotonic()
+        self.rows = 0
+        self.rows_at_report = 0
+        self.skipped_rows = skipped_rows
+
+    def add(self, rows: int):
+        self.rows += rows
+        now = time.monotonic()
+        if now - self.reported >= self.interval:
+            recent = (self.rows - self.rows_at_report) / (now - self.reported)
+            logging.info(f"Scored {self.skipped_rows + self.rows:,} rows ({recent:,.0f} rows/s now, {self.rate():,.0f} rows/s overall).")
+            self.reported, self.rows_at_report = now, self.rows
+
+    def rate(self) -> float:
+        return self.rows / max(time.monotonic() - self.started, 1e-9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV, Parquet or Arrow IPC stream file in the CarPrice_Assignment.csv layout.")
+    parser.add_argument("output", help="File to write; .parquet/.pq writes Parquet, anything else CSV.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--run-id", help="Registry run to score with (default: the run behind MODEL_NAME@MODEL_STAGE).")
+    source.add_argument("--local-model-dir", help="Local artifact directory to score with instead of a registry run.")
+    source.add_argument("--bundle", help="Bundle file written by export_bundle.py to score with.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: one per CPU).")
+    parser.add_argument("--chunk-rows", type=int, default=app.BULK_CHUNK_ROWS, help="Rows per chunk (default: BULK_CHUNK_ROWS).")
+    parser.add_argument("--keep", default="car_ID", help="Comma-separated input columns copied to the output (default: car_ID).")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run after its last finished chunk.")
+    parser.add_argument("--report-seconds", type=float, default=10.0, help="How often to log progress.")
+    args = parser.parse_args()
+
+    extension = os.path.splitext(args.input)[1].lower()
+    if extension not in INPUT_CONTENT_TYPES:
+        raise SystemExit(f"Unsupported input file type '{extension}'. Use one of: {', '.join(INPUT_CONTENT_TYPES)}.")
+    if args.chunk_rows <= 0 or args.workers <= 0:
+        raise SystemExit("--chunk-rows and --workers must be positive.")
+    keep = [name.strip() for name in args.keep.split(",") if name.strip()]
+
+    bundle = load_model(args)
+    pool = None
+    if bundle.native_model is not None and args.workers > 1:
+        pool = InferencePool(args.workers)
+        bundle_path = pool.publish(bundle.native_model, bundle.preprocessor)
+    elif args.workers > 1:
+        logging.warning("The model is served through pyfunc, which can't run in worker processes; scoring in this process.")
+
+    stat = os.stat(args.input)
+    manifest = {
+        "input": os.path.abspath(args.input),
+        "input_size": stat.st_size,
+        "input_mtime_ns": stat.st_mtime_ns,
+        "run_id": bundle.run_id,
+        "chunk_rows": args.chunk_rows,
+        "keep": keep
+    }
+    parts_dir = f"{args.output}.parts"
+    finished = prepare_parts_dir(parts_dir, manifest, args.resume)
+    if finished:
+        logging.info(f"Resuming after {finished} finished chunks of {args.chunk_rows:,} rows.")
+
+    progress = Progress(args.report_seconds, finished * args.chunk_rows)
+    # Bounded so at most a few chunks per worker are held in memory
+    in_flight = deque()
+    max_in_flight = 2 * args.workers
+
+    def finish_oldest():
+        index, kept, result = in_flight.popleft()
+        predictions = result.result()[0] if pool is not None else result
+        write_part(parts_dir, index, kept, predictions)
+        progress.add(len(predictions))
+
+    chunks = 0
+    from_csv = INPUT_CONTENT_TYPES[extension] in CSV_CONTENT_TYPES
+    try:
+        with open(args.input, "rb") as source_file:
+            batches = open_record_batches(source_file, INPUT_CONTENT_TYPES[extension], app.BULK_NUMERIC_COLUMNS, app.BULK_STRING_COLUMNS)
+            for index, table in enumerate(rechunk(batches, args.chunk_rows)):
+                chunks = index + 1
+                if index == 0:
+                    validate_schema(table.schema, app.BULK_NUMERIC_COLUMNS, app.BULK_STRING_COLUMNS)
+                    missing = [name for name in keep if name not in table.column_names]
+                    if missing:
+                        raise BulkInputError(f"--keep columns not in the input: {', '.join(missing)}")
+                if index < finished:
+                    continue
+
+                try:
+                    columns = table_to_columns(table, app.BULK_NUMERIC_COLUMNS, app.BULK_STRING_COLUMNS)
+                except BulkInputError as e:
+                    raise BulkInputError(f"rows {index * args.chunk_rows:,}-{index * args.chunk_rows + table.num_rows - 1:,}: {e}")
+                result = pool.submit(bundle_path, columns) if pool is not None else app.predict_array(bundle, columns)
+                kept = table.select(keep)
+                if from_csv:
+                    # The CSV reader parses every numeric column as float64; integer IDs stay integers
+                    kept = restore_integer_columns(kept, app.BULK_INTEGER_COLUMNS)
+                in_flight.append((index, kept, result))
+                while len(in_flight) >= max_in_flight:
+                    finish_oldest()
+            while in_flight:
+                finish_oldest()
+    except BulkInputError as e:
+        raise SystemExit(f"Invalid input: {e}")
+    finally:
+        if pool is not None:
+            pool.close()
+
+    merge_parts(parts_dir, chunks, args.output)
+    shutil.rmtree(parts_dir)
+    logging.info(f"Wrote {progress.skipped_rows + progress.rows:,} predictions to {args.output} ({progress.rate():,.0f} rows/s).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Mapping
+
+import numpy as np
+
+from metrics import observe_batch
+from model_bundle import ModelBundle
+
+
+def batch_rows(batch: Mapping[str, Any]) -> int:
+    return len(next(iter(batch.values()))) if batch else 0
+
+
+def canary_row_mask(rows: int, percent: float) -> np.ndarray:
+    """Picks each row for the canary independently with probability `percent` / 100."""
+    if percent <= 0:
+        return np.zeros(rows, dtype=bool)
+    # The legacy global generator locks internally, so request threads can share it
+    return np.random.random(rows) < percent / 100.0
+
+
+def take_rows(batch: Mapping[str, Any], indices: np.ndarray) -> dict:
+    """Selects rows of a column mapping whose columns are lists or NumPy arrays."""
+    selected = {}
+    for name, values in batch.items():
+        if isinstance(values, np.ndarray):
+            selected[name] = values[indices]
+        else:
+            selected[name] = [values[i] for i in indices.tolist()]
+    return selected
+
+
+def model_label(bundle: ModelBundle) -> str:
+    return f"{bundle.model_name}@{bundle.model_alias}" if bundle.model_name else bundle.run_id
+
+
+class ShadowScorer:
+    """
+    Scores copies of served batches on a shadow model and compares them with what was served.
+
+    `submit()` only enqueues the batch; `workers` background threads run `score` on it, so
+    the shadow model adds no latency to responses. The queue holds at most `queue_size`
+    batches and a batch that waited longer than `max_queue_seconds` is discarded unscored:
+    when the shadow model can't keep up its work is shed and counted, never piled up.
+    """
+
+    def __init__(
+        self,
+        score: Callable[[ModelBundle, Mapping[str, Any]], Any],
+        queue_size: int,
+        workers: int = 1,
+        max_queue_seconds: float = 5.0,
+        latency_histogram=None,
+        rows_counter=None,
+        delta_histogram=None,
+        relative_delta_histogram=None,
+        shed_counter=None,
+        queue_gauge=None
+    ):
+        self.score = score
+        self.max_queue_seconds = max_queue_seconds
+        self.latency_histogram = latency_histogram
+        self.rows_counter = rows_counter
+        self.delta_histogram = delta_histogram
+        self.relative_delta_histogram = relative_delta_histogram
+        self.shed_counter = shed_counter
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max(1, queue_size))
+        self._closed = threading.Event()
+        if queue_gauge is not None:
+            queue_gauge.set_function(self._queue.qsize)
+        self._threads = [
+            threading.Thread(target=self._run, name=f"shadow-scorer-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, bundle: ModelBundle, batch: Mapping[str, Any], served: Any):
+        """Queues a served batch and its served predictions for shadow scoring. Never blocks."""
+        try:
+            self._queue.put_nowait((time.monotonic(), bundle, batch, served))
+        except queue.Full:
+            self.shed(len(served), "queue_full")
+
+    def shed(self, rows: int, reason: str):
+        if self.shed_counter is not None:
+            self.shed_counter.labels(reason=reason).inc(rows)
+
+    def close(self):
+        """Stops the workers; batches still queued are dropped."""
+        self._closed.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+    def _run(self):
+        while not self._closed.is_set():
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                self._process(*item)
+            except Exception as e:
+                logging.error(f"Shadow scoring failed: {e}", exc_info=True)
+                self.shed(len(item[3]), "error")
+
+    def _process(self, enqueued_at: float, bundle: ModelBundle, batch: Mapping[str, Any], served: Any):
+        if time.monotonic() - enqueued_at > self.max_queue_seconds:
+            self.shed(len(served), "stale")
+            return
+
+        started = time.perf_counter()
+        shadow = np.asarray(self.score(bundle, batch), dtype=np.float64).ravel()
+        elapsed = time.perf_counter() - started
+
+        label = model_label(bundle)
+        served = np.asarray(served, dtype=np.float64).ravel()
+        if self.latency_histogram is not None:
+            self.latency_histogram.labels(model=label, role="shadow").observe(elapsed)
+        if self.rows_counter is not None:
+            self.rows_counter.labels(model=label, role="shadow").inc(len(shadow))
+
+        delta = np.abs(shadow - served)
+        if self.delta_histogram is not None:
+            observe_batch(self.delta_histogram.labels(model=label), delta)
+        if self.relative_delta_histogram is not None:
+            observe_batch(self.relative_delta_histogram.labels(model=label), delta / np.maximum(np.abs(served), 1.0))
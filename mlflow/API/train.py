@@ -0,0 +1,355 @@
+"""
+Trains the car price model and produces the artifacts the API loads from a registry run.
+
+Builds features from CarPrice_Assignment.csv with preprocess_batch_data, exactly as the API
+does, and caches the encoded cross-validation folds on disk under a hash of the data. It then
+grid-searches linear, random forest and XGBoost models with k-fold cross-validation. The fits
+run in parallel on a process pool and each configuration's score is cached too, so a retrain
+that only adds or changes hyperparameters only fits the new configurations.
+
+The best configuration of each family is refit on all rows and logged to MLflow with
+scaler.sav, model_features.json, target_encoder.sav, ordinal_encoder.sav and
+drift_reference.json. The best XGBoost model is registered and given --alias, since the
+API's native, worker pool, explanation and compiled paths need an XGBoost booster;
+--register-family picks another family, or "best" for the lowest CV MAE of any family.
+
+    python train.py                                         # register as MODEL_NAME@challenger
+    python train.py --register-family best                  # register whichever family scores best
+    python train.py --alias prod --families xgboost --jobs 8
+    python train.py --search-space space.json --no-mlflow --output-dir /tmp/car-price-model
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from drift import DRIFT_PROFILE_ARTIFACT, build_reference_profile, read_dataset_columns
+from preprocessing import NUMERICAL_FEATURES, ORDINAL_FEATURES, TARGET_ENCODED_FEATURES, preprocess_batch_data
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DATASET = os.path.join(API_DIR, "..", "CarPrice_Assignment.csv")
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "car-price-train")
+
+# Columns preprocess_batch_data leaves for the model, in model_features.json order.
+# boreratio, stroke and compressionratio pass through unscaled.
+MODEL_FEATURES = NUMERICAL_FEATURES + ["boreratio", "stroke", "compressionratio"] + TARGET_ENCODED_FEATURES + ORDINAL_FEATURES
+
+# Bump when feature building changes, so cached folds aren't reused
+FEATURES_VERSION = 1
+
+# Grids searched by default; --search-space replaces them per family
+SEARCH_SPACES: Dict[str, Dict[str, List[Any]]] = {
+    "linear": {"fit_intercept": [True, False], "positive": [False, True]},
+    "random_forest": {"n_estimators": [300], "max_depth": [None, 8], "min_samples_leaf": [1, 2], "max_features": [1.0, 0.5]},
+    "xgboost": {"n_estimators": [300], "max_depth": [3, 4, 6], "learning_rate": [0.05, 0.1], "subsample": [0.8, 1.0]},
+}
+
+
+# --- Features ---
+def fit_preprocessing(df: pd.DataFrame):
+    """Fits the scaler, target encoder and ordinal encoder on raw rows with a price column."""
+    import category_encoders as ce
+    from sklearn.preprocessing import StandardScaler
+
+    names = df["CarName"].str.split(" ")
+    categorical = pd.DataFrame({
+        "carbrand": names.str[0].str.lower(),
+        "cartype": names.apply(lambda parts: " ".join(parts[1:]) if len(parts) > 1 else "unknown").str.lower(),
+    })
+    for col in ORDINAL_FEATURES:
+        categorical[col] = df[col].astype(str).str.lower()
+
+    scaler = StandardScaler().fit(df[NUMERICAL_FEATURES])
+    target_encoder = ce.TargetEncoder(cols=TARGET_ENCODED_FEATURES).fit(categorical[TARGET_ENCODED_FEATURES], df["price"])
+    ordinal_encoder = ce.OrdinalEncoder(cols=ORDINAL_FEATURES).fit(categorical[ORDINAL_FEATURES])
+    return scaler, target_encoder, ordinal_encoder
+
+
+def encode(df: pd.DataFrame, scaler, target_encoder, ordinal_encoder) -> pd.DataFrame:
+    """Encodes raw rows exactly the way the API does before predicting."""
+    return preprocess_batch_data(df.drop(columns=["price"], errors="ignore"), scaler, MODEL_FEATURES, target_encoder, ordinal_encoder)
+
+
+def data_key(dataset_path: str, folds: int, seed: int) -> str:
+    digest = hashlib.sha256()
+    with open(dataset_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update(json.dumps({"features": MODEL_FEATURES, "version": FEATURES_VERSION, "folds": folds, "seed": seed}).encode())
+    return digest.hexdigest()[:24]
+
+
+def load_or_build_folds(dataset_path: str, cache_dir: str, folds: int, seed: int) -> Tuple[str, str]:
+    """
+    Returns the cache directory of this dataset and the path of its encoded folds, building
+    them on a miss. Encoders are fitted on each training fold only, so target encoding never
+    sees the rows it is validated on.
+    """
+    from sklearn.model_selection import KFold
+
+    key_dir = os.path.join(cache_dir, data_key(dataset_path, folds, seed))
+    folds_path = os.path.join(key_dir, "folds.pkl")
+    if os.path.exists(folds_path):
+        logging.info(f"Reusing encoded folds from {folds_path}")
+        return key_dir, folds_path
+
+    started = time.perf_counter()
+    df = pd.read_csv(dataset_path)
+    encoded_folds = []
+    for train_index, val_index in KFold(n_splits=folds, shuffle=True, random_state=seed).split(df):
+        train, val = df.iloc[train_index], df.iloc[val_index]
+        artifacts = fit_preprocessing(train)
+        encoded_folds.append((
+            encode(train, *artifacts).to_numpy(np.float32), train["price"].to_numpy(np.float64),
+            encode(val, *artifacts).to_numpy(np.float32), val["price"].to_numpy(np.float64)
+        ))
+
+    os.makedirs(key_dir, exist_ok=True)
+    with open(f"{folds_path}.tmp", "wb") as f:
+        pickle.dump(encoded_folds, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{folds_path}.tmp", folds_path)
+    logging.info(f"Encoded {folds} folds of {len(df)} rows in {time.perf_counter() - started:.1f}s; cached in {folds_path}")
+    return key_dir, folds_path
+
+
+# --- Models ---
+def make_model(family: str, params: Dict[str, Any], seed: int, n_jobs: int = 1):
+    if family == "linear":
+        from sklearn.linear_model import LinearRegression
+        return LinearRegression(**params)
+    if family == "random_forest":
+        from sklearn.ensemble import RandomForestRegressor
+        return RandomForestRegressor(random_state=seed, n_jobs=n_jobs, **params)
+    if family == "xgboost":
+        import xgboost as xgb
+        return xgb.XGBRegressor(random_state=seed, n_jobs=n_jobs, **params)
+    raise ValueError(f"Unknown model family '{family}'; expected one of {list(SEARCH_SPACES)}.")
+
+
+def grid(space: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    names = sorted(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def params_key(family: str, params: Dict[str, Any]) -> str:
+    return hashlib.sha256(json.dumps([family, params], sort_keys=True).encode()).hexdigest()[:16]
+
+
+# --- Cross-validation Worker State ---
+_worker_folds = None
+
+
+def _worker_init(folds_path: str):
+    global _worker_folds
+    with open(folds_path, "rb") as f:
+        _worker_folds = pickle.load(f)
+
+
+def _worker_score(family: str, params: Dict[str, Any], fold: int, seed: int) -> float:
+    """Fits one configuration on one training fold and returns its validation MAE."""
+    x_train, y_train, x_val, y_val = _worker_folds[fold]
+    model = make_model(family, params, seed)
+    model.fit(x_train, y_train)
+    return float(np.mean(np.abs(model.predict(x_val) - y_val)))
+
+
+def cross_validate(configs: List[Tuple[str, Dict[str, Any]]], key_dir: str, folds_path: str, folds: int, seed: int, jobs: int) -> Dict[str, List[float]]:
+    """
+    Returns the per-fold MAE of every (family, params) configuration. Scores cached from
+    earlier runs on the same data are reused; the rest are fitted in parallel, one fold each.
+    """
+    results_dir = os.path.join(key_dir, "cv")
+    os.makedirs(results_dir, exist_ok=True)
+    scores: Dict[str, List[float]] = {}
+    missing = []
+    for family, params in configs:
+        key = params_key(family, params)
+        path = os.path.join(results_dir, f"{key}.json")
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                scores[key] = json.load(f)["fold_mae"]
+        else:
+            missing.append((key, family, params))
+
+    logging.info(f"{len(configs) - len(missing)} of {len(configs)} configurations already scored; fitting {len(missing) * folds} folds on {jobs} processes.")
+    if not missing:
+        return scores
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_worker_init, initargs=(folds_path,)) as executor:
+        futures = {
+            (key, fold): executor.submit(_worker_score, family, params, fold, seed)
+            for key, family, params in missing
+            for fold in range(folds)
+        }
+        for key, family, params in missing:
+            scores[key] = [futures[(key, fold)].result() for fold in range(folds)]
+            with open(os.path.join(results_dir, f"{key}.json"), "w") as f:
+                json.dump({"family": family, "params": params, "fold_mae": scores[key]}, f)
+    logging.info(f"Cross-validation took {time.perf_counter() - started:.1f}s.")
+    return scores
+
+
+# --- Final Models ---
+def fit_final(family: str, params: Dict[str, Any], df: pd.DataFrame, artifacts, seed: int, jobs: int):
+    """Refits a configuration on every row; the feature names are kept for the API's explanations."""
+    features = encode(df, *artifacts)
+    model = make_model(family, params, seed, n_jobs=jobs)
+    model.fit(features, df["price"])
+    return model, features
+
+
+def write_artifacts(directory: str, family: str, model, features: pd.DataFrame, artifacts, metrics: Dict[str, float], drift_profile: Dict[str, Any]):
+    """Writes a model in the LOCAL_MODEL_DIR layout (the same files a registry run holds)."""
+    from mlflow.models import infer_signature
+
+    os.makedirs(directory, exist_ok=True)
+    signature = infer_signature(features, model.predict(features))
+    model_path = os.path.join(directory, "car_price_model")
+    # save_model refuses to overwrite, and a previous --output-dir run may have left one
+    shutil.rmtree(model_path, ignore_errors=True)
+    if family == "xgboost":
+        import mlflow.xgboost
+        mlflow.xgboost.save_model(model, model_path, signature=signature)
+    else:
+        import mlflow.sklearn
+        mlflow.sklearn.save_model(model, model_path, signature=signature, serialization_format="cloudpickle")
+
+    scaler, target_encoder, ordinal_encoder = artifacts
+    for name, artifact in (("scaler.sav", scaler), ("target_encoder.sav", target_encoder), ("ordinal_encoder.sav", ordinal_encoder)):
+        with open(os.path.join(directory, name), "wb") as f:
+            pickle.dump(artifact, f)
+    with open(os.path.join(directory, "model_features.json"), "w") as f:
+        json.dump(MODEL_FEATURES, f)
+    with open(os.path.join(directory, "metrics.json"), "w") as f:
+        json.dump(metrics, f)
+    with open(os.path.join(directory, DRIFT_PROFILE_ARTIFACT), "w") as f:
+        json.dump(drift_profile, f)
+
+
+def log_run(directory: str, family: str, params: Dict[str, Any], metrics: Dict[str, float], data_hash: str) -> str:
+    """Logs a directory written by `write_artifacts` as one MLflow run and returns its run_id."""
+    import mlflow
+
+    with mlflow.start_run(run_name=f"car_price_{family}") as run:
+        mlflow.set_tags({"model_family": family, "data_hash": data_hash})
+        mlflow.log_params(params)
+        mlflow.log_metrics(metrics)
+        # Same artifact layout the API downloads: car_price_model/ plus the preprocessing files
+        mlflow.log_artifacts(directory)
+    return run.info.run_id
+
+
+def register(run_id: str, model_name: str, alias: str):
+    import mlflow
+    from mlflow.tracking import MlflowClient
+
+    version = mlflow.register_model(f"runs:/{run_id}/car_price_model", model_name).version
+    MlflowClient().set_registered_model_alias(model_name, alias, version)
+    logging.info(f"Registered run {run_id} as {model_name} version {version} and pointed '{alias}' at it.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="Training data in the CarPrice_Assignment.csv layout.")
+    parser.add_argument("--families", default=",".join(SEARCH_SPACES), help="Comma-separated model families to search.")
+    parser.add_argument("--search-space", help="JSON file of {family: {param: [values]}} replacing the default grids.")
+    parser.add_argument("--folds", type=int, default=5, help="Cross-validation folds.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Processes fitting folds in parallel.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--cache-dir", default=os.getenv("TRAIN_CACHE_DIR", DEFAULT_CACHE_DIR), help="Where encoded folds and CV scores are cached.")
+    parser.add_argument("--model-name", default=os.getenv("MODEL_NAME", "xgboost_regressor"), help="Registered model name (default: MODEL_NAME).")
+    parser.add_argument("--alias", default="challenger", help="Alias pointed at the new version; use MODEL_STAGE (prod) to serve it right away.")
+    parser.add_argument("--register-family", default="xgboost", help="Family whose best model is registered and written to --output-dir; 'best' takes the lowest CV MAE of any family.")
+    parser.add_argument("--experiment", default=os.getenv("MLFLOW_EXPERIMENT_NAME", "car_price_prediction"), help="MLflow experiment to log to.")
+    parser.add_argument("--output-dir", help="Also write the best model's artifacts here, in the LOCAL_MODEL_DIR layout.")
+    parser.add_argument("--no-mlflow", action="store_true", help="Skip logging and registering (needs --output-dir).")
+    args = parser.parse_args()
+
+    if args.no_mlflow and not args.output_dir:
+        raise SystemExit("--no-mlflow needs --output-dir, or the trained model goes nowhere.")
+    spaces = dict(SEARCH_SPACES)
+    if args.search_space:
+        with open(args.search_space, "r") as f:
+            spaces.update(json.load(f))
+    families = [family.strip() for family in args.families.split(",") if family.strip()]
+    unknown = [family for family in families if family not in spaces]
+    if unknown:
+        raise SystemExit(f"Unknown model families: {', '.join(unknown)}. Choose from {', '.join(SEARCH_SPACES)}.")
+    if args.register_family != "best" and args.register_family not in families:
+        raise SystemExit(f"--register-family {args.register_family} isn't searched; add it to --families or pass --register-family best.")
+
+    key_dir, folds_path = load_or_build_folds(args.dataset, args.cache_dir, args.folds, args.seed)
+    configs = [(family, params) for family in families for params in grid(spaces[family])]
+    scores = cross_validate(configs, key_dir, folds_path, args.folds, args.seed, max(1, args.jobs))
+
+    # Best configuration of each family by mean validation MAE
+    best: Dict[str, Tuple[Dict[str, Any], List[float]]] = {}
+    for family, params in configs:
+        fold_mae = scores[params_key(family, params)]
+        if family not in best or np.mean(fold_mae) < np.mean(best[family][1]):
+            best[family] = (params, fold_mae)
+    for family, (params, fold_mae) in best.items():
+        logging.info(f"Best {family}: CV MAE {np.mean(fold_mae):,.2f} ± {np.std(fold_mae):,.2f} with {params}")
+
+    if not args.no_mlflow:
+        import mlflow
+
+        experiment_id = mlflow.set_experiment(args.experiment).experiment_id
+        if experiment_id != "1":
+            # app.load_bundle downloads from s3://mlflow/1/<run_id>/artifacts
+            logging.warning(f"Experiment '{args.experiment}' has id {experiment_id}; the API loads registry runs from experiment 1.")
+
+    overall = min(best, key=lambda family: np.mean(best[family][1]))
+    logging.info(f"Best model: {overall} (CV MAE {np.mean(best[overall][1]):,.2f}).")
+    winner = overall if args.register_family == "best" else args.register_family
+    if winner != overall:
+        logging.info(f"Registering the best {winner} model (CV MAE {np.mean(best[winner][1]):,.2f}); pass --register-family best to register {overall} instead.")
+    if winner != "xgboost":
+        logging.warning(f"Registering a {winner} model: the API serves it through pyfunc only, without /predict/explain, the worker pool or the compiled backends.")
+
+    df = pd.read_csv(args.dataset)
+    artifacts = fit_preprocessing(df)
+    reference_batch = read_dataset_columns(args.dataset)
+    winner_run_id = None
+    # Every family's best is logged for comparison; without MLflow only the winner is needed
+    for family in ([winner] if args.no_mlflow else list(best)):
+        params, fold_mae = best[family]
+        model, features = fit_final(family, params, df, artifacts, args.seed, max(1, args.jobs))
+        predictions = model.predict(features)
+        metrics = {
+            # The API reports "mae" as the model's error, so it holds the held-out estimate
+            "mae": float(np.mean(fold_mae)),
+            "cv_mae_std": float(np.std(fold_mae)),
+            "train_mae": float(np.mean(np.abs(predictions - df["price"].to_numpy())))
+        }
+        drift_profile = build_reference_profile(reference_batch, predictions)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            directory = args.output_dir if family == winner and args.output_dir else tmp_dir
+            write_artifacts(directory, family, model, features, artifacts, metrics, drift_profile)
+            if not args.no_mlflow:
+                run_id = log_run(directory, family, params, metrics, os.path.basename(key_dir))
+                if family == winner:
+                    winner_run_id = run_id
+
+    if args.output_dir:
+        logging.info(f"Wrote the {winner} model to {args.output_dir}; serve it with LOCAL_MODEL_DIR={args.output_dir}.")
+    if winner_run_id is not None:
+        register(winner_run_id, args.model_name, args.alias)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    main()
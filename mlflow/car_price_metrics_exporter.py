@@ -2,157 +2,329 @@
 """
 Car Price Prediction Metrics Exporter for Prometheus
 Exposes car price prediction specific metrics in Prometheus format
+
+Each collector runs in its own asyncio task with its own interval and timeout, over a
+shared asyncpg pool and a shared httpx client, so a slow or hung dependency only delays
+the metrics that depend on it. Every collector reports its duration, outcome, last
+success time and staleness.
+
+The prediction collector is a synthetic probe: it sends valid batches sampled from
+CarPrice_Assignment.csv at several sizes and checks the answers against predictions
+computed locally from the same registry run, so latency SLO data doesn't depend on
+user traffic.
 """
 
+import asyncio
+import csv
 import os
+import random
+import sys
+import threading
 import time
-import psycopg2
-import requests
+import asyncpg
+import httpx
 from prometheus_client import start_http_server, Gauge, Counter, Histogram
-from prometheus_client.core import REGISTRY
 
 # Prometheus metrics for car price prediction
 prediction_requests_total = Counter('car_price_prediction_requests_total', 'Total number of prediction requests', ['status', 'model_version'])
-prediction_duration_seconds = Histogram('car_price_prediction_duration_seconds', 'Time spent on prediction', ['model_version'])
+prediction_duration_seconds = Histogram('car_price_prediction_duration_seconds', 'Time spent on prediction', ['model_version', 'batch_size'])
+prediction_max_abs_error = Gauge('car_price_prediction_max_abs_error', 'Largest difference between probe predictions and the local reference in the last checked batch', ['model_version'])
 prediction_price_range = Histogram('car_price_prediction_price_range', 'Distribution of predicted prices', ['price_range'])
 model_accuracy_score = Gauge('car_price_model_accuracy', 'Model accuracy score', ['model_version'])
 model_last_updated = Gauge('car_price_model_last_updated_timestamp', 'Last model update timestamp', ['model_version'])
 
-# Database connection
-def get_db_connection():
-    return psycopg2.connect(
-        host=os.getenv('POSTGRES_HOST', 'postgres'),
-        port=os.getenv('POSTGRES_PORT', 5432),
-        database=os.getenv('POSTGRES_DB', 'mlflow'),
-        user=os.getenv('POSTGRES_USER', 'mlflow'),
-        password=os.getenv('POSTGRES_PASSWORD', 'mlflow123')
-    )
-
-def collect_mlflow_metrics():
+# Metrics about the collectors themselves
+collector_duration_seconds = Histogram(
+    'car_price_exporter_collector_duration_seconds',
+    'Time spent in one run of a collector',
+    ['collector'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+collector_runs_total = Counter('car_price_exporter_collector_runs_total', 'Collector runs by outcome', ['collector', 'result'])
+collector_last_success = Gauge('car_price_exporter_collector_last_success_timestamp_seconds', 'Time of the last successful collector run', ['collector'])
+collector_staleness_seconds = Gauge('car_price_exporter_collector_staleness_seconds', 'Seconds since the collector last succeeded', ['collector'])
+
+API_URL = os.getenv('API_URL', 'http://fastapi-app:8005')
+EXPORTER_PORT = int(os.getenv('EXPORTER_PORT', 8003))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 2))
+
+# Synthetic probe configuration
+PROBE_DATASET = os.getenv('PROBE_DATASET', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'CarPrice_Assignment.csv'))
+PROBE_BATCH_SIZES = [int(size) for size in os.getenv('PROBE_BATCH_SIZES', '1,32,512').split(',')]
+PROBE_CONCURRENCY = int(os.getenv('PROBE_CONCURRENCY', 2))
+# Check probe answers against the registry model (needs MLflow and artifact store access)
+PROBE_VERIFY = os.getenv('PROBE_VERIFY', 'true' if os.getenv('MLFLOW_TRACKING_URI') else 'false').lower() == 'true'
+PROBE_VERIFY_RTOL = float(os.getenv('PROBE_VERIFY_RTOL', 1e-4))
+PROBE_VERIFY_ATOL = float(os.getenv('PROBE_VERIFY_ATOL', 0.01))
+
+
+def collector_setting(name, setting, default):
+    """Per-collector setting, e.g. MLFLOW_INTERVAL_SECONDS or PREDICTION_TIMEOUT_SECONDS."""
+    return float(os.getenv(f'{name.upper()}_{setting}', default))
+
+
+class Resources:
+    """Connections shared by all collectors, created on first use."""
+
+    def __init__(self):
+        self.http = httpx.AsyncClient(
+            base_url=API_URL,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5)
+        )
+        self._db_pool = None
+        self._db_pool_lock = asyncio.Lock()
+        # Probe rows, read from the dataset on first use
+        self.probe_rows = None
+
+    async def db_pool(self):
+        async with self._db_pool_lock:
+            if self._db_pool is None:
+                self._db_pool = await asyncpg.create_pool(
+                    host=os.getenv('POSTGRES_HOST', 'postgres'),
+                    port=int(os.getenv('POSTGRES_PORT', 5432)),
+                    database=os.getenv('POSTGRES_DB', 'mlflow'),
+                    user=os.getenv('POSTGRES_USER', 'mlflow'),
+                    password=os.getenv('POSTGRES_PASSWORD', 'mlflow123'),
+                    min_size=1,
+                    max_size=DB_POOL_SIZE,
+                    server_settings={'application_name': 'car-price-metrics-exporter'}
+                )
+            return self._db_pool
+
+    async def close(self):
+        await self.http.aclose()
+        if self._db_pool is not None:
+            await self._db_pool.close()
+
+
+async def collect_mlflow_metrics(resources):
     """Collect metrics from MLflow database"""
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get latest model run information
-        cursor.execute("""
-            SELECT 
-                r.run_uuid,
-                r.start_time,
-                r.end_time,
-                p.value as accuracy_score,
-                rm.name as model_name,
-                rm.creation_timestamp
-            FROM runs r
-            JOIN experiments e ON r.experiment_id = e.experiment_id
-            LEFT JOIN params p ON r.run_uuid = p.run_uuid AND p.key = 'accuracy'
-            LEFT JOIN registered_models rm ON rm.name LIKE '%car%price%'
-            WHERE e.name LIKE '%car%price%'
-            ORDER BY r.start_time DESC
-            LIMIT 1
-        """)
-        
-        result = cursor.fetchone()
-        if result:
-            run_uuid, start_time, end_time, accuracy_score, model_name, creation_timestamp = result
-            
-            # Set model accuracy if available
-            if accuracy_score:
-                model_accuracy_score.labels(model_version=model_name or "unknown").set(float(accuracy_score))
-            
-            # Set last updated timestamp
-            if creation_timestamp:
-                model_last_updated.labels(model_version=model_name or "unknown").set(creation_timestamp.timestamp())
-        
-        cursor.close()
-        conn.close()
-        
-    except Exception as e:
-        print(f"Error collecting MLflow metrics: {e}")
-
-def collect_api_metrics():
+    pool = await resources.db_pool()
+    # Get latest model run information
+    result = await pool.fetchrow("""
+        SELECT
+            r.run_uuid,
+            r.start_time,
+            r.end_time,
+            p.value as accuracy_score,
+            rm.name as model_name,
+            rm.creation_time
+        FROM runs r
+        JOIN experiments e ON r.experiment_id = e.experiment_id
+        LEFT JOIN params p ON r.run_uuid = p.run_uuid AND p.key = 'accuracy'
+        LEFT JOIN registered_models rm ON rm.name LIKE '%car%price%'
+        WHERE e.name LIKE '%car%price%'
+        ORDER BY r.start_time DESC
+        LIMIT 1
+    """)
+
+    if result:
+        model_name = result['model_name'] or "unknown"
+
+        # Set model accuracy if available
+        if result['accuracy_score']:
+            model_accuracy_score.labels(model_version=model_name).set(float(result['accuracy_score']))
+
+        # Set last updated timestamp (MLflow stores milliseconds since the epoch)
+        if result['creation_time']:
+            model_last_updated.labels(model_version=model_name).set(result['creation_time'] / 1000.0)
+
+
+async def collect_api_metrics(resources):
     """Collect metrics from FastAPI application"""
-    try:
-        # Check API health
-        response = requests.get("http://fastapi-app:8005/", timeout=5)
-        if response.status_code == 200:
-            print("API is healthy")
-    except Exception as e:
-        print(f"API health check failed: {e}")
-
-def collect_prediction_metrics():
-    """Collect prediction-specific metrics"""
-    try:
-        # Simulate prediction request to collect metrics
-        test_data = {
-            "carname": "toyota camry",
-            "wheelbase": 99.8,
-            "carheight": 54.3,
-            "horsepower": 102,
-            "peakrpm": 5500,
-            "citympg": 24,
-            "fueltype": "gas",
-            "aspiration": "std",
-            "doornumber": "two",
-            "carbody": "sedan",
-            "drivewheel": "fwd",
-            "enginelocation": "front",
-            "enginetype": "ohc",
-            "cylindernumber": "four",
-            "fuelsystem": "mpfi"
-        }
-        
-        start_time = time.time()
-        response = requests.post(
-            "http://fastapi-app:8005/predict",
-            json=test_data,
-            timeout=10
+    # Check API health
+    response = await resources.http.get("/")
+    response.raise_for_status()
+
+
+def load_probe_rows(path):
+    """Reads the dataset as request rows, with numbers typed the way the API expects them."""
+    def convert(value):
+        for cast in (int, float):
+            try:
+                return cast(value)
+            except ValueError:
+                pass
+        return value
+
+    with open(path, newline='') as f:
+        return [{key: convert(value) for key, value in row.items() if key != 'price'} for row in csv.DictReader(f)]
+
+
+class ReferenceModels:
+    """
+    Local reference predictions per registry run: the pyfunc model and the pandas
+    preprocessing path, independent of the API's compiled serving path.
+    """
+
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _load(self, run_id):
+        import json
+        import pickle
+        import tempfile
+        import mlflow
+        from mlflow.tracking import MlflowClient
+
+        client = MlflowClient()
+        artifact_dir = tempfile.mkdtemp(prefix=f'probe-{run_id}-')
+        model = mlflow.pyfunc.load_model(mlflow.artifacts.download_artifacts(
+            artifact_uri=f"{client.get_run(run_id).info.artifact_uri}/car_price_model",
+            dst_path=artifact_dir
+        ))
+        artifacts = {}
+        for name in ('scaler.sav', 'target_encoder.sav', 'ordinal_encoder.sav', 'model_features.json'):
+            path = client.download_artifacts(run_id, name, artifact_dir)
+            with open(path, 'rb') as f:
+                artifacts[name] = json.load(f) if name.endswith('.json') else pickle.load(f)
+        print(f"Loaded reference model for run {run_id}")
+        return model, artifacts
+
+    def predict(self, run_id, rows):
+        """Blocking; call from a worker thread. The model stays cached even if the caller gave up."""
+        import pandas as pd
+        try:
+            from preprocessing import preprocess_batch_data
+        except ImportError:
+            # Running from a checkout rather than the exporter image
+            sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'API'))
+            from preprocessing import preprocess_batch_data
+
+        with self._lock:
+            if run_id not in self._models:
+                self._models[run_id] = self._load(run_id)
+            model, artifacts = self._models[run_id]
+
+        features = preprocess_batch_data(
+            pd.DataFrame(rows),
+            artifacts['scaler.sav'],
+            artifacts['model_features.json'],
+            artifacts['target_encoder.sav'],
+            artifacts['ordinal_encoder.sav']
         )
-        duration = time.time() - start_time
-        
-        # Record prediction duration
-        prediction_duration_seconds.labels(model_version="XGBoostRegressor").observe(duration)
-        
-        if response.status_code == 200:
-            result = response.json()
-            predicted_price = result.get("predicted_price", 0)
-            
-            # Categorize price range
-            if predicted_price < 10000:
-                price_range = "low"
-            elif predicted_price < 25000:
-                price_range = "medium"
-            else:
-                price_range = "high"
-            
-            prediction_price_range.labels(price_range=price_range).observe(predicted_price)
-            prediction_requests_total.labels(status="success", model_version="XGBoostRegressor").inc()
-        else:
-            prediction_requests_total.labels(status="error", model_version="XGBoostRegressor").inc()
-            
-    except Exception as e:
-        print(f"Error collecting prediction metrics: {e}")
-        prediction_requests_total.labels(status="error", model_version="XGBoostRegressor").inc()
+        return [float(price) for price in model.predict(features)]
+
+
+reference_models = ReferenceModels()
+
+
+def price_range(predicted_price):
+    # Categorize price range
+    if predicted_price < 10000:
+        return "low"
+    elif predicted_price < 25000:
+        return "medium"
+    return "high"
+
+
+async def probe_batch(resources, rows, semaphore):
+    """Sends one batch to /predict, records its latency and verifies the answers."""
+    async with semaphore:
+        start_time = time.perf_counter()
+        try:
+            response = await resources.http.post("/predict", json=rows)
+        except Exception:
+            prediction_requests_total.labels(status="error", model_version="unknown").inc()
+            raise
+        duration = time.perf_counter() - start_time
+
+    model_version = response.headers.get("x-model-run-id", "unknown")
+    if response.status_code != 200:
+        prediction_requests_total.labels(status="error", model_version=model_version).inc()
+        response.raise_for_status()
+
+    # Record prediction duration
+    prediction_duration_seconds.labels(model_version=model_version, batch_size=str(len(rows))).observe(duration)
+    predictions = [item["predicted_price"] for item in response.json()["predictions"]]
+    for predicted_price in predictions:
+        prediction_price_range.labels(price_range=price_range(predicted_price)).observe(predicted_price)
+
+    # Models served from a local directory or bundle ("local-..." ids) have no registry run to compare with
+    if PROBE_VERIFY and model_version != "unknown" and not model_version.startswith("local-"):
+        expected = await asyncio.to_thread(reference_models.predict, model_version, rows)
+        errors = [abs(actual - reference) for actual, reference in zip(predictions, expected)]
+        prediction_max_abs_error.labels(model_version=model_version).set(max(errors, default=0.0))
+        mismatched = len(predictions) != len(expected) or any(
+            error > PROBE_VERIFY_ATOL + PROBE_VERIFY_RTOL * abs(reference) for error, reference in zip(errors, expected)
+        )
+        if mismatched:
+            prediction_requests_total.labels(status="mismatch", model_version=model_version).inc()
+            raise ValueError(f"Probe predictions for run {model_version} differ from the local reference (max error {max(errors, default=0.0):.4f})")
+
+    prediction_requests_total.labels(status="success", model_version=model_version).inc()
+
+
+async def collect_prediction_metrics(resources):
+    """Collect prediction-specific metrics with one synthetic batch per configured size"""
+    if resources.probe_rows is None:
+        resources.probe_rows = load_probe_rows(PROBE_DATASET)
+    rows = resources.probe_rows
+
+    semaphore = asyncio.Semaphore(PROBE_CONCURRENCY)
+    batches = [random.choices(rows, k=size) for size in PROBE_BATCH_SIZES]
+    results = await asyncio.gather(*(probe_batch(resources, batch, semaphore) for batch in batches), return_exceptions=True)
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if failures:
+        raise failures[0]
+
+
+# name -> (collect function, default interval seconds, default timeout seconds)
+COLLECTORS = {
+    "mlflow": (collect_mlflow_metrics, 60, 10),
+    "api": (collect_api_metrics, 15, 5),
+    "prediction": (collect_prediction_metrics, 60, 30),
+}
+
+
+async def run_collector(name, collect, interval, timeout, resources):
+    """Runs one collector forever on its own schedule."""
+    last_success = [time.time()]
+    collector_staleness_seconds.labels(collector=name).set_function(lambda: time.time() - last_success[0])
+
+    while True:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(collect(resources), timeout)
+            last_success[0] = time.time()
+            collector_last_success.labels(collector=name).set(last_success[0])
+            collector_runs_total.labels(collector=name, result="success").inc()
+        except asyncio.TimeoutError:
+            print(f"Collector '{name}' timed out after {timeout}s")
+            collector_runs_total.labels(collector=name, result="timeout").inc()
+        except Exception as e:
+            print(f"Error in collector '{name}': {e}")
+            collector_runs_total.labels(collector=name, result="error").inc()
+        elapsed = time.perf_counter() - started
+        collector_duration_seconds.labels(collector=name).observe(elapsed)
+
+        await asyncio.sleep(max(0.0, interval - elapsed))
+
+
+async def run_collectors():
+    resources = Resources()
+    try:
+        tasks = []
+        for name, (collect, interval, timeout) in COLLECTORS.items():
+            interval = collector_setting(name, 'INTERVAL_SECONDS', interval)
+            timeout = collector_setting(name, 'TIMEOUT_SECONDS', timeout)
+            print(f"Collector '{name}': every {interval}s, timeout {timeout}s")
+            tasks.append(asyncio.create_task(run_collector(name, collect, interval, timeout, resources)))
+        await asyncio.gather(*tasks)
+    finally:
+        await resources.close()
+
 
 def main():
     """Main function"""
     print("Starting Car Price Prediction Metrics Exporter...")
-    
+
     # Start Prometheus HTTP server
-    start_http_server(8003)
-    print("Car Price Prediction Metrics Exporter started on port 8003")
-    
-    # Collect metrics every 60 seconds
-    while True:
-        try:
-            collect_mlflow_metrics()
-            collect_api_metrics()
-            collect_prediction_metrics()
-            print("Metrics collected successfully")
-        except Exception as e:
-            print(f"Error in main loop: {e}")
-        
-        time.sleep(60)
+    start_http_server(EXPORTER_PORT)
+    print(f"Car Price Prediction Metrics Exporter started on port {EXPORTER_PORT}")
+
+    asyncio.run(run_collectors())
 
 if __name__ == "__main__":
     main()
@@ -2,82 +2,265 @@
 """
 MLflow Exporter for Prometheus
 Exposes MLflow metrics in Prometheus format
+
+The tracking database is read incrementally: each cycle only fetches runs, model versions
+and registered models created since the last high-water mark (plus a short overlap window
+for rows committed late), over a persistent connection pool. The aggregates are kept in
+memory and rendered by a custom collector at scrape time, so scrapes never touch Postgres.
+A full re-read every EXPORTER_RECONCILE_SECONDS picks up rows removed by `mlflow gc`.
 """
 
 import os
+import threading
 import time
 import psycopg2
-from prometheus_client import start_http_server, Gauge, Counter, Histogram
-from prometheus_client.core import REGISTRY
-
-# Prometheus metrics
-mlflow_runs_total = Counter('mlflow_runs_total', 'Total number of MLflow runs', ['experiment_name'])
-mlflow_models_total = Counter('mlflow_models_total', 'Total number of MLflow models', ['experiment_name'])
-mlflow_artifacts_total = Counter('mlflow_artifacts_total', 'Total number of MLflow artifacts', ['experiment_name'])
-mlflow_experiments_total = Gauge('mlflow_experiments_total', 'Total number of MLflow experiments')
-
-# Database connection
-def get_db_connection():
-    return psycopg2.connect(
+import psycopg2.pool
+from prometheus_client import start_http_server
+from prometheus_client.core import REGISTRY, CounterMetricFamily, GaugeMetricFamily
+
+# Exporter configuration
+EXPORTER_PORT = int(os.getenv('EXPORTER_PORT', 8000))
+EXPORTER_INTERVAL_SECONDS = float(os.getenv('EXPORTER_INTERVAL_SECONDS', 30))
+EXPORTER_RECONCILE_SECONDS = float(os.getenv('EXPORTER_RECONCILE_SECONDS', 3600))
+# Rows are re-read this far behind the high-water mark, for transactions that commit late
+EXPORTER_LOOKBACK_MS = int(os.getenv('EXPORTER_LOOKBACK_MS', 5 * 60 * 1000))
+EXPORTER_DB_POOL_SIZE = int(os.getenv('EXPORTER_DB_POOL_SIZE', 2))
+EXPORTER_STATEMENT_TIMEOUT_MS = int(os.getenv('EXPORTER_STATEMENT_TIMEOUT_MS', 10000))
+# MLflow doesn't index these timestamps; opt in to let the incremental queries use an index
+EXPORTER_CREATE_INDEXES = os.getenv('EXPORTER_CREATE_INDEXES', 'false').lower() == 'true'
+
+# Incremental queries; %(since)s is NULL for a full read
+RUNS_QUERY = """
+    SELECT run_uuid, experiment_id, start_time
+    FROM runs
+    WHERE %(since)s IS NULL OR start_time >= %(since)s
+"""
+MODEL_VERSIONS_QUERY = """
+    SELECT mv.name || '/' || mv.version, mv.name, r.experiment_id, mv.creation_time
+    FROM model_versions mv
+    LEFT JOIN runs r ON r.run_uuid = mv.run_id
+    WHERE %(since)s IS NULL OR mv.creation_time >= %(since)s
+"""
+REGISTERED_MODELS_QUERY = """
+    SELECT name, creation_time
+    FROM registered_models
+    WHERE %(since)s IS NULL OR creation_time >= %(since)s
+"""
+INDEX_STATEMENTS = [
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS mlflow_exporter_runs_start_time ON runs (start_time)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS mlflow_exporter_model_versions_creation_time ON model_versions (creation_time)",
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS mlflow_exporter_registered_models_creation_time ON registered_models (creation_time)",
+]
+
+
+# Database connection pool
+def create_connection_pool():
+    return psycopg2.pool.ThreadedConnectionPool(
+        1,
+        EXPORTER_DB_POOL_SIZE,
         host=os.getenv('POSTGRES_HOST', 'postgres'),
         port=os.getenv('POSTGRES_PORT', 5432),
         database=os.getenv('POSTGRES_DB', 'mlflow'),
         user=os.getenv('POSTGRES_USER', 'mlflow'),
-        password=os.getenv('POSTGRES_PASSWORD', 'mlflow123')
+        password=os.getenv('POSTGRES_PASSWORD', 'mlflow123'),
+        application_name='mlflow-exporter',
+        options=f'-c statement_timeout={EXPORTER_STATEMENT_TIMEOUT_MS}'
     )
 
-def collect_metrics():
-    """Collect metrics from MLflow database"""
+
+class HighWaterMark:
+    """
+    Tracks how far a table has been read by a creation timestamp.
+
+    Reads restart `lookback_ms` before the mark so rows committed late are still seen;
+    keys read inside that window are remembered so overlapping rows are counted once.
+    """
+
+    def __init__(self, lookback_ms):
+        self.lookback_ms = lookback_ms
+        self.mark = None
+        self._recent = {}
+
+    def since(self):
+        return None if self.mark is None else self.mark - self.lookback_ms
+
+    def accept(self, key, timestamp):
+        """Returns True the first time a row is seen."""
+        if key in self._recent:
+            return False
+        if timestamp is not None:
+            self.mark = timestamp if self.mark is None else max(self.mark, timestamp)
+            self._recent[key] = timestamp
+        return True
+
+    def prune(self):
+        since = self.since()
+        if since is not None:
+            self._recent = {key: ts for key, ts in self._recent.items() if ts >= since}
+
+
+class MlflowState:
+    """In-memory aggregates of the tracking database, updated with deltas."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+        self.up = 0
+        self.last_success = 0.0
+        self.last_duration = 0.0
+        self.errors = 0
+
+    def reset(self):
+        self.experiments = {}
+        self.runs_per_experiment = {}
+        self.models_per_experiment = {}
+        self.registered_models = 0
+        self.runs_mark = HighWaterMark(EXPORTER_LOOKBACK_MS)
+        self.versions_mark = HighWaterMark(EXPORTER_LOOKBACK_MS)
+        self.models_mark = HighWaterMark(EXPORTER_LOOKBACK_MS)
+
+
+class MlflowCollector:
+    """Renders the current aggregates when Prometheus scrapes."""
+
+    def __init__(self, state):
+        self.state = state
+
+    def collect(self):
+        state = self.state
+        with state.lock:
+            experiments = dict(state.experiments)
+            runs = dict(state.runs_per_experiment)
+            models = {experiment_id: len(names) for experiment_id, names in state.models_per_experiment.items()}
+            registered_models = state.registered_models
+            up, last_success, last_duration, errors = state.up, state.last_success, state.last_duration, state.errors
+
+        yield GaugeMetricFamily('mlflow_experiments_total', 'Total number of MLflow experiments', value=len(experiments))
+
+        runs_family = GaugeMetricFamily('mlflow_runs_total', 'Total number of MLflow runs', labels=['experiment_name'])
+        models_family = GaugeMetricFamily('mlflow_models_total', 'Registered models with a version logged from the experiment', labels=['experiment_name'])
+        for experiment_id, name in experiments.items():
+            runs_family.add_metric([name], runs.get(experiment_id, 0))
+            models_family.add_metric([name], models.get(experiment_id, 0))
+        yield runs_family
+        yield models_family
+
+        yield GaugeMetricFamily('mlflow_registered_models_total', 'Total number of registered models', value=registered_models)
+        yield GaugeMetricFamily('mlflow_exporter_up', 'Whether the last collection cycle succeeded', value=up)
+        yield GaugeMetricFamily('mlflow_exporter_last_success_timestamp_seconds', 'Time of the last successful collection cycle', value=last_success)
+        yield GaugeMetricFamily('mlflow_exporter_collect_duration_seconds', 'Duration of the last collection cycle', value=last_duration)
+        yield CounterMetricFamily('mlflow_exporter_collect_errors', 'Failed collection cycles since the exporter started', value=errors)
+
+
+def fetch(cursor, query, since):
+    cursor.execute(query, {'since': since})
+    return cursor.fetchall()
+
+
+def collect_metrics(pool, state, full=False):
+    """Applies everything created since the last cycle (or re-reads it all when `full`) to `state`."""
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cursor:
+            # The experiments table is tiny and gives the id -> name mapping
+            cursor.execute("SELECT experiment_id, name FROM experiments")
+            experiments = dict(cursor.fetchall())
+
+            if full:
+                runs_mark, versions_mark, models_mark = (HighWaterMark(EXPORTER_LOOKBACK_MS) for _ in range(3))
+            else:
+                runs_mark, versions_mark, models_mark = state.runs_mark, state.versions_mark, state.models_mark
+            new_runs = fetch(cursor, RUNS_QUERY, runs_mark.since())
+            new_versions = fetch(cursor, MODEL_VERSIONS_QUERY, versions_mark.since())
+            new_models = fetch(cursor, REGISTERED_MODELS_QUERY, models_mark.since())
+    finally:
+        # End the read transaction so a pooled connection never sits idle in it
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass
+        pool.putconn(conn, close=bool(conn.closed))
+
+    with state.lock:
+        if full:
+            state.reset()
+            state.runs_mark, state.versions_mark, state.models_mark = runs_mark, versions_mark, models_mark
+        state.experiments = experiments
+
+        for run_uuid, experiment_id, start_time in new_runs:
+            if state.runs_mark.accept(run_uuid, start_time):
+                state.runs_per_experiment[experiment_id] = state.runs_per_experiment.get(experiment_id, 0) + 1
+        for version_key, model_name, experiment_id, creation_time in new_versions:
+            if state.versions_mark.accept(version_key, creation_time) and experiment_id is not None:
+                state.models_per_experiment.setdefault(experiment_id, set()).add(model_name)
+        for model_name, creation_time in new_models:
+            if state.models_mark.accept(model_name, creation_time):
+                state.registered_models += 1
+
+        for mark in (state.runs_mark, state.versions_mark, state.models_mark):
+            mark.prune()
+
+    return len(new_runs) + len(new_versions) + len(new_models)
+
+
+def create_indexes(pool):
+    conn = pool.getconn()
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Count experiments
-        cursor.execute("SELECT COUNT(*) FROM experiments")
-        experiments_count = cursor.fetchone()[0]
-        mlflow_experiments_total.set(experiments_count)
-        
-        # Count runs per experiment
-        cursor.execute("""
-            SELECT e.name, COUNT(r.run_uuid) 
-            FROM experiments e 
-            LEFT JOIN runs r ON e.experiment_id = r.experiment_id 
-            GROUP BY e.experiment_id, e.name
-        """)
-        
-        for experiment_name, run_count in cursor.fetchall():
-            mlflow_runs_total.labels(experiment_name=experiment_name).inc(run_count)
-        
-        # Count models per experiment
-        cursor.execute("""
-            SELECT e.name, COUNT(DISTINCT rm.name) 
-            FROM experiments e 
-            LEFT JOIN runs r ON e.experiment_id = r.experiment_id 
-            LEFT JOIN registered_models rm ON rm.name LIKE '%' || e.name || '%'
-            GROUP BY e.experiment_id, e.name
-        """)
-        
-        for experiment_name, model_count in cursor.fetchall():
-            mlflow_models_total.labels(experiment_name=experiment_name).inc(model_count)
-        
-        cursor.close()
-        conn.close()
-        
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            for statement in INDEX_STATEMENTS:
+                cursor.execute(statement)
+        print("Timestamp indexes for incremental queries are in place")
     except Exception as e:
-        print(f"Error collecting metrics: {e}")
+        print(f"Could not create timestamp indexes: {e}")
+    finally:
+        conn.autocommit = False
+        pool.putconn(conn)
+
 
 def main():
     """Main function"""
     print("Starting MLflow Exporter...")
-    
+
+    state = MlflowState()
+    REGISTRY.register(MlflowCollector(state))
+
     # Start Prometheus HTTP server
-    start_http_server(8000)
-    print("MLflow Exporter started on port 8000")
-    
-    # Collect metrics every 30 seconds
+    start_http_server(EXPORTER_PORT)
+    print(f"MLflow Exporter started on port {EXPORTER_PORT}")
+
+    pool = None
+    last_reconcile = 0.0
     while True:
-        collect_metrics()
-        time.sleep(30)
+        started = time.time()
+        try:
+            if pool is None:
+                pool = create_connection_pool()
+                if EXPORTER_CREATE_INDEXES:
+                    create_indexes(pool)
+
+            full = started - last_reconcile >= EXPORTER_RECONCILE_SECONDS
+            rows = collect_metrics(pool, state, full=full)
+            if full:
+                last_reconcile = started
+                print(f"Full reconciliation read {rows} rows")
+
+            with state.lock:
+                state.up = 1
+                state.last_success = time.time()
+                state.last_duration = state.last_success - started
+        except Exception as e:
+            print(f"Error collecting metrics: {e}")
+            with state.lock:
+                state.up = 0
+                state.errors += 1
+            if pool is not None and isinstance(e, psycopg2.OperationalError):
+                # Start over with fresh connections once the database is reachable again
+                pool.closeall()
+                pool = None
+
+        time.sleep(max(0.0, EXPORTER_INTERVAL_SECONDS - (time.time() - started)))
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()